@@ -0,0 +1,134 @@
+"""
+    指令分派开销的微基准测试
+
+    比较两种分派方式下每条指令的分派开销：
+        - 分派链：按原 run_command 中 if segment[0] == ... 的顺序逐个比较助记符
+        - 查表：按译码时确定的操作码直接取出处理函数
+
+    两种方式都以一次函数调用 dispatch(...) 完成，计时中的调用开销相同，差值只来自分派本身。
+
+    分派所用的指令序列取自实际运行一个示例程序时执行过的指令，因此两种方式的开销按真实的指令频率加权。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.dispatch [C源文件] [重复次数]
+"""
+import sys
+import time
+
+from compiler import driver, interpreter
+
+# 原 run_command 中比较助记符的顺序
+ELIF_CHAIN_ORDER = ["push", "pop", "add", "sub", "imul", "idiv", "cqo", "cmp",
+                    "sete", "setne", "setl", "setle", "movzb", "movsx", "movss", "movsd", "movsxd",
+                    "mov", "lea", "and", "or", "xor", "not", "shl", "shr", "sar", "sal",
+                    "print", "jmp", "jnz", "je", "jne", "call", "ret"]
+
+
+def record_trace(assembly):
+    """
+    运行一遍程序，记录每条被执行指令的操作码
+    """
+    trace = []
+
+    def recorded(handler):
+        def wrapper(machine, instruction):
+            trace.append(instruction.op)
+            handler(machine, instruction)
+
+        return wrapper
+
+    # 分派链只认识原有的助记符，记录时关闭超级指令融合
+    fuse = interpreter.FUSE_SUPERINSTRUCTIONS
+    interpreter.FUSE_SUPERINSTRUCTIONS = False
+    try:
+        machine = interpreter.Machine()
+        program = machine.load(assembly)
+    finally:
+        interpreter.FUSE_SUPERINSTRUCTIONS = fuse
+    for instruction in program:
+        instruction.handler = recorded(instruction.handler)
+    machine.run()
+    return [op for op in trace if interpreter.instruction_names[op] in ELIF_CHAIN_ORDER]
+
+
+def build_elif_chain():
+    """
+    生成与原 run_command 结构相同的 if/elif 分派链
+    """
+    lines = ["def dispatch(name):"]
+    for i, name in enumerate(ELIF_CHAIN_ORDER):
+        keyword = "if" if i == 0 else "elif"
+        lines.append("    %s name == %r:" % (keyword, name))
+        lines.append("        return handlers[%d]" % interpreter.opcode_table[name])
+    namespace = {"handlers": interpreter.instruction_handlers}
+    exec("\n".join(lines), namespace)
+    return namespace["dispatch"]
+
+
+def build_table_lookup():
+    """
+    生成按操作码查表的分派函数，与分派链同样经过一次函数调用，两者的差只在于分派本身
+    """
+    namespace = {"handlers": interpreter.instruction_handlers}
+    exec("def dispatch(op):\n    return handlers[op]", namespace)
+    return namespace["dispatch"]
+
+
+def time_elif_chain(names, repeat):
+    dispatch = build_elif_chain()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            dispatch(name)
+    return time.perf_counter() - start
+
+
+def time_table(ops, repeat):
+    dispatch = build_table_lookup()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for op in ops:
+            dispatch(op)
+    return time.perf_counter() - start
+
+
+def time_empty_loop(ops, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for op in ops:
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "example/rsa.c"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with open(path, encoding="utf-8") as f:
+        assembly = driver.compileSource(f.read())
+
+    ops = record_trace(assembly)
+    names = [interpreter.instruction_names[op] for op in ops]
+    count = len(ops) * repeat
+
+    baseline = time_empty_loop(ops, repeat)
+    chain = time_elif_chain(names, repeat) - baseline
+    table = time_table(ops, repeat) - baseline
+
+    print("程序: %s, 执行指令数: %d, 重复: %d 次" % (path, len(ops), repeat))
+    print("分派链: %8.1f ns/指令" % (chain / count * 1e9))
+    print("查表:   %8.1f ns/指令" % (table / count * 1e9))
+
+    print("\n按助记符统计（分派链 / 查表, ns/指令）:")
+    for name in sorted(set(names), key=ELIF_CHAIN_ORDER.index):
+        op = interpreter.opcode_table[name]
+        single = [name] * 10000
+        single_ops = [op] * 10000
+        empty = time_empty_loop(single_ops, repeat)
+        chain = time_elif_chain(single, repeat) - empty
+        table = time_table(single_ops, repeat) - empty
+        print("  %-8s %8.1f / %6.1f" % (name, chain / (10000 * repeat) * 1e9, table / (10000 * repeat) * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+    以不同输入反复运行同一程序时的准备开销基准测试
+
+    比较两种为每次运行准备虚拟机的方式：
+        - 重新装载：每次运行都调用 load，重新译码、装入数据段并登记标签
+        - 快照恢复：装载一次后取快照，每次运行由快照创建虚拟机，只需逐页拷贝内存
+
+    两种方式对每个输入运行程序，并核对输出是否一致。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.fork [C源文件] [输入个数]
+"""
+import sys
+import time
+
+from compiler import interpreter, batch
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "example/fibonacci.c"
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with open(path, encoding='utf-8') as f:
+        assembly = batch.compileSource(f.read())
+    inputs = [str(i % 8) for i in range(runs)]
+
+    setup = 0.0
+    start = time.perf_counter()
+    reloaded = []
+    for stdin in inputs:
+        begin = time.perf_counter()
+        machine = interpreter.Machine(stdin=stdin)
+        machine.load(assembly)
+        setup += time.perf_counter() - begin
+        reloaded.append(machine.run())
+    reload_total = time.perf_counter() - start
+    reload_setup = setup
+
+    setup = 0.0
+    start = time.perf_counter()
+    loaded = interpreter.Machine()
+    loaded.load(assembly)
+    snapshot = loaded.snapshot()
+    setup += time.perf_counter() - start
+    forked = []
+    for stdin in inputs:
+        begin = time.perf_counter()
+        machine = snapshot.machine(stdin=stdin)
+        setup += time.perf_counter() - begin
+        forked.append(machine.run())
+    fork_total = time.perf_counter() - start
+
+    if reloaded != forked:
+        raise RuntimeError("快照恢复的运行结果与重新装载不一致")
+
+    print("%s, %d runs, %d assembly lines" % (path, runs, len(assembly.split("\n"))))
+    print("%-10s %12s %12s %14s" % ("", "total(s)", "setup(s)", "setup/run(us)"))
+    print("%-10s %12.3f %12.4f %14.1f" % ("reload", reload_total, reload_setup, reload_setup / runs * 1e6))
+    print("%-10s %12.3f %12.4f %14.1f" % ("snapshot", fork_total, setup, setup / runs * 1e6))
+
+
+if __name__ == '__main__':
+    main()
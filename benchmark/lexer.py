@@ -0,0 +1,65 @@
+"""
+    词法分析吞吐量基准测试
+
+    将 example 目录中能通过词法分析的示例程序拼接起来，重复到指定的行数作为语料，
+    测量 tokenize.tokenize 每秒处理的token数与行数，以及在语料中间逐个字符输入时
+    TokenStream.edit 增量更新每次按键的耗时。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.lexer [行数] [重复次数]
+"""
+import glob
+import sys
+import time
+
+from compiler import tokenize
+
+
+def corpus(lines):
+    sources = []
+    for path in sorted(glob.glob("example/*.c")):
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+        try:
+            tokenize.tokenize(source)
+        except RuntimeError:
+            continue  # 含有尚不支持的语法
+        sources.append(source)
+    text = "\n".join(sources) + "\n"
+    return text * (lines // text.count("\n") + 1)
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    source = corpus(lines)
+
+    best = None
+    tokens = 0
+    for t in range(repeat):
+        start = time.perf_counter()
+        stream = tokenize.tokenize(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        tokens = len(stream)
+
+    # 在中间某一行的开头逐个字符输入一条语句
+    typed = "x = x + 1;\n" * 20
+    offset = source.index("\n", len(source) // 2) + 1
+    start = time.perf_counter()
+    for i, c in enumerate(typed):
+        stream.edit(offset + i, 0, c)
+    keystroke = (time.perf_counter() - start) / len(typed)
+    stream.settle()
+    if [(t.kind, t.str, t.loc, t.line, t.col) for t in stream] != \
+            [(t.kind, t.str, t.loc, t.line, t.col) for t in tokenize.tokenize(stream.source)]:
+        raise RuntimeError("增量更新的结果与重新分析不一致")
+
+    print("%d lines, %d bytes, %d tokens" % (source.count("\n"), len(source), tokens))
+    print("%-12s %12s %14s %12s" % ("", "time(ms)", "tokens/s", "lines/s"))
+    print("%-12s %12.1f %14.0f %12.0f" % ("tokenize", best * 1e3, tokens / best, source.count("\n") / best))
+    print("%-12s %12.3f %14s %12s" % ("keystroke", keystroke * 1e3, "", ""))
+
+
+if __name__ == '__main__':
+    main()
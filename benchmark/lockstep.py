@@ -0,0 +1,80 @@
+"""
+    锁步批量执行的吞吐量基准测试
+
+    以同一个程序与多组输入比较两种运行方式：
+        - 逐个运行：由装载后的快照为每组输入创建虚拟机，逐条解释执行
+        - 锁步执行：lockstep.run 以全部输入同时运行，每条指令对所有通道只分派一次
+
+    两种方式的输出与执行的指令数须一致。需要 NumPy。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.lockstep [C源文件] [输入组数]
+"""
+import sys
+import time
+
+from compiler import interpreter, batch, lockstep
+
+SOURCE = """
+int collatz(int n) {
+    int steps = 0;
+    while (n != 1) {
+        if (n % 2 == 0) n = n / 2;
+        else n = 3 * n + 1;
+        steps = steps + 1;
+    }
+    return steps;
+}
+int main() {
+    int n;
+    int i;
+    int total = 0;
+    read(&n);
+    i = 1;
+    while (i <= 20) {
+        total = total + collatz(n + i);
+        i = i + 1;
+    }
+    write(total);
+    return 0;
+}
+"""
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] != '-':
+        with open(sys.argv[1], encoding='utf-8') as f:
+            source = f.read()
+    else:
+        source = SOURCE
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    assembly = batch.compileSource(source)
+    inputs = [str(i % 64 + 1) for i in range(count)]
+
+    start = time.perf_counter()
+    machine = interpreter.Machine()
+    machine.load(assembly)
+    snapshot = machine.snapshot()
+    outputs = []
+    executed = []
+    for stdin in inputs:
+        single = snapshot.machine(stdin=stdin)
+        outputs.append(single.run())
+        executed.append(single.executed)
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = lockstep.run(assembly, [[stdin] for stdin in inputs])
+    lockstep_time = time.perf_counter() - start
+
+    if result.outputs != outputs or result.executed.tolist() != executed:
+        raise RuntimeError("锁步执行的结果与逐个运行不一致")
+
+    print("%d inputs, %d instructions per input on average" % (count, sum(executed) // count))
+    print("%-10s %10s %14s %10s" % ("", "total(s)", "per input(us)", "speedup"))
+    for name, elapsed in (("single", single_time), ("lockstep", lockstep_time)):
+        print("%-10s %10.3f %14.1f %9.1fx" % (name, elapsed, elapsed / count * 1e6, single_time / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+    本机执行基准测试
+
+    以同一段汇编代码与同一组输入比较：
+        - 解释器：Machine.run，翻译执行
+        - 本机：native.build 构建一次后以子进程运行，计入进程创建的开销
+
+    两者的输出须一致，构建时间单独列出。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.native [重复次数]
+"""
+import sys
+import tempfile
+import time
+
+from compiler import interpreter, batch, native
+
+SOURCE = """
+long long collatz(long long n) {
+    long long steps;
+    steps = 0;
+    while (n != 1) {
+        if (n % 2 == 0) {
+            n = n / 2;
+        } else {
+            n = 3 * n + 1;
+        }
+        steps = steps + 1;
+    }
+    return steps;
+}
+
+int main() {
+    long long n;
+    long long i;
+    long long total;
+    read(&n);
+    total = 0;
+    for (i = 1; i <= n; i++) {
+        total = total + collatz(i);
+    }
+    write(total);
+    return 0;
+}
+"""
+
+
+def measure(run, repeat):
+    best = None
+    for t in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(assembly, program, built, repeat):
+    print("build %.1f ms" % (built * 1e3))
+    print("%-8s %14s %12s %10s" % ("n", "interpreter(s)", "native(ms)", "speedup"))
+    for n in (100, 1000, 2000):
+        check = native.crossCheck(assembly, [n], program)
+        if not check.matches():
+            raise RuntimeError("本机运行结果与解释器不一致:\n%s" % check.report())
+        interpreted = measure(lambda: interpreter.Machine(stdin=[n]).run(assembly), repeat)
+        compiled = measure(lambda: program.run([n]), repeat)
+        print("%-8d %14.3f %12.2f %9.0fx" % (n, interpreted, compiled * 1e3, interpreted / compiled))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    if not native.available():
+        print("native backend unavailable: needs x86-64 Linux and %s" % native.COMPILER)
+        return
+
+    assembly = batch.compileSource(SOURCE)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        program = native.build(assembly, directory)
+        built = time.perf_counter() - start
+        compare(assembly, program, built, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+    装载开销基准测试
+
+    比较三种让虚拟机进入可运行状态的方式：
+        - 文本装载：load 解析汇编代码、译码、装入数据段并登记标签
+        - 目标文件：读取 objfile 写出的目标文件，只做反序列化
+        - 缓存命中：LoadCache 命中内存中的快照，只需恢复快照
+
+    三种方式装载后各运行一次程序，并核对输出是否一致。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.objload [C源文件] [重复次数]
+"""
+import sys
+import time
+
+from compiler import interpreter, batch, objfile
+
+
+def measure(load, repeat):
+    best = None
+    for t in range(3):
+        start = time.perf_counter()
+        for i in range(repeat):
+            load()
+        elapsed = (time.perf_counter() - start) / repeat
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "example/rsa.c"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with open(path, encoding='utf-8') as f:
+        assembly = batch.compileSource(f.read())
+
+    machine = interpreter.Machine()
+    machine.load(assembly)
+    data = objfile.dumpObject(machine, assembly)
+    cache = objfile.LoadCache()
+    cache.load(interpreter.Machine(), assembly)
+
+    outputs = []
+    for load in (lambda m: m.load(assembly), lambda m: objfile.loadObject(m, data),
+                 lambda m: cache.load(m, assembly)):
+        machine = interpreter.Machine(stdin="7\n")
+        load(machine)
+        outputs.append(machine.run())
+    if outputs[1:] != outputs[:-1]:
+        raise RuntimeError("目标文件或缓存装载的运行结果与文本装载不一致")
+
+    text = measure(lambda: interpreter.Machine().load(assembly), repeat)
+    obj = measure(lambda: objfile.loadObject(interpreter.Machine(), data), repeat)
+    hit = measure(lambda: cache.load(interpreter.Machine(), assembly), repeat)
+
+    print("%s, %d assembly lines, object file %d bytes" % (path, len(assembly.split("\n")), len(data)))
+    print("%-12s %12s %10s" % ("", "load(ms)", "speedup"))
+    for name, elapsed in (("text", text), ("object", obj), ("cache hit", hit)):
+        print("%-12s %12.3f %9.1fx" % (name, elapsed * 1e3, text / elapsed))
+
+
+if __name__ == '__main__':
+    main()
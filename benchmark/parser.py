@@ -0,0 +1,58 @@
+"""
+    语法分析基准测试
+
+    生成一个有数千个全局变量、每个函数有数十个局部变量的程序，测量 Parser.program 的耗时。
+    每次引用标识符都要在符号表中查找，符号表的查找开销随已声明的名字增多而增长时，耗时会明显上升。
+
+    用法（在仓库根目录下执行）：
+        python -m benchmark.parser [全局变量数] [函数数] [每个函数的局部变量数]
+"""
+import sys
+import time
+
+from compiler import tokenize, parse
+
+
+def generate(globals, functions, locals):
+    lines = ["int g%d;" % i for i in range(globals)]
+    for f in range(functions):
+        lines.append("int f%d(int a) {" % f)
+        lines.extend("    int v%d;" % i for i in range(locals))
+        for i in range(locals):
+            lines.append("    v%d = a + g%d + v%d;" % (i, (f * locals + i) % globals, (i + 1) % locals))
+        lines.append("    return v0;")
+        lines.append("}")
+    lines.append("int main() {")
+    lines.append("    return f0(1);")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def parseOnce(stream):
+    stream.pos = 0
+    return parse.Parser(stream).program()
+
+
+def main():
+    globals = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    functions = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    locals = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    source = generate(globals, functions, locals)
+    stream = tokenize.tokenize(source)
+    identifiers = sum(1 for tok in stream if tok.kind == tokenize.TokenKind.TK_IDENT)
+
+    best = None
+    for t in range(3):
+        start = time.perf_counter()
+        parseOnce(stream)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("%d globals, %d functions x %d locals, %d lines, %d tokens, %d identifiers" % (
+        globals, functions, locals, source.count("\n"), len(stream), identifiers))
+    print("%-12s %12s %16s" % ("", "time(ms)", "identifiers/s"))
+    print("%-12s %12.1f %16.0f" % ("parse", best * 1e3, identifiers / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+    批量编译运行
+
+    将大量 C 源文件分发到进程池中编译并解释执行，每完成一个作业即以一行 JSON 输出结果，
+    包含程序输出、墙钟时间与执行的指令数。工作进程在启动时预热，此后复用于所有作业。
+
+    作业来源：
+        - 目录：目录下所有 .c 文件，同名的 .in 文件（如 fibonacci.in）作为该程序的标准输入
+        - 清单：每行一个 JSON 对象，{"source": "a.c", "stdin": "12\n", "name": "a"}，
+          source 为相对清单所在目录的路径，stdin 与 name 可省略
+
+    用法（在仓库根目录下执行）：
+        python -m compiler.batch example -j 8 > results.jsonl
+        python -m compiler.batch jobs.jsonl --interpret --max-instructions 10000000 --timeout 5
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from compiler import driver, interpreter, translate
+
+
+class Job:
+    """
+    批量运行的一个作业
+    :param name: 作业名，原样写入结果
+    :param path: C 源文件路径
+    :param stdin: 标准输入，每行供一次 read 调用
+    """
+
+    def __init__(self, name, path, stdin=''):
+        self.name = name
+        self.path = path
+        self.stdin = stdin
+
+
+def loadJobs(path):
+    """
+    从目录或清单文件读取作业列表
+    :param path: 目录或清单文件路径
+    :return: 作业列表
+    """
+    if os.path.isdir(path):
+        jobs = []
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.endswith('.c'):
+                continue
+            source = os.path.join(path, file_name)
+            stdin = ''
+            stdin_path = source[:-2] + '.in'
+            if os.path.exists(stdin_path):
+                with open(stdin_path, encoding='utf-8') as f:
+                    stdin = f.read()
+            jobs.append(Job(file_name[:-2], source, stdin))
+        return jobs
+
+    jobs = []
+    base = os.path.dirname(path)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            entry = json.loads(line)
+            source = os.path.join(base, entry['source'])
+            name = entry.get('name', os.path.splitext(os.path.basename(source))[0])
+            jobs.append(Job(name, source, entry.get('stdin', '')))
+    return jobs
+
+
+def compileSource(source):
+    """
+    将 C 源代码编译为汇编代码，过程与 CompileController.compile 相同
+    每次编译都使用新的 Compiler，结果与作业在哪个进程、以何种顺序运行无关
+    """
+    return driver.compileSource(source)
+
+
+def runJob(job, translated=True, limits=None):
+    """
+    编译并运行一个作业，在工作进程中执行
+    :param job: 作业
+    :param translated: 是否使用基本块翻译执行
+    :param limits: 虚拟机的限额，如 {"max_instructions": 10 ** 7, "max_time": 5}
+    :return: 结果字典，可直接序列化为 JSON；超出限额时 limit 与 function 字段给出超出的限额与当时运行的函数
+    """
+    result = {"name": job.name, "source": job.path, "ok": False}
+    machine = None
+    console = io.StringIO()  # 解释器直接打印的提示信息
+    start = time.perf_counter()
+    stage = "compile"
+    try:
+        with contextlib.redirect_stdout(console):
+            with open(job.path, encoding='utf-8') as f:
+                assembly = compileSource(f.read())
+            result["compile_time"] = time.perf_counter() - start
+
+            stage = "run"
+            machine = interpreter.Machine(stdin=job.stdin, **(limits or {}))
+            machine.load(assembly)
+            if translated:
+                translate.execute(machine)
+            else:
+                machine.run()
+        result["ok"] = True
+    except interpreter.BudgetExceeded as e:
+        result["stage"] = stage
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+        result["limit"] = e.limit
+        result["function"] = e.function
+    except Exception as e:
+        result["stage"] = stage
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    result["wall_time"] = time.perf_counter() - start
+    result["instructions"] = machine.executed if machine is not None else 0
+    result["output"] = machine.output if machine is not None else ''
+    if console.getvalue():
+        result["console"] = console.getvalue()
+    return result
+
+
+WARM_UP_SOURCE = """
+int main() {
+    int i=0;
+    while (i < 64) i = i + 1;
+    return i;
+}
+"""
+
+
+def warmUp():
+    """
+    工作进程的初始化函数：导入编译器并完整运行一次小程序，使各模块与缓存就绪
+    """
+    machine = interpreter.Machine()
+    machine.load(compileSource(WARM_UP_SOURCE))
+    translate.execute(machine, threshold=0)
+
+
+def runBatch(jobs, workers=None, translated=True, limits=None):
+    """
+    在进程池中运行作业，按完成顺序逐个产出结果
+    :param jobs: 作业列表
+    :param workers: 工作进程数，默认为 CPU 核数
+    :param translated: 是否使用基本块翻译执行
+    :param limits: 每个作业的限额，见 runJob
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=warmUp) as executor:
+        futures = [executor.submit(runJob, job, translated, limits) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m compiler.batch", description="批量编译运行 C 程序，以 JSON 行输出结果")
+    parser.add_argument("path", help="包含 .c 文件的目录，或 JSON 行格式的作业清单")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="工作进程数，默认为 CPU 核数")
+    parser.add_argument("--interpret", action="store_true", help="逐条解释执行，不使用基本块翻译")
+    parser.add_argument("--max-instructions", type=int, default=None, help="每个作业最多执行的指令数")
+    parser.add_argument("--timeout", type=float, default=None, help="每个作业最长的运行时间（秒）")
+    parser.add_argument("--max-memory", type=int, default=None, help="每个作业最多分配的内存（字节）")
+    args = parser.parse_args(argv)
+    limits = {"max_instructions": args.max_instructions, "max_time": args.timeout, "max_memory": args.max_memory}
+
+    jobs = loadJobs(args.path)
+    start = time.perf_counter()
+    failed = 0
+    for result in runBatch(jobs, args.jobs, not args.interpret, limits):
+        failed += not result["ok"]
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+    sys.stderr.write("%d jobs, %d failed, %.2fs\n" % (len(jobs), failed, time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
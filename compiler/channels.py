@@ -0,0 +1,168 @@
+"""
+    客户程序的输入输出通道
+
+    输入通道提供 request_input()，每次调用返回一个数值，供 read 使用：
+        - ConsoleInput：提示后从标准输入读取一行，不指定输入时的默认行为
+        - IteratorInput：从迭代器逐个取值，字符串按 parseInput 解析，数值原样使用
+        - StreamInput：从文本或二进制流（文件、管道、io.StringIO/io.BytesIO）逐行读取，跳过空行
+    实现了 request_input() 的对象（如图形界面的 CompileController）可直接作为输入通道。
+
+    输出通道提供 write(text) 与 flush()，虚拟机把输出攒成块后再写入通道：
+        - CallbackOutput：以每块文本调用回调函数
+        - StreamOutput：写入文本或二进制流（文件、管道、缓冲写入器）
+    不指定输出通道时，输出保存在虚拟机的 output 中。
+"""
+import io
+
+OUTPUT_CHUNK_SIZE = 8192  # 输出攒到多少个字符时写入输出通道
+
+
+def parseInput(userInput):
+    """
+    将一行输入解析为整数或浮点数，支持 0x 十六进制、0 开头的八进制与 b 开头的二进制
+    :param userInput: 一行输入
+    :return: 解析出的数值
+    """
+    try:
+        if userInput.isdigit():
+            return int(userInput)
+        elif userInput[0:2] == '0x':
+            return int(userInput, 16)
+        elif '.' in userInput:
+            return float(userInput)
+        elif 'e' in userInput or 'E' in userInput:
+            return float(userInput)
+        elif 'f' in userInput:
+            return float(userInput)
+        elif 'd' in userInput:
+            return float(userInput)
+        elif userInput[0] == '0':
+            return int(userInput[1:], 8)
+        elif userInput[0] == 'b':
+            return int(userInput[1:], 2)
+        else:
+            return int(userInput)
+    except ValueError:
+        raise RuntimeError("无法识别的输入: %s" % userInput)
+
+
+class ConsoleInput:
+    """
+    交互式输入，提示后从标准输入读取一行
+    """
+
+    def request_input(self):
+        print("请求输入：")
+        return parseInput(input())
+
+
+class IteratorInput:
+    """
+    从迭代器逐个取值作为输入
+    :param values: 可迭代对象，元素为数值或一行输入文本
+    """
+
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def request_input(self):
+        try:
+            value = next(self.values)
+        except StopIteration:
+            raise RuntimeError("输入已耗尽")
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('utf-8')
+        if isinstance(value, str):
+            return parseInput(value.strip())
+        return value
+
+
+class StreamInput:
+    """
+    从流中逐行读取输入，空行被跳过
+    :param stream: 文本或二进制流，需实现 readline()
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def request_input(self):
+        while True:
+            line = self.stream.readline()
+            if not line:
+                raise RuntimeError("输入已耗尽")
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if line != '':
+                return parseInput(line)
+
+
+def inputSource(source):
+    """
+    将各种形式的输入转换为输入通道
+    :param source: None（交互式输入）、实现 request_input() 的对象、文本、bytes、流或可迭代对象
+    :return: 输入通道
+    """
+    if source is None:
+        return ConsoleInput()
+    if hasattr(source, 'request_input'):
+        return source
+    if isinstance(source, str):
+        return StreamInput(io.StringIO(source))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return StreamInput(io.BytesIO(bytes(source)))
+    if hasattr(source, 'readline'):
+        return StreamInput(source)
+    if hasattr(source, '__iter__'):
+        return IteratorInput(source)
+    raise RuntimeError("无法作为输入的对象: %r" % (source,))
+
+
+class CallbackOutput:
+    """
+    以每块输出文本调用回调函数
+    :param callback: 接受一个字符串参数的函数
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+    def flush(self):
+        pass
+
+
+class StreamOutput:
+    """
+    将输出写入流，二进制流按 UTF-8 编码
+    :param stream: 文本或二进制流，需实现 write()
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.binary = isinstance(stream, (io.RawIOBase, io.BufferedIOBase))
+
+    def write(self, text):
+        self.stream.write(text.encode('utf-8') if self.binary else text)
+
+    def flush(self):
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+def outputSink(sink):
+    """
+    将各种形式的输出目标转换为输出通道
+    :param sink: None（保存在虚拟机中）、输出通道、流或回调函数
+    :return: 输出通道，sink 为None时返回None
+    """
+    if sink is None or isinstance(sink, (CallbackOutput, StreamOutput)):
+        return sink
+    if hasattr(sink, 'write'):
+        return StreamOutput(sink)
+    if callable(sink):
+        return CallbackOutput(sink)
+    raise RuntimeError("无法作为输出的对象: %r" % (sink,))
@@ -0,0 +1,90 @@
+"""
+    编译驱动
+
+    Compiler 将一段C源代码依次经过词法分析、语法分析、栈帧布局与代码生成编译为汇编代码。
+    一次编译的全部状态（token序列、Parser、CodeGenerator）都保存在实例中，不经过模块级的全局变量，
+    因此多个 Compiler 可以在多个线程、asyncio 的执行器或常驻的服务中同时编译，互不影响。
+
+    用法：
+        assembly = driver.Compiler().compile(source)
+"""
+from compiler import tokenize, parse, codegen, utils
+
+
+def layoutFrames(prog):
+    """
+    为每个函数的局部变量分配相对 rbp 的偏移，并计算栈帧的大小
+    :param prog: 语法分析得到的程序
+    """
+    fn = prog.fns
+    while fn is not None:
+        offset = 0
+        vl = fn.locals
+        while vl is not None:
+            offset += vl.var.ty.size
+            vl.var.offset = offset
+            vl = vl.next
+        fn.stack_size = utils.align_to(offset, 8)
+        fn = fn.next
+
+
+class Compiler:
+    """
+    编译器，保存一次编译各阶段的结果
+    同一个实例同一时刻只能进行一次编译，需要同时编译时各自使用新的实例
+    """
+
+    def __init__(self):
+        self.stream = None  # 词法分析的结果
+        self.prog = None  # 语法分析的结果
+        self.code = None  # 汇编代码
+        self.line_map = None  # 汇编代码每一行对应的源代码范围，见 CodeGenerator.line_map
+
+    def tokenize(self, source):
+        """
+        词法分析
+        :param source: C源代码
+        :return: token序列
+        """
+        self.stream = tokenize.tokenize(source)
+        return self.stream
+
+    def parse(self, stream=None):
+        """
+        语法分析并布局栈帧
+        :param stream: 要分析的token序列，默认为 tokenize 的结果，从头开始分析
+        :return: 程序
+        """
+        if stream is not None:
+            self.stream = stream
+        self.stream.pos = 0
+        self.prog = parse.Parser(self.stream).program()
+        layoutFrames(self.prog)
+        return self.prog
+
+    def codegen(self):
+        """
+        由 parse 的结果生成汇编代码
+        :return: 汇编代码
+        """
+        generator = codegen.CodeGenerator()
+        self.code = generator.codegen(self.prog)
+        self.line_map = generator.line_map
+        return self.code
+
+    def compile(self, source):
+        """
+        将C源代码编译为汇编代码
+        :param source: C源代码
+        :return: 汇编代码
+        """
+        self.tokenize(source)
+        self.parse()
+        return self.codegen()
+
+
+def compileSource(source):
+    """
+    用新的 Compiler 将C源代码编译为汇编代码
+    """
+    return Compiler().compile(source)
@@ -2,10 +2,16 @@
     Intel 80x86 模拟器
     用于模拟汇编代码的执行过程
 """
+import functools
 import struct
+import time
 from enum import Enum
 
-MEMORY_SIZE = 65536
+from compiler import channels
+
+MEMORY_SIZE = 65536  # 默认的地址空间大小
+PAGE_SIZE = 4096
+CALL_STACK_SIZE = 256  # 调用栈预先分配的层数，不够时加倍
 CompileController = None
 
 
@@ -14,6 +20,7 @@ class AddressingMode(Enum):
     IMMEDIATE = 0
     REGISTER = 1
     MEMORY = 2
+    OFFSET = 3  # 全局变量的地址，如 push offset x
 
 
 # 确定寻址模式
@@ -36,11 +43,12 @@ def addressing(source):
         return AddressingMode.IMMEDIATE
 
 # 根据寻址模式获取操作数的值
-def getValueByAddressing(AddressingMode, source):
+def getValueByAddressing(AddressingMode, source, registers=None):
     """
     根据寻址模式获取操作数的值
     :param AddressingMode: 寻址模式
     :param source: 源操作数
+    :param registers: 寄存器寻址时所读的寄存器文件
     :return value: 源操作数的值
     """
     if AddressingMode == AddressingMode.IMMEDIATE:
@@ -50,7 +58,7 @@ def getValueByAddressing(AddressingMode, source):
            return source
 
     elif AddressingMode == AddressingMode.REGISTER:
-        return Register_Table[source].get()
+        return Register_Table[source].get(registers)
 
     elif AddressingMode == AddressingMode.MEMORY:
         raise RuntimeError("在不确定大小的情况下无法获取内存值")
@@ -62,179 +70,281 @@ def getValueByAddressing(AddressingMode, source):
 MAX_64BIT_INT = 0x7FFFFFFFFFFFFFFF
 
 
+MAX_64BIT_UNSIGNED_INT = 0xFFFFFFFFFFFFFFFF
+
+# 寄存器文件的项数：每个64位通用寄存器以一个整数保存，标志位各占一项，另有一项保存惰性标志位
+REGISTER_FILE_SIZE = 21
+
+
 class Register:
-    shared_storage = [0 for t in range(256)]
+    """
+    寄存器视图，eax、ax、al 等子寄存器与 rax 共用寄存器文件中的同一项
+    所有子寄存器均为低位视图，读写只需一次掩码运算，写入时保留未覆盖的高位
+    寄存器视图本身不保存数值，读写的是传入的寄存器文件，因此可被多个虚拟机共用
+    :param name: 寄存器名
+    :param index: 在寄存器文件中的下标
+    :param size: 字节数
+    """
 
-    def __init__(self, name, pos, size):
+    def __init__(self, name, index, size):
         self.name = name
-        self.pos = pos
+        self.index = index
         self.size = size
+        self.mask = (1 << (size * 8)) - 1
+        self.keep = MAX_64BIT_UNSIGNED_INT & ~self.mask
+
+    def insert(self, registers, value):
+        registers[self.index] = registers[self.index] & self.keep | value & self.mask
 
-    def insert(self, value):
-        for i in range(self.size):
-            self.shared_storage[self.pos + i] = (value >> (i * 8)) & 0xFF
+    def get(self, registers):
+        return registers[self.index] & self.mask
 
-    def get(self):
-        value = 0
-        for i in range(self.size):
-            value += self.shared_storage[self.pos + i] << (i * 8)
-        return value
 
+# 常用寄存器在寄存器文件中的下标
+RAX = 0
+RSP = 1
+RDI = 3
+RDX = 5
+CF = 16
+OF = 17
+SF = 18
+ZF = 19
+FLAGS = 20  # 惰性标志位：最近一次 cmp 的差值，为None时标志位以 CF/OF/SF/ZF 四项为准
 
 Register_Table = {
     # 64bit寄存器
     "rax": Register("rax", 0, 8),
-    "rsp": Register("rsp", 8, 8),
-    "rbp": Register("rbp", 16, 8),
-    "rdi": Register("rdi", 24, 8),
-    "rsi": Register("rsi", 32, 8),
-    "rdx": Register("rdx", 40, 8),
-    "rcx": Register("rcx", 48, 8),
-    "r8": Register("r8", 56, 8),
-    "r9": Register("r9", 64, 8),
-    "rbx": Register("rbx", 72, 8),
-    "r10": Register("r10", 80, 8),
-    "r11": Register("r11", 88, 8),
-    "r12": Register("r12", 96, 8),
-    "r13": Register("r13", 104, 8),
-    "r14": Register("r14", 112, 8),
-    "r15": Register("r15", 120, 8),
+    "rsp": Register("rsp", 1, 8),
+    "rbp": Register("rbp", 2, 8),
+    "rdi": Register("rdi", 3, 8),
+    "rsi": Register("rsi", 4, 8),
+    "rdx": Register("rdx", 5, 8),
+    "rcx": Register("rcx", 6, 8),
+    "r8": Register("r8", 7, 8),
+    "r9": Register("r9", 8, 8),
+    "rbx": Register("rbx", 9, 8),
+    "r10": Register("r10", 10, 8),
+    "r11": Register("r11", 11, 8),
+    "r12": Register("r12", 12, 8),
+    "r13": Register("r13", 13, 8),
+    "r14": Register("r14", 14, 8),
+    "r15": Register("r15", 15, 8),
 
     # 32bit寄存器
     "eax": Register("eax", 0, 4),
-    "esp": Register("esp", 8, 4),
-    "ebp": Register("ebp", 16, 4),
-    "edi": Register("edi", 24, 4),
-    "esi": Register("esi", 32, 4),
-    "edx": Register("edx", 40, 4),
-    "ecx": Register("ecx", 48, 4),
-    "r8d": Register("r8d", 56, 4),
-    "r9d": Register("r9d", 64, 4),
-    "ebx": Register("ebx", 72, 4),
-    "r10d": Register("r10d", 80, 4),
-    "r11d": Register("r11d", 88, 4),
-    "r12d": Register("r12d", 96, 4),
-    "r13d": Register("r13d", 104, 4),
-    "r14d": Register("r14d", 112, 4),
-    "r15d": Register("r15d", 120, 4),
+    "esp": Register("esp", 1, 4),
+    "ebp": Register("ebp", 2, 4),
+    "edi": Register("edi", 3, 4),
+    "esi": Register("esi", 4, 4),
+    "edx": Register("edx", 5, 4),
+    "ecx": Register("ecx", 6, 4),
+    "r8d": Register("r8d", 7, 4),
+    "r9d": Register("r9d", 8, 4),
+    "ebx": Register("ebx", 9, 4),
+    "r10d": Register("r10d", 10, 4),
+    "r11d": Register("r11d", 11, 4),
+    "r12d": Register("r12d", 12, 4),
+    "r13d": Register("r13d", 13, 4),
+    "r14d": Register("r14d", 14, 4),
+    "r15d": Register("r15d", 15, 4),
 
     # 16bit寄存器
     "ax": Register("ax", 0, 2),
-    "sp": Register("sp", 8, 2),
-    "bp": Register("bp", 16, 2),
-    "di": Register("di", 24, 2),
-    "si": Register("si", 32, 2),
-    "dx": Register("dx", 40, 2),
-    "cx": Register("cx", 48, 2),
-    "r8w": Register("r8w", 56, 2),
-    "r9w": Register("r9w", 64, 2),
-    "bx": Register("bx", 72, 2),
-    "r10w": Register("r10w", 80, 2),
-    "r11w": Register("r11w", 88, 2),
-    "r12w": Register("r12w", 96, 2),
-    "r13w": Register("r13w", 104, 2),
-    "r14w": Register("r14w", 112, 2),
-    "r15w": Register("r15w", 120, 2),
+    "sp": Register("sp", 1, 2),
+    "bp": Register("bp", 2, 2),
+    "di": Register("di", 3, 2),
+    "si": Register("si", 4, 2),
+    "dx": Register("dx", 5, 2),
+    "cx": Register("cx", 6, 2),
+    "r8w": Register("r8w", 7, 2),
+    "r9w": Register("r9w", 8, 2),
+    "bx": Register("bx", 9, 2),
+    "r10w": Register("r10w", 10, 2),
+    "r11w": Register("r11w", 11, 2),
+    "r12w": Register("r12w", 12, 2),
+    "r13w": Register("r13w", 13, 2),
+    "r14w": Register("r14w", 14, 2),
+    "r15w": Register("r15w", 15, 2),
 
     # 8bit寄存器
     "al": Register("al", 0, 1),
-    "spl": Register("spl", 8, 1),
-    "bpl": Register("bpl", 16, 1),
-    "dil": Register("dil", 24, 1),
-    "sil": Register("sil", 32, 1),
-    "dl": Register("dl", 40, 1),
-    "cl": Register("cl", 48, 1),
-    "r8b": Register("r8b", 56, 1),
-    "r9b": Register("r9b", 64, 1),
-    "bl": Register("bl", 72, 1),
-    "r10b": Register("r10b", 80, 1),
-    "r11b": Register("r11b", 88, 1),
-    "r12b": Register("r12b", 96, 1),
-    "r13b": Register("r13b", 104, 1),
-    "r14b": Register("r14b", 112, 1),
-    "r15b": Register("r15b", 120, 1),
+    "spl": Register("spl", 1, 1),
+    "bpl": Register("bpl", 2, 1),
+    "dil": Register("dil", 3, 1),
+    "sil": Register("sil", 4, 1),
+    "dl": Register("dl", 5, 1),
+    "cl": Register("cl", 6, 1),
+    "r8b": Register("r8b", 7, 1),
+    "r9b": Register("r9b", 8, 1),
+    "bl": Register("bl", 9, 1),
+    "r10b": Register("r10b", 10, 1),
+    "r11b": Register("r11b", 11, 1),
+    "r12b": Register("r12b", 12, 1),
+    "r13b": Register("r13b", 13, 1),
+    "r14b": Register("r14b", 14, 1),
+    "r15b": Register("r15b", 15, 1),
 
     # 标志寄存器
-    "CF": Register("CF", 128, 1),
-    "OF": Register("OF", 129, 1),
-    "SF": Register("SF", 130, 1),
-    "ZF": Register("ZF", 131, 1),
+    "CF": Register("CF", 16, 1),
+    "OF": Register("OF", 17, 1),
+    "SF": Register("SF", 18, 1),
+    "ZF": Register("ZF", 19, 1),
 }
 
 
+# 按访问宽度预编译的小端序整数打包格式
+UNSIGNED_FORMATS = {1: struct.Struct('<B'), 2: struct.Struct('<H'), 4: struct.Struct('<I'), 8: struct.Struct('<Q')}
+SIGNED_FORMATS = {1: struct.Struct('<b'), 2: struct.Struct('<h'), 4: struct.Struct('<i'), 8: struct.Struct('<q')}
+SIZE_MASKS = {size: (1 << (size * 8)) - 1 for size in UNSIGNED_FORMATS}
+
+
 class MemoryClass:
-    storage = [0 for t in range(MEMORY_SIZE)]
+    """
+    模拟内存，按页稀疏分配的虚拟地址空间
+    每页为一个 bytearray，首次写入时才分配，未分配的页读出为0，因此地址空间可以远大于实际占用的内存
+    1/2/4/8 字节的读写通过预编译的 struct 格式一次完成，跨页访问退化为逐页拷贝
+    :param size: 地址空间大小（字节）
+    :param page_size: 页大小（字节），须为2的幂
+    """
+
+    def __init__(self, size=MEMORY_SIZE, page_size=PAGE_SIZE):
+        if page_size & (page_size - 1):
+            raise RuntimeError("页大小必须为2的幂: %d" % page_size)
+        self.size = size
+        self.page_size = page_size
+        self.page_shift = page_size.bit_length() - 1
+        self.offset_mask = page_size - 1
+        self.pages = {}
+
+    def page(self, number):
+        """
+        取出页号对应的页，未分配时分配
+        """
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = bytearray(self.page_size)
+        return page
+
+    def check(self, pos, size):
+        if pos < 0 or pos + size > self.size:
+            raise RuntimeError("内存访问越界: 地址 %d, 大小 %d" % (pos, size))
 
     def insert(self, pos, value, size):
-        if type(value) == int:
-            for i in range(size):
-                self.storage[pos + i] = (value >> (i * 8)) & 0xFF
-        else:
+        if type(value) != int:
             print("value:", value)
+            return
+        offset = pos & self.offset_mask
+        if offset + size <= self.page_size and 0 <= pos and pos + size <= self.size:
+            page = self.pages.get(pos >> self.page_shift)
+            if page is None:
+                page = self.page(pos >> self.page_shift)
+            UNSIGNED_FORMATS[size].pack_into(page, offset, value & SIZE_MASKS[size])
+        else:
+            self.insert_bytes(pos, UNSIGNED_FORMATS[size].pack(value & SIZE_MASKS[size]))
+
+    def get(self, pos, size, signed=False):
+        offset = pos & self.offset_mask
+        if offset + size <= self.page_size and 0 <= pos and pos + size <= self.size:
+            page = self.pages.get(pos >> self.page_shift)
+            if page is None:
+                return 0
+            if signed:
+                return SIGNED_FORMATS[size].unpack_from(page, offset)[0]
+            return UNSIGNED_FORMATS[size].unpack_from(page, offset)[0]
+        return int.from_bytes(self.get_bytes(pos, size), 'little', signed=signed)
+
+    def insert_bytes(self, pos, data):
+        self.check(pos, len(data))
+        data = memoryview(data)
+        while len(data) > 0:
+            offset = pos & self.offset_mask
+            length = min(len(data), self.page_size - offset)
+            self.page(pos >> self.page_shift)[offset:offset + length] = data[:length]
+            data = data[length:]
+            pos += length
+
+    def get_bytes(self, pos, size):
+        self.check(pos, size)
+        chunks = []
+        while size > 0:
+            offset = pos & self.offset_mask
+            length = min(size, self.page_size - offset)
+            page = self.pages.get(pos >> self.page_shift)
+            if page is None:
+                chunks.append(bytes(length))
+            else:
+                chunks.append(bytes(memoryview(page)[offset:offset + length]))
+            size -= length
+            pos += length
+        return b''.join(chunks)
+
+    def allocated(self):
+        """
+        已分配的内存大小（字节）
+        """
+        return len(self.pages) * self.page_size
+
+    def snapshot(self):
+        """
+        已分配各页内容的只读副本
+        :return: 页号 -> bytes
+        """
+        return {number: bytes(page) for number, page in self.pages.items()}
+
+    def restore(self, pages):
+        """
+        以 snapshot 得到的页内容替换全部内存，每页只做一次拷贝
+        """
+        self.pages = {number: bytearray(page) for number, page in pages.items()}
+
+
+
+# 内存操作数表达式的词法单元与语法树，仅在首次编译某个内存操作数时使用
+class AddressTokenKind(Enum):
+    TK_RESERVED = 0
+    TK_NUM = 1
+    TK_REGISTER = 2
+    TK_EOF = 3
+
+
+class AddressToken:
+    def __init__(self, kind, str, next):
+        self.kind = kind
+        self.str = str
+        self.next = next
+
+
+class AddressNodeKind(Enum):
+    ND_REGISTER = 0
+    ND_NUM = 1
 
-    def get(self, pos, size):
-        value = 0
-        for i in range(size):
-            value += self.storage[pos + i] << (i * 8)
-        return value
-
-Memory = MemoryClass()
-
-output = ''
-
-function_entry_index_table = {}
-
-
-
-def getMemoryAddress(src):
-    class TokenKind(Enum):
-        TK_RESERVED = 0
-        TK_NUM = 1
-        TK_REGISTER = 2
-        TK_EOF = 3
-
-    class Token:
-        def __init__(self, kind, str, next):
-            self.kind = kind
-            self.str = str
-            self.next = next
-
-    class NodeKind(Enum):
-        ND_REGISTER = 0
-        ND_NUM = 1
-
-        ND_ADD = 2
-        ND_SUB = 3
-        ND_MUL = 4
-        ND_DIV = 5
-
-    class Node:
-        def __init__(self, kind, val, lhs, rhs):
-            self.kind = kind
-            self.val = val
-            self.lhs = lhs
-            self.rhs = rhs
-
-    def eval(root):
-        if root is None:
-            return 0
-        if root.kind == NodeKind.ND_NUM:
-            return root.val
-        elif root.kind == NodeKind.ND_REGISTER:
-            return Register_Table[root.val].get()
-        elif root.kind == NodeKind.ND_ADD:
-            return eval(root.lhs) + eval(root.rhs)
-        elif root.kind == NodeKind.ND_SUB:
-            return eval(root.lhs) - eval(root.rhs)
-        elif root.kind == NodeKind.ND_MUL:
-            return eval(root.lhs) * eval(root.rhs)
-        elif root.kind == NodeKind.ND_DIV:
-            return eval(root.lhs) // eval(root.rhs)
+    ND_ADD = 2
+    ND_SUB = 3
+    ND_MUL = 4
+    ND_DIV = 5
+
+
+class AddressNode:
+    def __init__(self, kind, val, lhs, rhs):
+        self.kind = kind
+        self.val = val
+        self.lhs = lhs
+        self.rhs = rhs
+
+
+ADDRESS_OPERATORS = ['+', '-', '*', '/', '(', ')']
+
+
+def parseMemoryExpression(expr):
+    """
+    将内存操作数表达式解析为语法树，支持 + - * / 与括号
+    :param expr: 去掉方括号的表达式，如 rbp-8
+    :return AddressNode: 语法树的根节点
+    """
 
     def tokenize():
-        nonlocal expr
         pos = 0
-        head = Token(TokenKind.TK_RESERVED, None, None)
+        head = AddressToken(AddressTokenKind.TK_RESERVED, None, None)
         cur = head
 
         while pos < len(expr):
@@ -246,35 +356,49 @@ def getMemoryAddress(src):
                 while pos < len(expr) and expr[pos].isdigit():
                     val = val * 10 + int(expr[pos])
                     pos += 1
-                cur.next = Token(TokenKind.TK_NUM, val, None)
+                cur.next = AddressToken(AddressTokenKind.TK_NUM, val, None)
                 cur = cur.next
             elif expr[pos].isalpha():
                 val = ''
-                while pos < len(expr) and expr[pos] not in operand:
+                while pos < len(expr) and expr[pos] not in ADDRESS_OPERATORS:
                     val += expr[pos]
                     pos += 1
-                cur.next = Token(TokenKind.TK_REGISTER, val, None)
+                cur.next = AddressToken(AddressTokenKind.TK_REGISTER, val, None)
                 cur = cur.next
-            elif expr[pos] in operand:
-                cur.next = Token(TokenKind.TK_RESERVED, expr[pos], None)
+            elif expr[pos] in ADDRESS_OPERATORS:
+                cur.next = AddressToken(AddressTokenKind.TK_RESERVED, expr[pos], None)
                 cur = cur.next
                 pos += 1
             else:
                 raise RuntimeError("无法识别的字符: %s" % expr[pos])
         return head.next
 
+    # expr = mul ("+" mul | "-" mul)*
+    def add():
+        nonlocal token
+        node = mul()
+        while token is not None:
+            if token.str == "+":
+                token = token.next
+                node = AddressNode(AddressNodeKind.ND_ADD, 0, node, mul())
+            elif token.str == "-":
+                token = token.next
+                node = AddressNode(AddressNodeKind.ND_SUB, 0, node, mul())
+            else:
+                return node
+        return node
+
     # mul = primary ("*" primary | "/" primary)*
     def mul():
         nonlocal token
         node = primary()
         while token is not None:
             if token.str == "*":
-                node = Node(NodeKind.ND_MUL, 0, node, primary())
                 token = token.next
-
+                node = AddressNode(AddressNodeKind.ND_MUL, 0, node, primary())
             elif token.str == "/":
-                node = Node(NodeKind.ND_DIV, 0, node, primary())
                 token = token.next
+                node = AddressNode(AddressNodeKind.ND_DIV, 0, node, primary())
             else:
                 return node
         return node
@@ -282,40 +406,183 @@ def getMemoryAddress(src):
     # primary = num | register | "(" expr ")"
     def primary():
         nonlocal token
-        if token.kind == TokenKind.TK_NUM:
-            node = Node(NodeKind.ND_NUM, int(token.str), None, None)
+        if token.kind == AddressTokenKind.TK_NUM:
+            node = AddressNode(AddressNodeKind.ND_NUM, int(token.str), None, None)
             token = token.next
             return node
-        elif token.kind == TokenKind.TK_REGISTER:
-            node = Node(NodeKind.ND_REGISTER, token.str, None, None)
+        elif token.kind == AddressTokenKind.TK_REGISTER:
+            if token.str not in Register_Table:
+                raise RuntimeError("无法识别的寄存器: %s" % token.str)
+            node = AddressNode(AddressNodeKind.ND_REGISTER, token.str, None, None)
             token = token.next
             return node
         elif token.str == "(":
             token = token.next
-            node = expr()
-            if token.str != ")":
+            node = add()
+            if token is None or token.str != ")":
                 raise RuntimeError("括号不匹配")
             token = token.next
             return node
+        raise RuntimeError("无法识别的字符: %s" % token.str)
 
-    expr = src[1:-1]
-    operand = ['+', '-', '*', '/', '(', ')']
     token = tokenize()
-    # expr = mul ("+" mul | "-" mul)*
-    root = mul()
-
-    while token is not None:
-        if token.str == "+":
-            token = token.next
-            root = Node(NodeKind.ND_ADD, 0, root, mul())
-        elif token.str == "-":
-            token = token.next
-            root = Node(NodeKind.ND_SUB, 0, root, mul())
+    root = add()
+    if token is not None:
+        raise RuntimeError("无法识别的字符: %s" % token.str)
+    return root
+
+
+def evalMemoryExpression(root, registers):
+    if root is None:
+        return 0
+    if root.kind == AddressNodeKind.ND_NUM:
+        return root.val
+    elif root.kind == AddressNodeKind.ND_REGISTER:
+        return Register_Table[root.val].get(registers)
+    elif root.kind == AddressNodeKind.ND_ADD:
+        return evalMemoryExpression(root.lhs, registers) + evalMemoryExpression(root.rhs, registers)
+    elif root.kind == AddressNodeKind.ND_SUB:
+        return evalMemoryExpression(root.lhs, registers) - evalMemoryExpression(root.rhs, registers)
+    elif root.kind == AddressNodeKind.ND_MUL:
+        return evalMemoryExpression(root.lhs, registers) * evalMemoryExpression(root.rhs, registers)
+    elif root.kind == AddressNodeKind.ND_DIV:
+        return evalMemoryExpression(root.lhs, registers) // evalMemoryExpression(root.rhs, registers)
+
+
+def linearizeMemoryExpression(root):
+    """
+    将语法树化简为 base + index * scale + displacement 的形式
+    :return: (base, index, scale, displacement)，无法化简时返回None
+    """
+    base = None
+    index = None
+    scale = 1
+    displacement = 0
+
+    terms = []  # (符号, 节点)
+    pending = [(1, root)]
+    while pending:
+        sign, node = pending.pop()
+        # 先压入右操作数，使各项按从左到右的顺序取出
+        if node.kind == AddressNodeKind.ND_ADD:
+            pending.append((sign, node.rhs))
+            pending.append((sign, node.lhs))
+        elif node.kind == AddressNodeKind.ND_SUB:
+            pending.append((-sign, node.rhs))
+            pending.append((sign, node.lhs))
         else:
-            raise RuntimeError("无法识别的字符: %s" % token.str)
+            terms.append((sign, node))
+
+    for sign, node in terms:
+        if node.kind == AddressNodeKind.ND_NUM:
+            displacement += sign * node.val
+        elif node.kind == AddressNodeKind.ND_REGISTER and sign > 0:
+            if base is None:
+                base = node.val
+            elif index is None:
+                index = node.val
+            else:
+                return None
+        elif node.kind == AddressNodeKind.ND_MUL and sign > 0 and index is None:
+            lhs, rhs = node.lhs, node.rhs
+            if lhs.kind == AddressNodeKind.ND_NUM:
+                lhs, rhs = rhs, lhs
+            if lhs.kind != AddressNodeKind.ND_REGISTER or rhs.kind != AddressNodeKind.ND_NUM:
+                return None
+            index = lhs.val
+            scale = rhs.val
+        else:
+            return None
+
+    return base, index, scale, displacement
+
+
+# 内存操作数的访问宽度
+PTR_SIZE = {'byte': 1, 'word': 2, 'dword': 4, 'qword': 8}
+
+
+class MemoryAddress:
+    """
+    编译后的内存操作数，地址为 base + index * scale + displacement
+    evaluate(registers) 为按操作数形式特化的求值函数，每次访存只需读取寄存器文件并做一次加法
+    :param text: 内存操作数原文，如 [rbp-8]、byte ptr [rax]
+    :param size: 由 byte/word/dword/qword ptr 指明的访问宽度，未指明时为None
+    """
+
+    def __init__(self, text, size, base=None, index=None, scale=1, displacement=0, root=None):
+        self.text = text
+        self.size = size
+        self.base = base
+        self.index = index
+        self.scale = scale
+        self.displacement = displacement
+        self.linear = root is None  # 能否化简为 base + index * scale + displacement
+        self.evaluate = self.specialize(root)
+
+    def specialize(self, root):
+        displacement = self.displacement
+        scale = self.scale
+
+        if root is not None:
+            return lambda registers: evalMemoryExpression(root, registers)
+
+        if self.base is None:
+            return lambda registers: displacement
+
+        base = Register_Table[self.base]
+        if self.index is None:
+            if base.size == 8:
+                base = base.index
+                return lambda registers: registers[base] + displacement
+            return lambda registers: base.get(registers) + displacement
+
+        index = Register_Table[self.index]
+        if base.size == 8 and index.size == 8:
+            base = base.index
+            index = index.index
+            return lambda registers: registers[base] + registers[index] * scale + displacement
+        return lambda registers: base.get(registers) + index.get(registers) * scale + displacement
+
+    def __str__(self):
+        return self.text
+
+
+@functools.lru_cache(maxsize=4096)
+def compileMemoryAddress(src):
+    """
+    将内存操作数编译为求值对象，相同的操作数文本只编译一次
+    支持 [reg±disp]、[reg+reg*scale±disp] 以及 byte/word/dword/qword ptr [...] 形式，
+    其他合法的表达式退化为对预先构建的语法树求值
+    :param src: 内存操作数文本
+    :return MemoryAddress: 编译后的内存操作数
+    """
+    text = src.strip()
+    size = None
+    segment = text.split(" ", 2)
+    if len(segment) == 3 and segment[1] == 'ptr' and segment[0] in PTR_SIZE:
+        size = PTR_SIZE[segment[0]]
+        text = segment[2].strip()
+
+    if text[0] != '[' or text[-1] != ']':
+        raise RuntimeError("无法识别的内存操作数: %s" % src)
 
-    result = eval(root)
-    return result
+    root = parseMemoryExpression(text[1:-1])
+    linear = linearizeMemoryExpression(root)
+    if linear is None:
+        return MemoryAddress(src, size, root=root)
+
+    base, index, scale, displacement = linear
+    return MemoryAddress(src, size, base, index, scale, displacement)
+
+
+def getMemoryAddress(src, registers):
+    """
+    计算内存操作数的地址
+    :param src: 内存操作数文本，如 [rbp-8]
+    :param registers: 寄存器文件
+    :return: 内存地址
+    """
+    return compileMemoryAddress(src).evaluate(registers)
 
 
 def float_to_ieee754(value):
@@ -350,11 +617,6 @@ def ieee754_to_double(ieee754_hex):
 
 
 
-RUNNING_COMMAND_LINE_INDEX = 0
-CURRENT_FUNC = 'main'
-PREV_FUNC = []
-
-
 class Func:
     def __init__(self):
         self.labels = {}
@@ -369,779 +631,1279 @@ class Vars:
         self.size = size
 
 
-glb_vars = {}
-glb_func = {}
-
 inset_func = {'read', 'write'}
 
-glb_vars_size = 0
 
-current_var = Vars('', 0)
+class Operand:
+    """
+    译码后的操作数
+    :param mode: 寻址模式
+    :param value: 寄存器视图、立即数、编译后的内存操作数或符号名
+    """
+
+    def __init__(self, mode, value):
+        self.mode = mode
+        self.value = value
+        self.is_register = mode == AddressingMode.REGISTER
+
+
+class Instruction:
+    """
+    译码后的指令记录，与汇编代码的行一一对应
+    :param op: 操作码
+    :param operands: 已分类的操作数
+    :param text: 原始的汇编代码，用于报错
+    :param length: 指令记录覆盖的行数，融合而成的超级指令覆盖多行
+    """
+
+    def __init__(self, op, operands=(), text='', length=1):
+        self.op = op
+        self.handler = instruction_handlers[op]
+        self.operands = operands
+        self.text = text
+        self.length = length
+        self.target = None  # 跳转与调用指令在装载时解析出的目标指令下标
 
 
-def enterDataSegment(command_line_index, assembly_commands):
+class DecodeError(Exception):
     """
-    进入数据段，处理数据段的数据
-    :param command_line_index:
-    :param assembly_commands:
-    :return:
+    译码期发现的指令错误，译码为一条在执行时才抛出该错误的指令
     """
-    global current_var, glb_vars_size, glb_vars
 
-    while command_line_index < len(assembly_commands):
-        command_line = assembly_commands[command_line_index]  # 获取当前行的汇编代码
-        command_line_index += 1
 
-        command_line = command_line.strip()  # 去掉行首行尾的空格
+class BudgetExceeded(RuntimeError):
+    """
+    运行超出限额，在两条指令之间抛出，虚拟机的状态保持完整，放宽限额后可再次调用 run() 继续执行
+    :param limit: 超出的限额，为 instructions、time 或 memory
+    :param executed: 已执行的指令数
+    :param function: 停止时正在运行的函数名
+    :param elapsed: 本次 run 已运行的时间（秒）
+    :param memory: 已分配的内存（字节）
+    """
 
-        if command_line == '.text':
-            return command_line_index
+    def __init__(self, limit, executed, function, elapsed, memory):
+        super().__init__("超出%s限额: 已执行%d条指令, 运行%.3f秒, 占用内存%d字节, 当前函数 %s"
+                         % (BUDGET_NAMES[limit], executed, elapsed, memory, function))
+        self.limit = limit
+        self.executed = executed
+        self.function = function
+        self.elapsed = elapsed
+        self.memory = memory
 
-        elif command_line[-1] == ':':
-            current_var = Vars(command_line[:-1], 0)
-            current_var.pos = glb_vars_size
-            glb_vars[command_line[:-1]] = current_var
+    def report(self):
+        """
+        以字典形式给出停止时的状态
+        """
+        return {"limit": self.limit, "instructions": self.executed, "function": self.function,
+                "elapsed": self.elapsed, "memory": self.memory}
 
-        elif command_line[0:5] == '.zero':
-            command_segment = command_line.split(" ")
-            glb_vars_size += int(command_segment[1])
-            current_var.size += int(command_segment[1])
 
-        elif command_line[0:5] == '.byte':
-            command_segment = command_line.split(" ")
-            Memory.insert(glb_vars_size, int(command_segment[1]), 1)
-            current_var.size += 1
-            glb_vars_size += 1
+BUDGET_NAMES = {"instructions": "指令数", "time": "运行时间", "memory": "内存"}
+BUDGET_CHECK_INTERVAL = 4096  # 每执行多少条指令检查一次限额
 
 
-def init():
-    Register_Table['rsp'].insert(MEMORY_SIZE)
-    Register_Table['rbp'].insert(MEMORY_SIZE)
+# 指令注册表
+opcode_table = {}  # 助记符 -> 操作码
+instruction_names = []  # 操作码 -> 助记符
+instruction_handlers = []  # 操作码 -> 处理函数
+instruction_decoders = []  # 操作码 -> 译码函数
 
 
-def run(code):
+def register_instruction(*mnemonics, decoder=None):
     """
-      解释执行汇编代码
-      :param code: 要执行的汇编代码
-      :return: Nothing?
+    注册指令的装饰器，为每个助记符分配操作码；执行时直接按记录中的处理函数分派，不再逐个比较助记符
+    已注册的助记符再次注册时，新的处理函数覆盖旧的
+    :param mnemonics: 助记符
+    :param decoder: 译码函数 decoder(name, segment)，返回操作数元组；返回None时该行作为空指令
+    :return: 装饰器
     """
-    global output
-    global glb_vars, glb_func
-    global CURRENT_FUNC, RUNNING_COMMAND_LINE_INDEX
 
-    init()
+    def register(handler):
+        for mnemonic in mnemonics:
+            if mnemonic in opcode_table:
+                op = opcode_table[mnemonic]
+                instruction_handlers[op] = handler
+                instruction_decoders[op] = decoder
+            else:
+                opcode_table[mnemonic] = len(instruction_names)
+                instruction_names.append(mnemonic)
+                instruction_handlers.append(handler)
+                instruction_decoders.append(decoder)
+        return handler
 
-    output = ''
+    return register
 
-    assembly_commands = code.split("\n")  # 将汇编代码按行分割
 
-    command_line_index = 0
+def decodeOperand(source):
+    """
+    对操作数进行分类，立即数在译码时即转换为整数
+    :param source: 操作数文本
+    :return Operand: 译码后的操作数
+    """
+    addressing_mode = addressing(source)
+    if addressing_mode == AddressingMode.IMMEDIATE:
+        return Operand(addressing_mode, getValueByAddressing(addressing_mode, source))
+    elif addressing_mode == AddressingMode.MEMORY:
+        return Operand(addressing_mode, compileMemoryAddress(source))
+    return Operand(addressing_mode, Register_Table[source])
 
-    while command_line_index < len(assembly_commands):
-        command_line = assembly_commands[command_line_index]  # 获取当前行的汇编代码
 
-        command_line_index += 1  # 执行完一行代码后，指针指向下一行, 类似与PC寄存器
+def decodeWithoutOperand(name, segment):
+    """
+    无操作数的指令，如 cqo
+    """
+    if len(segment) != 1:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (name, len(segment)))
+    return ()
 
-        if command_line == "":
-            continue
 
-        command_line = command_line.strip()  # 去掉行首行尾的空格
+def decodeIgnoringOperand(name, segment):
+    """
+    忽略操作数的指令，如 ret、print
+    """
+    return ()
 
-        if command_line[0] == '.':
-            command_segment = command_line.split(" ")
-            if command_segment[0] == ".intel_syntax":
-                pass
-            elif command_segment[0] == '.data':
-                command_line_index = enterDataSegment(command_line_index, assembly_commands)
-            elif command_segment[0] == '.text':
-                pass
-            elif command_segment[0] == '.global':
-                pass
 
-        elif command_line[-1] == ':':
-            current_func = Func()
-            glb_func[command_line[:-1]] = current_func
-            current_func.entry = command_line_index
-            while command_line_index < len(assembly_commands):
-                command_line = assembly_commands[command_line_index]
-                command = command_line.strip()
-                if command[0:2] == '.L':
-                    current_func.labels[command[:-1]] = command_line_index + 1
-                elif command[0:3] == 'ret':
-                    current_func.ret = command_line_index
-                    break
-                command_line_index += 1
+def decodePush(name, segment):
+    """
+    push ( source | offset source )
+    """
+    if len(segment) == 2:
+        return decodeOperand(segment[1]),
+    elif len(segment) == 3:
+        if segment[1] == 'offset':
+            return Operand(AddressingMode.OFFSET, segment[2]),
+        return None
+    raise DecodeError("push的参数量错误，共有%d个参数" % len(segment))
+
 
-    RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].entry
-    while RUNNING_COMMAND_LINE_INDEX < len(assembly_commands):
-        # 取完指令，RUNNING_COMMAND_LINE_INDEX自增
-        command = assembly_commands[RUNNING_COMMAND_LINE_INDEX]
-        RUNNING_COMMAND_LINE_INDEX += 1
-        command = command.strip()
-        # 运行指令
-        run_command(command)
+def decodePop(name, segment):
+    """
+    pop destination
+    """
+    if len(segment) != 2:
+        return None
+    destination = decodeOperand(segment[1])
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("pop指令的目的操作数错误, %s" % segment[1])
+    return destination,
 
 
-def run_command(command):
+def decodeRegisterValue(name, segment):
+    """
+    op destination, source  目的操作数为寄存器，源操作数为寄存器或立即数
     """
-    运行指令
-    :param command:
-    :return:
+    if len(segment) != 3:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (name, len(segment)))
+    destination = decodeOperand(segment[1][:-1])
+    source = decodeOperand(segment[2])
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("%s指令的目的操作数错误, %s" % (name, destination.value))
+    if source.mode == AddressingMode.MEMORY:
+        raise DecodeError("在不确定大小的情况下无法获取内存值")
+    return destination, source
+
+
+def decodeCompare(name, segment):
     """
-    global output, register
-    global CURRENT_FUNC, RUNNING_COMMAND_LINE_INDEX, PREV_FUNC
-    # print("RUNNING INDEX: %d" % RUNNING_COMMAND_LINE_INDEX, "COMMAND: ", command) # DEBUG USE
+    cmp operand1, operand2  两个操作数均为寄存器或立即数
+    """
+    if len(segment) != 3:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (name, len(segment)))
+    operand1 = decodeOperand(segment[1][:-1])
+    operand2 = decodeOperand(segment[2])
+    if operand1.mode == AddressingMode.MEMORY or operand2.mode == AddressingMode.MEMORY:
+        raise DecodeError("在不确定大小的情况下无法获取内存值")
+    return operand1, operand2
 
-    segment = command.split(" ")  # 将每行汇编代码按空格分割
-    # push指令:将数据压入栈中 通用形式：push ( source | offset source )
-    if segment[0] == "push":
-        if len(segment) == 2:
-            source = segment[1]
 
-            addressing_mode = addressing(source)
+def decodeRegister(name, segment):
+    """
+    op operand  唯一的操作数为寄存器，如 sete、idiv
+    """
+    if len(segment) != 2:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (name, len(segment)))
+    operand = decodeOperand(segment[1])
+    if operand.mode != AddressingMode.REGISTER:
+        if name == "idiv":
+            raise DecodeError("idiv指令的源操作数错误, %s" % segment[1])
+        raise DecodeError("%s指令的目的操作数错误, %s" % (name, segment[1]))
+    return operand,
+
 
-            if addressing_mode == AddressingMode.MEMORY:
-                source_value = Memory.get(getMemoryAddress(source), 8)
-            else:
-                source_value = getValueByAddressing(addressing_mode, source)
+def decodeExtend(name, segment):
+    """
+    movsx rax, byte ptr [rax] 与 movsxd rax, dword ptr [rax]
+    """
+    # 沿用原有报错信息
+    error_name = "movsb" if name == "movsx" else name
+    if len(segment) != 5:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (error_name, len(segment)))
+    destination = decodeOperand(segment[1][:-1])
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("%s指令的目的操作数错误, %s" % (error_name, destination.value))
+    return destination, decodeOperand(" ".join(segment[2:]))
 
-            rsp = Register_Table['rsp']
-            value = rsp.get()
-            value -= 8
-            rsp.insert(value)
 
-            stack_top = Register_Table['rsp'].get()
-            Memory.insert(stack_top, source_value, 8)
+def decodeMov(name, segment):
+    """
+    mov destination, source  寄存器之间、寄存器与内存之间或立即数到寄存器
+    """
+    if len(segment) != 3:
+        return None
+    destination = decodeOperand(segment[1][:-1])
+    source = decodeOperand(segment[2])
+    if destination.mode == AddressingMode.MEMORY:
+        if source.mode != AddressingMode.REGISTER:
+            raise DecodeError("mov指令的源操作数错误, %s" % segment[2])
+    elif destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("mov指令的目的操作数错误, %s" % destination.value)
+    return destination, source
+
+
+def decodeLea(name, segment):
+    """
+    lea destination, source  目的操作数为寄存器，源操作数为内存
+    """
+    if len(segment) != 3:
+        return None
+    destination = decodeOperand(segment[1][:-1])
+    source = decodeOperand(segment[2])
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("lea指令的目的操作数错误, %s" % destination.value)
+    if source.mode != AddressingMode.MEMORY:
+        raise DecodeError("lea指令的源操作数错误, %s" % segment[2])
+    return destination, source
+
+
+def decodeLogic(name, segment):
+    """
+    and/or/xor destination, source
+    """
+    if len(segment) != 3:
+        return None
+    destination = decodeOperand(segment[1][:-1])
+    source = decodeOperand(segment[2])
+    if destination.mode == AddressingMode.MEMORY or source.mode == AddressingMode.MEMORY:
+        raise DecodeError("在不确定大小的情况下无法获取内存值")
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("%s指令的目的操作数错误, %s" % (name, destination.value))
+    return destination, source
+
+
+def decodeNot(name, segment):
+    """
+    not destination
+    """
+    if len(segment) != 2:
+        return None
+    destination = decodeOperand(segment[1])
+    if destination.mode != AddressingMode.REGISTER:
+        raise DecodeError("not指令的目的操作数错误, %s" % segment[1])
+    return destination,
 
-        elif len(segment) == 3:
-            if segment[1] == 'offset':
-                var_name = segment[2]
 
-                rsp = Register_Table['rsp']
-                value = rsp.get()
-                value -= 8
-                rsp.insert(value)
+def decodeSymbol(name, segment):
+    """
+    jmp label、call function  操作数为标签或函数名
+    """
+    if len(segment) != 2:
+        raise DecodeError("%s指令的参数量错误，共有%d个参数" % (name, len(segment)))
+    return Operand(AddressingMode.IMMEDIATE, segment[1]),
 
-                stack_top = Register_Table['rsp'].get()
-                Memory.insert(stack_top, glb_vars[var_name].pos, 8)
-        else:
-            raise RuntimeError("push的参数量错误，共有%d个参数" % len(segment))
 
-    # pop指令:将数据从栈中弹出 通用形式：pop destination
-    elif segment[0] == "pop":
-        if len(segment) == 2:
-            destination = segment[1]
-            addressing_mode = addressing(destination)
+def decode(command_line):
+    """
+    将一行汇编代码译码为指令记录，参数错误在执行到该指令时才会抛出，与逐行解释时的行为一致
+    :param command_line: 一行汇编代码
+    :return Instruction: 指令记录
+    """
+    command = command_line.strip()
+    if command == "" or command[0] == '.':
+        return NOP_INSTRUCTION
 
-            if addressing_mode == AddressingMode.REGISTER:
-                register = Register_Table[destination]
+    segment = command.split(" ")  # 将每行汇编代码按空格分割
+    name = segment[0]
 
-                stack_top = Register_Table['rsp'].get()
-                # print("top index:", stack_top)
-                register.insert(Memory.get(stack_top, register.size))
+    if name not in opcode_table:
+        return Instruction(UNKNOWN_OPCODE, (name,), command)
 
-                Register_Table['rsp'].insert(stack_top + 8)
-            elif addressing_mode == AddressingMode.MEMORY:
-                raise RuntimeError("pop指令的目的操作数错误, %s" % destination)
+    op = opcode_table[name]
+    try:
+        operands = instruction_decoders[op](name, segment)
+    except DecodeError as e:
+        return Instruction(ERROR_OPCODE, (str(e),), command)
 
-            else:
-                raise RuntimeError("pop指令的目的操作数错误, %s" % destination)
+    if operands is None:
+        return NOP_INSTRUCTION
+    return Instruction(op, operands, command)
 
-    # 加法指令add 通用形式：add destination, source
-    elif segment[0] == "add":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
 
-            addressing_mode = addressing(destination)
+class Snapshot:
+    """
+    虚拟机状态的快照，可在装载后或运行到中途时（如超出指令数限额后）取得
+    快照只保存寄存器、已分配的内存页、调用栈与输出等运行状态，指令记录、函数与全局变量表在装载后不再改变，与原虚拟机共享
+    同一个快照可以反复恢复到不同的虚拟机中，每次恢复只需逐页拷贝内存，无需重新装载数据段与登记标签
+    :param machine: 取快照的虚拟机
+    """
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("add指令的目的操作数错误, %s" % destination)
+    def __init__(self, machine):
+        self.memory_size = machine.memory_size
+        self.stack_top = machine.stack_top
+        self.data_base = machine.data_base
+
+        self.registers = tuple(machine.registers)
+        self.pages = machine.memory.snapshot()
+        self.program = machine.program
+        self.index = machine.index
+        self.current_func = machine.current_func
+        self.call_frames = tuple(machine.call_frames[:machine.call_depth])
+        self.owners = machine.owners
+        self.functions = machine.functions
+        self.variables = machine.variables
+        self.data_size = machine.data_size
+        self.fused_instructions = machine.fused_instructions
+        self.executed = machine.executed
+        self.output = machine.output
+
+    def machine(self, controller=None, max_instructions=None, max_time=None, max_memory=None,
+                stdin=None, stdout=None):
+        """
+        由快照创建一台新的虚拟机，从取快照时的位置继续运行，参数与 Machine 相同
+        :return Machine: 新的虚拟机
+        """
+        machine = Machine(self.memory_size, self.stack_top, self.data_base, controller,
+                          max_instructions, max_time, max_memory, stdin, stdout)
+        machine.restore(self)
+        return machine
+
+
+class Machine:
+    """
+    虚拟机，拥有自己的寄存器文件、内存、调用栈与输入输出
+    虚拟机之间不共享可变状态，多个虚拟机可以在不同线程中同时运行，也可以调用 load/run 反复复用
+    :param memory_size: 地址空间大小（字节），内存按页在首次写入时分配，可远大于程序实际使用的内存
+    :param stack_top: 栈顶地址，默认为地址空间的末尾
+    :param data_base: 数据段的起始地址，默认为0
+    :param controller: 提供输入的对象，需实现 request_input()；为None时从标准输入读取
+    :param max_instructions: 最多执行的指令数，为None时不限
+    :param max_time: 每次 run 最长的运行时间（秒），为None时不限
+    :param max_memory: 最多分配的内存（字节），为None时不限
+    :param stdin: 输入，可以是文本、bytes、文件或管道、迭代器，见 channels.inputSource；给出时代替 controller
+    :param stdout: 输出通道，可以是文件、缓冲写入器或回调函数，见 channels.outputSink；
+                   为None时输出保存在 output 中，否则按块写出，output 中只保留尚未写出的部分
+    """
 
-            source = segment[2]
-            addressing_mode = addressing(source)
+    def __init__(self, memory_size=MEMORY_SIZE, stack_top=None, data_base=0, controller=None,
+                 max_instructions=None, max_time=None, max_memory=None, stdin=None, stdout=None):
+        if stack_top is None:
+            stack_top = memory_size
+        if not 0 <= data_base < memory_size or not 0 < stack_top <= memory_size:
+            raise RuntimeError("栈或数据段超出地址空间")
+
+        self.memory_size = memory_size
+        self.stack_top = stack_top
+        self.data_base = data_base
+        self.controller = controller
+        self.stdin = channels.inputSource(stdin if stdin is not None else controller)
+        self.stdout = channels.outputSink(stdout)
+        self.max_instructions = max_instructions
+        self.max_time = max_time
+        self.max_memory = max_memory
+        self.started = 0.0  # 本次 run 开始的时间
+        self.deadline = None
+        self.reset()
+
+    def reset(self):
+        """
+        恢复到装载程序之前的状态
+        """
+        self.registers = [0 for t in range(REGISTER_FILE_SIZE)]
+        self.registers[FLAGS] = None
+        self.registers[Register_Table['rsp'].index] = self.stack_top
+        self.registers[Register_Table['rbp'].index] = self.stack_top
+        self.memory = MemoryClass(self.memory_size)
+
+        self.program = []
+        self.index = 0  # 当前运行的指令行号
+        self.current_func = 'main'  # 当前运行的函数名
+        self.call_frames = [0] * CALL_STACK_SIZE  # 调用栈，每层为返回后的指令行号
+        self.call_depth = 0  # 调用栈的深度
+        self.owners = []  # 每行指令所属的函数名
+        self.functions = {}  # 所有全局可见函数
+        self.variables = {}  # 全局变量
+        self.data_size = 0  # 数据段已占用的大小
+        self.fused_instructions = 0  # 装载时被融合的指令数
+        self.executed = 0  # 已执行的指令数
+        self.output = ''
+
+    @property
+    def output(self):
+        """
+        保存在虚拟机中的输出；设置了输出通道时为尚未写出的部分
+        """
+        if len(self.output_chunks) > 1:
+            self.output_chunks = [''.join(self.output_chunks)]
+        return self.output_chunks[0] if self.output_chunks else ''
+
+    @output.setter
+    def output(self, text):
+        self.output_chunks = [text] if text else []
+        self.output_pending = len(text)
+
+    def emit(self, text):
+        """
+        输出一段文本，输出以块为单位攒起，避免反复拼接字符串
+        """
+        self.output_chunks.append(text)
+        self.output_pending += len(text)
+        if self.stdout is not None and self.output_pending >= channels.OUTPUT_CHUNK_SIZE:
+            self.flushOutput()
+
+    def flushOutput(self):
+        """
+        将攒起的输出写入输出通道，没有输出通道时什么也不做
+        """
+        if self.stdout is None:
+            return
+        if self.output_chunks:
+            self.stdout.write(''.join(self.output_chunks))
+            self.output_chunks = []
+            self.output_pending = 0
+        self.stdout.flush()
+
+    def snapshot(self):
+        """
+        取得当前状态的快照
+        :return Snapshot: 快照
+        """
+        return Snapshot(self)
+
+    def restore(self, snapshot):
+        """
+        恢复到快照时的状态，快照须来自地址空间与栈布局相同的虚拟机
+        :param snapshot: Snapshot
+        """
+        if (snapshot.memory_size, snapshot.stack_top, snapshot.data_base) != \
+                (self.memory_size, self.stack_top, self.data_base):
+            raise RuntimeError("快照的地址空间与虚拟机不一致")
+        self.registers = list(snapshot.registers)
+        self.memory = MemoryClass(self.memory_size)
+        self.memory.restore(snapshot.pages)
+        self.program = snapshot.program
+        self.index = snapshot.index
+        self.current_func = snapshot.current_func
+        self.call_frames = [0] * max(CALL_STACK_SIZE, 2 * len(snapshot.call_frames))
+        self.call_frames[:len(snapshot.call_frames)] = snapshot.call_frames
+        self.call_depth = len(snapshot.call_frames)
+        self.owners = snapshot.owners
+        self.functions = snapshot.functions
+        self.variables = snapshot.variables
+        self.data_size = snapshot.data_size
+        self.fused_instructions = snapshot.fused_instructions
+        self.executed = snapshot.executed
+        self.output = snapshot.output
+
+    def fork(self, stdin=None, stdout=None):
+        """
+        复制出一台状态相同的虚拟机，两者此后各自独立运行
+        同一状态需要复制多次时，先取一次 snapshot 再逐个创建更省
+        :param stdin: 新虚拟机的输入，为None时沿用本虚拟机的输入通道
+        :param stdout: 新虚拟机的输出通道，为None时沿用本虚拟机的
+        :return Machine: 新的虚拟机
+        """
+        return self.snapshot().machine(None, self.max_instructions, self.max_time, self.max_memory,
+                                       stdin if stdin is not None else self.stdin,
+                                       stdout if stdout is not None else self.stdout)
+
+    def enterDataSegment(self, command_line_index, assembly_commands):
+        """
+        进入数据段，处理数据段的数据
+        :param command_line_index:
+        :param assembly_commands:
+        :return:
+        """
+        current_var = Vars('', 0)
+
+        while command_line_index < len(assembly_commands):
+            command_line = assembly_commands[command_line_index]  # 获取当前行的汇编代码
+            command_line_index += 1
+
+            command_line = command_line.strip()  # 去掉行首行尾的空格
+
+            if command_line == '.text':
+                return command_line_index
+
+            elif command_line[-1] == ':':
+                current_var = Vars(command_line[:-1], 0)
+                current_var.pos = self.data_base + self.data_size
+                self.variables[command_line[:-1]] = current_var
+
+            elif command_line[0:5] == '.zero':
+                command_segment = command_line.split(" ")
+                self.data_size += int(command_segment[1])
+                current_var.size += int(command_segment[1])
+
+            elif command_line[0:5] == '.byte':
+                command_segment = command_line.split(" ")
+                self.memory.insert(self.data_base + self.data_size, int(command_segment[1]), 1)
+                current_var.size += 1
+                self.data_size += 1
+
+    def load(self, code):
+        """
+        装载阶段：将汇编代码一次性译码为指令记录，同时装入数据段、登记函数入口与标签
+        指令记录与汇编代码逐行对应，标签登记的行号即为指令下标
+        装载前虚拟机恢复到初始状态，上一个程序的数据不会残留
+        :param code: 要执行的汇编代码
+        :return: 指令记录列表
+        """
+        self.reset()
+
+        assembly_commands = code.split("\n")  # 将汇编代码按行分割
+        program = [decode(command_line) for command_line in assembly_commands]
+
+        command_line_index = 0
+
+        while command_line_index < len(assembly_commands):
+            command_line = assembly_commands[command_line_index]  # 获取当前行的汇编代码
+
+            command_line_index += 1  # 执行完一行代码后，指针指向下一行, 类似与PC寄存器
+
+            if command_line == "":
+                continue
 
-            source_value = getValueByAddressing(addressing_mode, source)
+            command_line = command_line.strip()  # 去掉行首行尾的空格
+
+            if command_line[0] == '.':
+                command_segment = command_line.split(" ")
+                if command_segment[0] == '.data':
+                    command_line_index = self.enterDataSegment(command_line_index, assembly_commands)
+
+            elif command_line[-1] == ':':
+                current_func = Func()
+                self.functions[command_line[:-1]] = current_func
+                current_func.entry = command_line_index
+                while command_line_index < len(assembly_commands):
+                    command_line = assembly_commands[command_line_index]
+                    command = command_line.strip()
+                    if command[0:2] == '.L':
+                        current_func.labels[command[:-1]] = command_line_index + 1
+                    elif command[0:3] == 'ret':
+                        current_func.ret = command_line_index
+                        break
+                    command_line_index += 1
+
+        self.owners = resolve(program, self.functions)
+        guardFlagAccess(program)
+        if FUSE_SUPERINSTRUCTIONS:
+            self.fused_instructions = fuse(program)
+
+        self.program = program
+        self.index = self.functions[self.current_func].entry
+        return program
+
+    def callers(self):
+        """
+        调用栈上各层调用者的函数名，最外层在前
+        """
+        return [self.owners[self.call_frames[depth] - 1] for depth in range(self.call_depth)]
+
+    def startBudget(self):
+        """
+        开始一次运行的计时
+        :return: 下一次检查限额时的指令数
+        """
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.max_time if self.max_time is not None else None
+        return self.checkBudget(self.executed)
+
+    def checkBudget(self, executed):
+        """
+        检查限额，超出时抛出 BudgetExceeded
+        指令数以外的限额每隔 BUDGET_CHECK_INTERVAL 条指令检查一次，检查点不会越过指令数限额
+        :param executed: 已执行的指令数
+        :return: 下一次检查限额时的指令数
+        """
+        if self.max_instructions is not None and executed >= self.max_instructions:
+            self.budgetExceeded("instructions", executed)
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.budgetExceeded("time", executed)
+        if self.max_memory is not None and self.memory.allocated() > self.max_memory:
+            self.budgetExceeded("memory", executed)
+
+        checkpoint = executed + BUDGET_CHECK_INTERVAL
+        if self.max_instructions is not None and checkpoint > self.max_instructions:
+            checkpoint = self.max_instructions
+        return checkpoint
+
+    def budgetExceeded(self, limit, executed):
+        raise BudgetExceeded(limit, executed, self.current_func, time.perf_counter() - self.started,
+                             self.memory.allocated())
+
+    def run(self, code=None):
+        """
+        解释执行汇编代码
+        超出限额时在两条指令之间抛出 BudgetExceeded，限额每隔若干条指令才检查一次，对执行速度几乎没有影响
+        :param code: 要执行的汇编代码，为None时从当前位置继续执行已装载的程序
+        :return: 程序的输出
+        """
+        if code is not None:
+            self.load(code)
+
+        program = self.program
+        program_size = len(program)
+        executed = self.executed
+        checkpoint = self.startBudget()
+        try:
+            while self.index < program_size:
+                # 取完指令，index自增
+                instruction = program[self.index]
+                self.index += 1
+                executed += instruction.length
+                # 运行指令
+                instruction.handler(self, instruction)
+                if executed >= checkpoint:
+                    checkpoint = self.checkBudget(executed)
+        finally:
+            self.executed = executed
+            self.flushOutput()
+        return self.output
+
+
+output = ''  # 上次调用 run 的输出
+machine = None  # 上次调用 run 所用的虚拟机
+
+
+def run(code, memory_size=MEMORY_SIZE, stack_top=None, data_base=0):
+    """
+      解释执行汇编代码，每次调用使用一台新的虚拟机，输出保存在 output 中
+      :param code: 要执行的汇编代码
+      :param memory_size: 地址空间大小（字节），内存按页在首次写入时分配，可远大于程序实际使用的内存
+      :param stack_top: 栈顶地址，默认为地址空间的末尾
+      :param data_base: 数据段的起始地址，默认为0
+      :return: Nothing?
+    """
+    global output, machine
 
-            register = Register_Table[destination]
-            register.insert(register.get() + source_value)
+    machine = Machine(memory_size, stack_top, data_base, CompileController)
+    try:
+        machine.run(code)
+    finally:
+        output = machine.output
 
-        else:
-            raise RuntimeError("add指令的参数量错误，共有%d个参数" % len(segment))
 
-    # 减法指令sub 通用形式：sub destination, source
-    elif segment[0] == "sub":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+def readOperand(registers, operand):
+    """
+    读取寄存器或立即数操作数的值
+    """
+    if operand.is_register:
+        register = operand.value
+        return registers[register.index] & register.mask
+    return operand.value
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("sub指令的目的操作数错误, %s" % destination)
+def resolve(program, functions):
+    """
+    装载时将跳转与调用指令的标签、函数名解析为目标指令下标，记入指令记录的 target
+    标签只在跳转指令所属的函数内查找；找不到的标签与函数译码为执行到时才抛出错误的指令，内置函数的 target 为None
+    :param program: 指令记录列表，原地修改
+    :param functions: 函数名 -> Func
+    :return: 每行指令所属的函数名，不属于任何函数的行为None
+    """
+    owners = [None] * len(program)
+    for name, func in functions.items():
+        end = func.ret if func.ret is not None else len(program) - 1
+        for index in range(func.entry - 1, end + 1):
+            owners[index] = name
+
+    for index, instruction in enumerate(program):
+        if instruction.handler in (jmp, jne, je):
+            label = instruction.operands[0].value
+            owner = owners[index]
+            if owner is None or label not in functions[owner].labels:
+                program[index] = Instruction(ERROR_OPCODE, ("未找到标签: %s" % label,), instruction.text)
+            else:
+                instruction.target = functions[owner].labels[label]
+        elif instruction.handler is call:
+            func_name = instruction.operands[0].value
+            if func_name in functions:
+                instruction.target = functions[func_name].entry
+            elif func_name not in inset_func:
+                program[index] = Instruction(ERROR_OPCODE, ("未找到函数: %s" % func_name,), instruction.text)
+    return owners
 
-            source = segment[2]
-            addressing_mode = addressing(source)
 
-            source_value = getValueByAddressing(addressing_mode, source)
+def guardFlagAccess(program):
+    """
+    直接读写 CF/OF/SF/ZF 寄存器的指令改为先展开惰性标志位再执行，使其读写到的标志位与逐项保存时相同
+    :param program: 指令记录列表，原地修改
+    """
+    for index, instruction in enumerate(program):
+        if any(isinstance(operand, Operand) and operand.is_register and operand.value.index in FLAG_FUNCTIONS
+               for operand in instruction.operands):
+            program[index] = Instruction(FLAG_ACCESS_OPCODE, (instruction,), instruction.text)
 
-            register = Register_Table[destination]
-            register.insert(register.get() - source_value)
 
-        else:
-            raise RuntimeError("sub指令的参数量错误，共有%d个参数" % len(segment))
+# 空指令：空行、标签与伪指令
+@register_instruction("nop", decoder=decodeWithoutOperand)
+def nop(machine, instruction):
+    pass
 
-    # 整数乘法指令imul 通用形式：imul destination, source
-    elif segment[0] == "imul":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
 
-            addressing_mode = addressing(destination)
+# 译码期发现的错误，执行到时才抛出
+@register_instruction(".error")
+def error(machine, instruction):
+    raise RuntimeError(instruction.operands[0])
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("imul指令的目的操作数错误, %s" % destination)
 
-            source = segment[2]
-            addressing_mode = addressing(source)
+@register_instruction(".unknown")
+def unknown(machine, instruction):
+    print("无法识别的指令: ", instruction.operands[0])
 
-            source_value = getValueByAddressing(addressing_mode, source)
 
-            register = Register_Table[destination]
-            register.insert(register.get() * source_value)
+# 读写标志寄存器的指令，见 guardFlagAccess
+@register_instruction(".flag_access")
+def flag_access(machine, instruction):
+    materializeFlags(machine.registers)
+    original = instruction.operands[0]
+    original.handler(machine, original)
 
-        else:
-            raise RuntimeError("imul指令的参数量错误，共有%d个参数" % len(segment))
 
-    # 整数除法指令idiv 通用形式：idiv operand
-    # idiv指令实现的有些粗糙，可能出现问题
-    elif segment[0] == "idiv":
-        if len(segment) == 2:
-            operand = segment[1]
-            addressing_mode = addressing(operand)
+NOP_INSTRUCTION = Instruction(opcode_table["nop"])
+ERROR_OPCODE = opcode_table[".error"]
+UNKNOWN_OPCODE = opcode_table[".unknown"]
+FLAG_ACCESS_OPCODE = opcode_table[".flag_access"]
 
-            if addressing_mode == AddressingMode.REGISTER:
-                rax = Register_Table['rax']
-                rdx = Register_Table['rdx']
 
-                src = rax.get()
+# push指令:将数据压入栈中 通用形式：push ( source | offset source )
+@register_instruction("push", decoder=decodePush)
+def push(machine, instruction):
+    registers = machine.registers
+    source = instruction.operands[0]
 
-                rax.insert(src // getValueByAddressing(addressing_mode, operand))
-                rdx.insert(src % getValueByAddressing(addressing_mode, operand))
-            else:
-                raise RuntimeError("idiv指令的源操作数错误, %s" % operand)
+    if source.is_register:
+        register = source.value
+        source_value = registers[register.index] & register.mask
+    elif source.mode == AddressingMode.MEMORY:
+        source_value = machine.memory.get(source.value.evaluate(registers), 8)
+    elif source.mode == AddressingMode.OFFSET:
+        source_value = machine.variables[source.value].pos
+    else:
+        source_value = source.value
 
-        else:
-            raise RuntimeError("idiv指令的参数量错误，共有%d个参数" % len(segment))
-
-    # cqo指令, 将rax的值扩展到rdx:rax中
-    elif segment[0] == "cqo":
-        if len(segment) == 1:
-            pass
-            # 将rax的值扩展到rdx:rax中
-            # 模拟器还未模拟到如此深度，所以暂时不实现
-        else:
-            raise RuntimeError("cqo指令的参数量错误，共有%d个参数" % len(segment))
+    stack_top = (registers[RSP] - 8) & MAX_64BIT_UNSIGNED_INT
+    registers[RSP] = stack_top
+    machine.memory.insert(stack_top, source_value, 8)
 
-    # 比较指令cmp 通用形式：cmp operand1 operand2
-    elif segment[0] == "cmp":
-        if len(segment) == 3:
 
-            operand1 = segment[1][:-1]
-            operand2 = segment[2]
+# pop指令:将数据从栈中弹出 通用形式：pop destination
+@register_instruction("pop", decoder=decodePop)
+def pop(machine, instruction):
+    registers = machine.registers
+    register = instruction.operands[0].value
+    index = register.index
 
-            operand1_addressing_mode = addressing(operand1)
-            operand2_addressing_mode = addressing(operand2)
+    stack_top = registers[RSP]
+    registers[index] = registers[index] & register.keep | machine.memory.get(stack_top, register.size)
+    registers[RSP] = (stack_top + 8) & MAX_64BIT_UNSIGNED_INT
 
-            operand1_value = getValueByAddressing(operand1_addressing_mode, operand1)
-            operand2_value = getValueByAddressing(operand2_addressing_mode, operand2)
 
-            cmp_result = operand1_value - operand2_value
+# 加法指令add 通用形式：add destination, source
+@register_instruction("add", decoder=decodeRegisterValue)
+def add(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    index = register.index
+    value = (registers[index] & register.mask) + readOperand(registers, source)
+    registers[index] = registers[index] & register.keep | value & register.mask
 
-            if cmp_result == 0:
-                Register_Table['ZF'].insert(1)
-            else:
-                Register_Table['ZF'].insert(0)
 
-            if cmp_result < 0:
-                Register_Table['SF'].insert(1)
-            else:
-                Register_Table['SF'].insert(0)
+# 减法指令sub 通用形式：sub destination, source
+@register_instruction("sub", decoder=decodeRegisterValue)
+def sub(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    index = register.index
+    value = (registers[index] & register.mask) - readOperand(registers, source)
+    registers[index] = registers[index] & register.keep | value & register.mask
 
-            # TODO 溢出标志位实现不够完善
-            if cmp_result > MAX_64BIT_INT or cmp_result < -MAX_64BIT_INT:
-                Register_Table['OF'].insert(1)
-            else:
-                Register_Table['OF'].insert(0)
 
-            if cmp_result > 0:
-                Register_Table['CF'].insert(1)
-            else:
-                Register_Table['CF'].insert(0)
+# 整数乘法指令imul 通用形式：imul destination, source
+@register_instruction("imul", decoder=decodeRegisterValue)
+def imul(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) * readOperand(registers, source))
 
-        else:
-            raise RuntimeError("cmp指令的参数量错误，共有%d个参数" % len(segment))
 
-    # 设置标志位指令sete 通用形式：sete destination
-    elif segment[0] == "sete":
-        if len(segment) == 2:
-            destination = segment[1]
-            addressing_mode = addressing(destination)
+# 整数除法指令idiv 通用形式：idiv operand
+# idiv指令实现的有些粗糙，可能出现问题
+@register_instruction("idiv", decoder=decodeRegister)
+def idiv(machine, instruction):
+    registers = machine.registers
+    src = registers[RAX]
+    divisor = readOperand(registers, instruction.operands[0])
 
-            if addressing_mode == AddressingMode.REGISTER:
-                if Register_Table['ZF'].get() == 1:
-                    Register_Table[destination].insert(1)
-                else:
-                    Register_Table[destination].insert(0)
+    registers[RAX] = (src // divisor) & MAX_64BIT_UNSIGNED_INT
+    registers[RDX] = (src % divisor) & MAX_64BIT_UNSIGNED_INT
 
-            else:
-                raise RuntimeError("sete指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("sete指令的参数量错误，共有%d个参数" % len(segment))
+# cqo指令, 将rax的值扩展到rdx:rax中
+# 模拟器还未模拟到如此深度，所以暂时不实现
+@register_instruction("cqo", decoder=decodeWithoutOperand)
+def cqo(machine, instruction):
+    pass
 
-    # 设置标志位指令setne 通用形式：setne destination
-    elif segment[0] == "setne":
-        if len(segment) == 2:
-            destination = segment[1]
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                if Register_Table['ZF'].get() == 0:
-                    Register_Table[destination].insert(1)
-                else:
-                    Register_Table[destination].insert(0)
+# 比较指令cmp 通用形式：cmp operand1 operand2
+@register_instruction("cmp", decoder=decodeCompare)
+def cmp(machine, instruction):
+    registers = machine.registers
+    operand1, operand2 = instruction.operands
+    # 只记录差值，标志位在用到时才由差值算出
+    registers[FLAGS] = readOperand(registers, operand1) - readOperand(registers, operand2)
 
-            else:
-                raise RuntimeError("setne指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("setne指令的参数量错误，共有%d个参数" % len(segment))
+# 由 cmp 的差值计算各标志位
+def zeroFlag(cmp_result):
+    return 1 if cmp_result == 0 else 0
 
-    # 设置标志位指令setl 通用形式：setl destination
-    elif segment[0] == "setl":
-        if len(segment) == 2:
-            destination = segment[1]
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                if Register_Table['SF'].get() != Register_Table['OF'].get():
-                    Register_Table[destination].insert(1)
-                else:
-                    Register_Table[destination].insert(0)
+def signFlag(cmp_result):
+    return 1 if cmp_result < 0 else 0
 
-            else:
-                raise RuntimeError("setl指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("setl指令的参数量错误，共有%d个参数" % len(segment))
+def overflowFlag(cmp_result):
+    # TODO 溢出标志位实现不够完善
+    return 1 if cmp_result > MAX_64BIT_INT or cmp_result < -MAX_64BIT_INT else 0
 
-    # 设置标志位指令setle 通用形式：setle destination
-    elif segment[0] == "setle":
-        if len(segment) == 2:
-            destination = segment[1]
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                if Register_Table['ZF'].get() == 1 or Register_Table['SF'].get() != Register_Table['OF'].get():
-                    Register_Table[destination].insert(1)
-                else:
-                    Register_Table[destination].insert(0)
+def carryFlag(cmp_result):
+    return 1 if cmp_result > 0 else 0
 
-            else:
-                raise RuntimeError("setle指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("setle指令的参数量错误，共有%d个参数" % len(segment))
+FLAG_FUNCTIONS = {CF: carryFlag, OF: overflowFlag, SF: signFlag, ZF: zeroFlag}
 
-    # movzb指令，用于将一个字节（8位）的无符号整数值零扩展并移动到指定寄存器。
-    # movzb destination, source
-    # "move zero-extend byte"。
-    elif segment[0] == "movzb":
-        if len(segment) == 3:
 
-            destination = segment[1][:-1]
+def materializeFlags(registers):
+    """
+    将惰性标志位展开到 CF/OF/SF/ZF 四项，此后以这四项为准，直到下一次 cmp
+    """
+    cmp_result = registers[FLAGS]
+    if cmp_result is not None:
+        for index, flag in FLAG_FUNCTIONS.items():
+            registers[index] = flag(cmp_result)
+        registers[FLAGS] = None
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                source = segment[2]
-                addressing_mode = addressing(source)
-                source_value = getValueByAddressing(addressing_mode, source)
-                # TODO 0扩展 依照现在版本的模拟程度， 0扩展不需要实现
+# 条件码：ZF == 1、SF != OF、ZF == 1 or SF != OF
+def isEqual(registers):
+    cmp_result = registers[FLAGS]
+    if cmp_result is None:
+        return registers[ZF] == 1
+    return cmp_result == 0
 
-                Register_Table[destination].insert(source_value)
 
-            else:
-                raise RuntimeError("movzb指令的目的操作数错误, %s" % destination)
+def isLess(registers):
+    cmp_result = registers[FLAGS]
+    if cmp_result is None:
+        return registers[SF] != registers[OF]
+    return signFlag(cmp_result) != overflowFlag(cmp_result)
 
-        else:
-            raise RuntimeError("movzb指令的参数量错误，共有%d个参数" % len(segment))
 
-    # movsx指令，用于将一个字节（8位）的有符号整数值符号扩展并移动到指定寄存器。
-    # movsx destination, source
-    elif segment[0] == "movsx":
-        if len(segment) == 5:
+def isLessEqual(registers):
+    return isEqual(registers) or isLess(registers)
 
-            destination = segment[1][:-1]
 
-            addressing_mode = addressing(destination)
+def setRegister(registers, register, condition):
+    index = register.index
+    registers[index] = registers[index] & register.keep | (1 if condition else 0)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                source = segment[4]
-                addressing_mode = addressing(source)
-                if addressing_mode == AddressingMode.MEMORY:
-                    source_value = Memory.get(getMemoryAddress(source), 1)
-                else:
-                    source_value = getValueByAddressing(addressing_mode, source)
-                Register_Table[destination].insert(source_value)
 
+# 设置标志位指令sete 通用形式：sete destination
+@register_instruction("sete", decoder=decodeRegister)
+def sete(machine, instruction):
+    registers = machine.registers
+    setRegister(registers, instruction.operands[0].value, isEqual(registers))
 
-            else:
-                raise RuntimeError("movsb指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("movsb指令的参数量错误，共有%d个参数" % len(segment))
-    # movss指令，用于将一个双字（32位）的单精度浮点数值移动到指定寄存器。
-    # movss destination, source
-    elif segment[0] == "movss":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+# 设置标志位指令setne 通用形式：setne destination
+@register_instruction("setne", decoder=decodeRegister)
+def setne(machine, instruction):
+    registers = machine.registers
+    setRegister(registers, instruction.operands[0].value, not isEqual(registers))
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                source = segment[2]
-                addressing_mode = addressing(source)
-                source_value = getValueByAddressing(addressing_mode, source)
+# 设置标志位指令setl 通用形式：setl destination
+@register_instruction("setl", decoder=decodeRegister)
+def setl(machine, instruction):
+    registers = machine.registers
+    setRegister(registers, instruction.operands[0].value, isLess(registers))
 
-                Register_Table[destination].insert(source_value)
-            else:
-                raise RuntimeError("movss指令的目的操作数错误, %s" % destination)
 
-        else:
-            raise RuntimeError("movss指令的参数量错误，共有%d个参数" % len(segment))
-    # movsd指令，用于将一个双字（32位）的双精度浮点数值移动到指定寄存器。
-    elif segment[0] == "movsd":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+# 设置标志位指令setle 通用形式：setle destination
+@register_instruction("setle", decoder=decodeRegister)
+def setle(machine, instruction):
+    registers = machine.registers
+    setRegister(registers, instruction.operands[0].value, isLessEqual(registers))
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode == AddressingMode.REGISTER:
-                source = segment[2]
-                addressing_mode = addressing(source)
-                source_value = getValueByAddressing(addressing_mode, source)
+# movzb指令，用于将一个字节（8位）的无符号整数值零扩展并移动到指定寄存器。
+# movzb destination, source
+# "move zero-extend byte"。
+@register_instruction("movzb", decoder=decodeRegisterValue)
+def movzb(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    # TODO 0扩展 依照现在版本的模拟程度， 0扩展不需要实现
+    destination.value.insert(registers, readOperand(registers, source))
 
-                Register_Table[destination].insert(source_value)
-            else:
-                raise RuntimeError("movsd指令的目的操作数错误, %s" % destination)
 
+# movsx指令，用于将一个字节（8位）的有符号整数值符号扩展并移动到指定寄存器。
+# movsx destination, source
+@register_instruction("movsx", decoder=decodeExtend)
+def movsx(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    if source.mode == AddressingMode.MEMORY:
+        source_value = machine.memory.get(source.value.evaluate(registers), source.value.size or 1)
+    else:
+        source_value = readOperand(registers, source)
+    destination.value.insert(registers, source_value)
+
+
+# movss指令，用于将一个双字（32位）的单精度浮点数值移动到指定寄存器。
+# movss destination, source
+@register_instruction("movss", decoder=decodeRegisterValue)
+def movss(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    destination.value.insert(registers, readOperand(registers, source))
+
+
+# movsd指令，用于将一个双字（32位）的双精度浮点数值移动到指定寄存器。
+@register_instruction("movsd", decoder=decodeRegisterValue)
+def movsd(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    destination.value.insert(registers, readOperand(registers, source))
+
+
+# movsxd指令，用于将一个双字（32位）的符号整数值符号扩展并移动到指定寄存器。
+@register_instruction("movsxd", decoder=decodeExtend)
+def movsxd(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    if source.mode == AddressingMode.MEMORY:
+        source_value = machine.memory.get(source.value.evaluate(registers), source.value.size or 4)
+    else:
+        source_value = readOperand(registers, source)
+    # TODO 符号扩展 依照现在版本的模拟程度， 符号扩展不需要实现
+    destination.value.insert(registers, source_value)
+
+
+# mov指令 mov dest src
+# 将ops的数据传给opd
+@register_instruction("mov", decoder=decodeMov)
+def mov(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    if destination.is_register:
+        register = destination.value
+        index = register.index
+        if source.is_register:
+            value = registers[source.value.index] & source.value.mask
+        elif source.mode == AddressingMode.MEMORY:
+            value = machine.memory.get(source.value.evaluate(registers), register.size)
         else:
-            raise RuntimeError("movsd指令的参数量错误，共有%d个参数" % len(segment))
-    # movsxd指令，用于将一个双字（32位）的符号整数值符号扩展并移动到指定寄存器。
-    elif segment[0] == "movsxd":
-        if len(segment) == 5:
+            value = source.value
+        registers[index] = registers[index] & register.keep | value & register.mask
+    else:
+        register = source.value
+        machine.memory.insert(destination.value.evaluate(registers), registers[register.index] & register.mask, register.size)
 
-            destination = segment[1][:-1]
 
-            addressing_mode = addressing(destination)
+# lea指令 lea destination, source
+# 将source的地址计算结果传给destination，而不会访问source的值
+@register_instruction("lea", decoder=decodeLea)
+def lea(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    destination.value.insert(registers, source.value.evaluate(registers))
 
-            if addressing_mode == AddressingMode.REGISTER:
-                source = segment[4]
-                addressing_mode = addressing(source)
-                if addressing_mode == AddressingMode.MEMORY:
-                    source_value = Memory.get(getMemoryAddress(source), 4)
-                else:
-                    source_value = getValueByAddressing(addressing_mode, source)
-                # TODO 符号扩展 依照现在版本的模拟程度， 符号扩展不需要实现
-                Register_Table[destination].insert(source_value)
 
-            else:
-                raise RuntimeError("movsxd指令的目的操作数错误, %s" % destination)
+# and指令，and eax ebx
+# 逻辑与运算,结果赋值给eax
+@register_instruction("and", decoder=decodeLogic)
+def and_(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) & readOperand(registers, source))
 
-        else:
-            raise RuntimeError("movsxd指令的参数量错误，共有%d个参数" % len(segment))
-
-    # mov指令 mov dest src
-    # 将ops的数据传给opd
-    elif segment[0] == "mov":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
-
-            dest_addr_mode = addressing(destination)
-
-            source = segment[2]
-            src_addr_mode = addressing(source)
-
-            if dest_addr_mode == AddressingMode.REGISTER:
-                if src_addr_mode == AddressingMode.MEMORY:
-                    register = Register_Table[destination]
-                    Memory.get(getMemoryAddress(source), register.size)
-                    register.insert(Memory.get(getMemoryAddress(source), register.size))
-                else:
-                    Register_Table[destination].insert(getValueByAddressing(src_addr_mode, source))
-            elif dest_addr_mode == AddressingMode.MEMORY:
-                if src_addr_mode == AddressingMode.REGISTER:
-                    register = Register_Table[source]
-                    Memory.insert(getMemoryAddress(destination), register.get(), register.size)
-                else:
-                    raise RuntimeError("mov指令的源操作数错误, %s" % source)
-            else:
-                raise RuntimeError("mov指令的目的操作数错误, %s" % destination)
 
+@register_instruction("or", decoder=decodeLogic)
+def or_(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) | readOperand(registers, source))
 
-    # lea指令 lea destination, source
-    # 将source的地址计算结果传给destination，而不会访问source的值
 
-    elif segment[0] == "lea":
-        if len(segment) == 3:
-            op_destination = segment[1][:-1]
-            dest_addr_mode = addressing(op_destination)
+@register_instruction("xor", decoder=decodeLogic)
+def xor(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) ^ readOperand(registers, source))
 
-            op_source = segment[2]
-            src_addr_mode = addressing(op_source)
 
-            if not dest_addr_mode == AddressingMode.REGISTER:
-                raise RuntimeError("lea指令的目的操作数错误, %s" % op_destination)
+@register_instruction("not", decoder=decodeNot)
+def not_(machine, instruction):
+    registers = machine.registers
+    register = instruction.operands[0].value
+    register.insert(registers, ~register.get(registers))
 
-            if src_addr_mode == AddressingMode.MEMORY:
-                Register_Table[op_destination].insert(getMemoryAddress(op_source))
-            else:
-                raise RuntimeError("lea指令的源操作数错误, %s" % op_source)
-
-    # and指令，and eax ebx
-    # 逻辑与运算,结果赋值给eax
-    elif segment[0] == 'and' or segment[0] == 'or':
-        if len(segment) == 3:
-            op_destination = segment[1][:-1]
-            addressing_mode1 = addressing(op_destination)
-            destination_value = getValueByAddressing(addressing_mode1, op_destination)
-
-            op_source = segment[2]
-            addressing_mode2 = addressing(op_source)
-            source_value = getValueByAddressing(addressing_mode2, op_source)
-
-            ret = 0
-            if segment[0] == 'and':
-                ret = destination_value & source_value
-            else:
-                ret = destination_value | source_value
 
-            if addressing_mode1 == AddressingMode.REGISTER:
-                Register_Table[op_destination].insert(ret)
+@register_instruction("shl", "sal", decoder=decodeRegisterValue)
+def shl(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) << readOperand(registers, source))
 
-            elif addressing_mode1 == AddressingMode.MEMORY:
-                if addressing_mode2 == AddressingMode.REGISTER:
-                    register = Register_Table[op_source]
-                    Memory.insert(getMemoryAddress(op_destination), ret, register.size)
-                else:
-                    raise RuntimeError("and指令的源操作数错误, %s" % op_source)
-    elif segment[0] == 'xor':
-        if len(segment) == 3:
-            op_destination = segment[1][:-1]
-            addressing_mode1 = addressing(op_destination)
-            destination_value = getValueByAddressing(addressing_mode1, op_destination)
 
-            op_source = segment[2]
-            addressing_mode2 = addressing(op_source)
-            source_value = getValueByAddressing(addressing_mode2, op_source)
+@register_instruction("shr", "sar", decoder=decodeRegisterValue)
+def shr(machine, instruction):
+    registers = machine.registers
+    destination, source = instruction.operands
+    register = destination.value
+    register.insert(registers, register.get(registers) >> readOperand(registers, source))
 
-            ret = destination_value ^ source_value
 
-            if addressing_mode1 == AddressingMode.REGISTER:
-                Register_Table[op_destination].insert(ret)
+# print指令，调试用。
+@register_instruction("print", decoder=decodeIgnoringOperand)
+def print_(machine, instruction):
+    registers = machine.registers
+    machine.emit("print rax value:" + str(registers[RAX]) + "\n")
 
-            elif addressing_mode1 == AddressingMode.MEMORY:
-                if addressing_mode2 == AddressingMode.REGISTER:
-                    register = Register_Table[op_source]
-                    Memory.insert(getMemoryAddress(op_destination), ret, register.size)
-                else:
-                    raise RuntimeError("xor指令的源操作数错误, %s" % op_source)
-    elif segment[0] == 'not':
-        if len(segment) == 2:
-            op_destination = segment[1][:-1]
-            addressing_mode1 = addressing(op_destination)
-            destination_value = getValueByAddressing(addressing_mode1, op_destination)
 
-            ret = ~destination_value
+@register_instruction("jmp", decoder=decodeSymbol)
+def jmp(machine, instruction):
+    machine.index = instruction.target
 
-            if addressing_mode1 == AddressingMode.REGISTER:
-                Register_Table[op_destination].insert(ret)
 
-            elif addressing_mode1 == AddressingMode.MEMORY:
-                raise RuntimeError("not指令的目的操作数错误, %s" % op_destination)
-    elif segment[0] == "shl":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+@register_instruction("jnz", "jne", decoder=decodeSymbol)
+def jne(machine, instruction):
+    cmp_result = machine.registers[FLAGS]
+    if cmp_result != 0 and (cmp_result is not None or machine.registers[ZF] == 0):
+        machine.index = instruction.target
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("shl指令的目的操作数错误, %s" % destination)
+@register_instruction("je", decoder=decodeSymbol)
+def je(machine, instruction):
+    cmp_result = machine.registers[FLAGS]
+    if cmp_result == 0 or cmp_result is None and machine.registers[ZF] == 1:
+        machine.index = instruction.target
 
-            source = segment[2]
-            addressing_mode = addressing(source)
 
-            source_value = getValueByAddressing(addressing_mode, source)
+def read(machine):
+    addr = getMemoryAddress('[rdi]', machine.registers)
+    machine.memory.insert(addr, machine.stdin.request_input(), 8)
 
-            Register_Table[destination].insert(Register_Table[destination].get() << source_value)
 
-        else:
-            raise RuntimeError("shl指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "shr":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+def write(machine):
+    registers = machine.registers
+    machine.emit(str(registers[RDI]) + '\n')
+
 
-            addressing_mode = addressing(destination)
+@register_instruction("call", decoder=decodeSymbol)
+def call(machine, instruction):
+    target = instruction.target
+    if target is None:  # 内置函数
+        if instruction.operands[0].value == 'read':
+            read(machine)
+        else:
+            write(machine)
+        return
+
+    depth = machine.call_depth
+    try:
+        machine.call_frames[depth] = machine.index
+    except IndexError:
+        machine.call_frames.extend([0] * len(machine.call_frames))
+        machine.call_frames[depth] = machine.index
+    machine.call_depth = depth + 1
+    machine.current_func = instruction.operands[0].value
+    machine.index = target
+
+
+# ret指令，用于从函数中返回 通用形式：ret
+@register_instruction("ret", decoder=decodeIgnoringOperand)
+def ret(machine, instruction):
+    registers = machine.registers
+    if machine.current_func == 'main':
+        machine.emit("return value:" + str(registers[RAX]) + "\n")
+        machine.index = MAX_64BIT_INT
+    else:
+        depth = machine.call_depth - 1
+        index = machine.call_frames[depth]
+        machine.call_depth = depth
+        machine.current_func = machine.owners[index - 1]
+        machine.index = index
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("shr指令的目的操作数错误, %s" % destination)
 
-            source = segment[2]
-            addressing_mode = addressing(source)
+# 超级指令：装载时将 codegen 生成的固定指令序列融合为一条指令，执行效果与原序列相同
+# 融合后的指令记录放在序列的第一行，其余行保留原指令，处理函数执行完整个序列后跳过这些行
+FUSE_SUPERINSTRUCTIONS = True  # 超级指令融合开关
 
-            source_value = getValueByAddressing(addressing_mode, source)
 
-            Register_Table[destination].insert(Register_Table[destination].get() >> source_value)
-        else:
-            raise RuntimeError("shr指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "sar":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
+def isValue(operand):
+    """
+    寄存器或整数立即数操作数
+    """
+    return operand.is_register or operand.mode == AddressingMode.IMMEDIATE and type(operand.value) == int
 
-            addressing_mode = addressing(destination)
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("sar指令的目的操作数错误, %s" % destination)
+def matchPushPop(program, i):
+    """
+    push source / pop destination
+    """
+    push_, pop_ = program[i:i + 2]
+    if isValue(push_.operands[0]) and pop_.operands[0].value.index != RSP:
+        return opcode_table[".push_pop"]
 
-            source = segment[2]
-            addressing_mode = addressing(source)
 
-            source_value = getValueByAddressing(addressing_mode, source)
+def matchPopCompareJump(program, i):
+    """
+    pop destination / cmp operand1, operand2 / je|jne label
+    """
+    pop_, cmp_, jump = program[i:i + 3]
+    if pop_.operands[0].value.index != RSP and isValue(cmp_.operands[0]) and isValue(cmp_.operands[1]):
+        return opcode_table[".pop_cmp_je" if instruction_names[jump.op] == "je" else ".pop_cmp_jne"]
 
-            Register_Table[destination].insert(Register_Table[destination].get() >> source_value)
-        else:
-            raise RuntimeError("sar指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "sal":
-        if len(segment) == 3:
-            destination = segment[1][:-1]
 
-            addressing_mode = addressing(destination)
+def matchCompareSetPush(program, i):
+    """
+    cmp operand1, operand2 / setX register / movzb destination, register / push destination
+    """
+    cmp_, set_, movzb_, push_ = program[i:i + 4]
+    if isValue(cmp_.operands[0]) and isValue(cmp_.operands[1]) \
+            and movzb_.operands[1].is_register and push_.operands[0].is_register:
+        return opcode_table[".cmp_set_push"]
 
-            if addressing_mode != AddressingMode.REGISTER:
-                raise RuntimeError("sal指令的目的操作数错误, %s" % destination)
 
-            source = segment[2]
-            addressing_mode = addressing(source)
+# 可融合的指令序列，按序列从长到短匹配
+FUSION_PATTERNS = [
+    (("cmp", ("sete", "setne", "setl", "setle"), "movzb", "push"), matchCompareSetPush),
+    (("pop", "cmp", ("je", "jne", "jnz")), matchPopCompareJump),
+    (("push", "pop"), matchPushPop),
+]
 
-            source_value = getValueByAddressing(addressing_mode, source)
 
-            Register_Table[destination].insert(Register_Table[destination].get() << source_value)
-        else:
-            raise RuntimeError("sal指令的参数量错误，共有%d个参数" % len(segment))
-    # print指令，调试用。
-    elif segment[0] == "print":
-        output += "print rax value:" + str(Register_Table['rax'].get()) + "\n"
-    elif segment[0] == "jmp":
-        if len(segment) == 2:
-            label = segment[1]
-            if label in glb_func[CURRENT_FUNC].labels:
-                RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].labels[label]
-            else:
-                raise RuntimeError("未找到标签: %s" % label)
-        else:
-            raise RuntimeError("jmp指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "jnz":
-        if len(segment) == 2:
-            label = segment[1]
-            if Register_Table['ZF'].get() == 0:
-                if label in glb_func[CURRENT_FUNC].labels:
-                    RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].labels[label]
-                else:
-                    raise RuntimeError("未找到标签: %s" % label)
-        else:
-            raise RuntimeError("jnz指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "je":
-        if len(segment) == 2:
-            label = segment[1]
-            if Register_Table['ZF'].get() == 1:
-                if label in glb_func[CURRENT_FUNC].labels:
-                    RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].labels[label]
-                else:
-                    raise RuntimeError("未找到标签: %s" % label)
-        else:
-            raise RuntimeError("je指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "jne":
-        if len(segment) == 2:
-            label = segment[1]
-            if Register_Table['ZF'].get() == 0:
-                if label in glb_func[CURRENT_FUNC].labels:
-                    RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].labels[label]
-                else:
-                    raise RuntimeError("未找到标签: %s" % label)
-        else:
-            raise RuntimeError("jne指令的参数量错误，共有%d个参数" % len(segment))
-    elif segment[0] == "call":
-        if len(segment) == 2:
-            func_name = segment[1]
-            if func_name in glb_func:
-                PREV_FUNC.append({'func': CURRENT_FUNC, 'index': RUNNING_COMMAND_LINE_INDEX})
-                CURRENT_FUNC = func_name
-                RUNNING_COMMAND_LINE_INDEX = glb_func[CURRENT_FUNC].entry
-            elif func_name in inset_func:
-                if func_name == 'read':
-                    if CompileController is not None:
-                        addr = getMemoryAddress('[rdi]')
-                        Memory.insert(addr, CompileController.request_input(), 8)
-                    else:
-                        addr = getMemoryAddress('[rdi]')
-                        print("请求输入：")
-                        userInput = input()
-                        try:
-                            if userInput.isdigit():
-                                Memory.insert(addr, int(userInput), 8)
-                            elif userInput[0:2] == '0x':
-                                Memory.insert(addr, int(userInput, 16), 8)
-                            elif '.' in userInput:
-                                Memory.insert(addr, float(userInput), 8)
-                            elif 'e' in userInput or 'E' in userInput:
-                                Memory.insert(addr, float(userInput), 8)
-                            elif 'f' in userInput:
-                                Memory.insert(addr, float(userInput), 8)
-                            elif 'd' in userInput:
-                                Memory.insert(addr, float(userInput), 8)
-                            elif userInput[0] == '0':
-                                Memory.insert(addr, int(userInput[1:], 8), 8)
-                            elif userInput[0] == 'b':
-                                Memory.insert(addr, int(userInput[1:], 2), 8)
-                            else:
-                                Memory.insert(addr, int(userInput), 8)
-                        except ValueError:
-                            raise RuntimeError("无法识别的输入: %s" % userInput)
-                elif func_name == 'write':
-                    output += str(Register_Table['rdi'].get()) + '\n'
-            else:
-                raise RuntimeError("未找到函数: %s" % func_name)
-        else:
-            raise RuntimeError("call指令的参数量错误，共有%d个参数" % len(segment))
-    # ret指令，用于从函数中返回 通用形式：ret
-    elif segment[0] == "ret":
-        if CURRENT_FUNC == 'main':
-            output += "return value:" + str(Register_Table['rax'].get()) + "\n"
-            RUNNING_COMMAND_LINE_INDEX = MAX_64BIT_INT
-        else:
-            return_info = PREV_FUNC.pop()
-            CURRENT_FUNC = return_info['func']
-            RUNNING_COMMAND_LINE_INDEX = return_info['index']
-            # rax = register[register_index_table['rax']]
-            # print("return value:", rax)
-            # register = return_info['regs']
-            # register[register_index_table['rax']]= rax
-        # 调试用
-    else:
-        if not (segment[0] == "" or segment[0][0] == "."):
-            # 空指令或标签跳过
-            print("无法识别的指令: ", segment[0])
+def fuse(program):
+    """
+    在指令记录中查找可融合的指令序列，将序列的第一行替换为超级指令
+    序列由相邻的指令组成，中间没有标签，因此不会有跳转落在序列内部
+    :param program: 指令记录列表，原地修改
+    :return: 被融合的指令数
+    """
+    fused_instructions = 0
+
+    i = 0
+    while i < len(program):
+        for mnemonics, match in FUSION_PATTERNS:
+            parts = program[i:i + len(mnemonics)]
+            if len(parts) == len(mnemonics) and all(
+                    instruction_names[part.op] in (names if type(names) == tuple else (names,))
+                    for part, names in zip(parts, mnemonics)):
+                op = match(program, i)
+                if op is not None:
+                    program[i] = Instruction(op, tuple(parts), " / ".join(part.text for part in parts), len(parts))
+                    fused_instructions += len(parts)
+                    i += len(parts) - 1
+                    break
+        i += 1
+    return fused_instructions
+
+
+def popRegister(machine, register):
+    registers = machine.registers
+    index = register.index
+    stack_top = registers[RSP]
+    registers[index] = registers[index] & register.keep | machine.memory.get(stack_top, register.size)
+    registers[RSP] = (stack_top + 8) & MAX_64BIT_UNSIGNED_INT
+
+
+def compareOperands(registers, operand1, operand2):
+    registers[FLAGS] = readOperand(registers, operand1) - readOperand(registers, operand2)
+
+
+# push source / pop destination：数据经栈传入目标寄存器，栈中的数据保持写入后的状态
+@register_instruction(".push_pop")
+def push_pop(machine, instruction):
+    registers = machine.registers
+    push_, pop_ = instruction.operands
+    value = readOperand(registers, push_.operands[0]) & MAX_64BIT_UNSIGNED_INT
+    register = pop_.operands[0].value
+    index = register.index
+
+    stack_top = (registers[RSP] - 8) & MAX_64BIT_UNSIGNED_INT
+    machine.memory.insert(stack_top, value, 8)
+    registers[index] = registers[index] & register.keep | value & register.mask
+    registers[RSP] = (stack_top + 8) & MAX_64BIT_UNSIGNED_INT
+    machine.index += 1
+
+
+# pop destination / cmp operand1, operand2 / je label
+@register_instruction(".pop_cmp_je")
+def pop_cmp_je(machine, instruction):
+    registers = machine.registers
+    pop_, cmp_, jump = instruction.operands
+    popRegister(machine, pop_.operands[0].value)
+    compareOperands(registers, *cmp_.operands)
+    machine.index += 2
+    if registers[FLAGS] == 0:
+        machine.index = jump.target
+
+
+# pop destination / cmp operand1, operand2 / jne label
+@register_instruction(".pop_cmp_jne")
+def pop_cmp_jne(machine, instruction):
+    registers = machine.registers
+    pop_, cmp_, jump = instruction.operands
+    popRegister(machine, pop_.operands[0].value)
+    compareOperands(registers, *cmp_.operands)
+    machine.index += 2
+    if registers[FLAGS] != 0:
+        machine.index = jump.target
+
+
+# cmp operand1, operand2 / setX register / movzb destination, register / push destination：gen_binary 生成的比较
+@register_instruction(".cmp_set_push")
+def cmp_set_push(machine, instruction):
+    registers = machine.registers
+    cmp_, set_, movzb_, push_ = instruction.operands
+    compareOperands(registers, *cmp_.operands)
+    set_.handler(machine, set_)
+
+    source = movzb_.operands[1].value
+    register = movzb_.operands[0].value
+    index = register.index
+    registers[index] = registers[index] & register.keep | registers[source.index] & source.mask & register.mask
+
+    register = push_.operands[0].value
+    stack_top = (registers[RSP] - 8) & MAX_64BIT_UNSIGNED_INT
+    machine.memory.insert(stack_top, registers[register.index] & register.mask, 8)
+    registers[RSP] = stack_top
+    machine.index += 3
 
 
 if __name__ == '__main__':
-    Register_Table['rax'].insert(12)
-    print(Register_Table['rax'].get())
+    machine = Machine()
+    Register_Table['rax'].insert(machine.registers, 12)
+    print(Register_Table['rax'].get(machine.registers))
@@ -0,0 +1,852 @@
+"""
+    锁步批量执行：以一组输入同时运行同一个程序
+
+    每一路输入称为一条通道。寄存器与内存以 NumPy 数组保存，多出一维通道维，
+    每条指令对处在同一位置的所有通道只分派一次，以向量运算完成。
+    分支使通道分散到不同位置时，每一步选出调用栈最深、位置最靠前的一组通道执行，
+    其余通道等待，走到同一位置后自然重新汇合。
+
+    每条通道的输出、返回值与执行的指令数与单独运行 Machine 时相同；出错或超出指令数限额的通道单独停下，
+    错误记录在结果中，不影响其他通道。
+
+    需要 NumPy（pip install numpy），未安装时调用 run 会报错，其余模块不受影响。
+
+    用法（在仓库根目录下执行）：
+        python -m compiler.lockstep example/fibonacci.c --inputs inputs.txt > results.jsonl
+    inputs.txt 每行为一条通道的输入，各次 read 的输入以空白分隔。
+"""
+import argparse
+import json
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from compiler import channels, interpreter
+from compiler.interpreter import AddressingMode, MAX_64BIT_INT, MAX_64BIT_UNSIGNED_INT, RAX, RSP, RDI, RDX
+
+LANES = 4096  # 每批最多同时运行的通道数，输入更多时分批运行
+GENERAL_REGISTERS = 16  # 寄存器文件中通用寄存器的项数，标志位另行保存
+
+lane_handlers = {}  # 解释器的处理函数 -> 锁步执行的处理函数
+
+
+def requireNumpy():
+    if numpy is None:
+        raise RuntimeError("锁步批量执行需要安装 NumPy")
+
+
+def register_lane_handler(*handlers):
+    """
+    为指令的处理函数注册锁步执行的处理函数 lane_handler(state, instruction, lanes, line)
+    lanes 为本步执行的通道，line 为指令所在的行；未注册的指令执行到时使通道出错停下
+    """
+
+    def decorator(lane_handler):
+        for handler in handlers:
+            lane_handlers[handler] = lane_handler
+        return lane_handler
+
+    return decorator
+
+
+class LockstepResult:
+    """
+    一批通道的运行结果，均按输入的顺序排列
+    :param outputs: 每条通道的输出
+    :param return_values: 每条通道 main 函数的返回值（numpy.uint64 数组），未正常返回的通道为0
+    :param executed: 每条通道执行的指令数（numpy.int64 数组）
+    :param errors: 每条通道运行中抛出的异常，正常结束的通道为None
+    """
+
+    def __init__(self, outputs, return_values, executed, errors):
+        self.outputs = outputs
+        self.return_values = return_values
+        self.executed = executed
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def ok(self):
+        """
+        每条通道是否正常结束
+        """
+        return numpy.array([error is None for error in self.errors], dtype=bool)
+
+    @staticmethod
+    def concatenate(results):
+        return LockstepResult(sum((result.outputs for result in results), []),
+                              numpy.concatenate([result.return_values for result in results]),
+                              numpy.concatenate([result.executed for result in results]),
+                              sum((result.errors for result in results), []))
+
+
+# 按访问宽度对齐读写时，页按字解释的数据类型（小端序）
+WORD_TYPES = {1: numpy.dtype('<u1'), 2: numpy.dtype('<u2'), 4: numpy.dtype('<u4'), 8: numpy.dtype('<u8')} \
+    if numpy is not None else {}
+SIZE_MASKS = interpreter.SIZE_MASKS
+
+
+def fromBytes(data):
+    """
+    (通道数, 字节数) 的小端序字节数组转换为 numpy.uint64 数组
+    """
+    count, size = data.shape
+    if size in WORD_TYPES:
+        return numpy.ascontiguousarray(data).view(WORD_TYPES[size]).reshape(count).astype(numpy.uint64)
+    padded = numpy.zeros((count, 8), dtype=numpy.uint8)
+    padded[:, :size] = data
+    return padded.view('<u8').reshape(count).astype(numpy.uint64)
+
+
+def toBytes(value, count):
+    """
+    numpy.uint64 数组或标量转换为 (通道数, 8) 的小端序字节数组
+    """
+    words = numpy.empty(count, dtype='<u8')
+    words[:] = value
+    return words.view(numpy.uint8).reshape(count, 8)
+
+
+class LaneMemory:
+    """
+    各通道的内存，按页保存，每页为 (通道数, 页大小) 的字节数组
+    通道首次写入某页前，读到的都是装载时的内容，该页在所有通道间共用一份
+    :param memory: 装载完成的虚拟机的内存
+    :param lanes: 通道数
+    """
+
+    def __init__(self, memory, lanes):
+        self.size = memory.size
+        self.page_size = memory.page_size
+        self.page_shift = memory.page_shift
+        self.offset_mask = memory.offset_mask
+        self.lanes = lanes
+        self.shared = {number: numpy.frombuffer(bytes(page), dtype=numpy.uint8)
+                       for number, page in memory.pages.items()}
+        self.pages = {}
+
+    def page(self, number):
+        """
+        取出各通道独有的页，首次写入时由共用的内容复制
+        """
+        page = self.pages.get(number)
+        if page is None:
+            page = numpy.zeros((self.lanes, self.page_size), dtype=numpy.uint8)
+            shared = self.shared.get(number)
+            if shared is not None:
+                page[:] = shared
+            self.pages[number] = page
+        return page
+
+    def allocated(self):
+        """
+        每条通道已分配的内存大小（字节），与 MemoryClass.allocated 相同
+        """
+        return len(self.shared.keys() | self.pages.keys()) * self.page_size
+
+    def readAt(self, lanes, position, size):
+        """
+        所有通道读同一地址，地址已检查不越界
+        :return: numpy.uint64 数组或标量
+        """
+        offset = position & self.offset_mask
+        if offset + size > self.page_size:
+            return None
+        number = position >> self.page_shift
+        page = self.pages.get(number)
+        if page is None:
+            shared = self.shared.get(number)
+            if shared is None:
+                return numpy.uint64(0)
+            return numpy.uint64(int.from_bytes(shared[offset:offset + size].tobytes(), 'little'))
+        if offset % size == 0:
+            return page.view(WORD_TYPES[size])[lanes, offset // size].astype(numpy.uint64)
+        return fromBytes(page[lanes, offset:offset + size])
+
+    def writeAt(self, lanes, position, value, size):
+        """
+        所有通道写同一地址，地址已检查不越界
+        :return: 是否已写入，跨页时返回 False
+        """
+        offset = position & self.offset_mask
+        if offset + size > self.page_size:
+            return False
+        page = self.page(position >> self.page_shift)
+        if offset % size == 0:
+            page.view(WORD_TYPES[size])[lanes, offset // size] = value & numpy.uint64(SIZE_MASKS[size])
+        else:
+            count = self.lanes if type(lanes) == slice else len(lanes)
+            page[lanes, offset:offset + size] = toBytes(value, count)[:, :size]
+        return True
+
+    def read(self, ids, address, size):
+        """
+        读出每条通道在各自地址上的无符号整数，地址已检查不越界
+        :param ids: 通道下标数组
+        :param address: 各通道的地址，numpy.uint64 数组
+        :return: numpy.uint64 数组
+        """
+        offset = address & numpy.uint64(self.offset_mask)
+        if (offset % numpy.uint64(size)).any():
+            return fromBytes(self.gather(ids, address, size))
+        # 对齐的访问不会跨页，按字读出
+        numbers = address >> numpy.uint64(self.page_shift)
+        columns = (offset // numpy.uint64(size)).astype(numpy.intp)
+        values = numpy.zeros(len(ids), dtype=numpy.uint64)
+        unique = self.numbers(numbers)
+        for number in unique:
+            selected = slice(None) if len(unique) == 1 else numbers == number
+            page = self.pages.get(int(number))
+            if page is not None:
+                values[selected] = page.view(WORD_TYPES[size])[ids[selected], columns[selected]]
+            elif int(number) in self.shared:
+                values[selected] = self.shared[int(number)].view(WORD_TYPES[size])[columns[selected]]
+        return values
+
+    def write(self, ids, address, value, size):
+        """
+        将每条通道的无符号整数写入各自的地址，地址已检查不越界
+        """
+        offset = address & numpy.uint64(self.offset_mask)
+        value = numpy.broadcast_to(value, address.shape)
+        if (offset % numpy.uint64(size)).any():
+            self.scatter(ids, address, toBytes(value, len(ids))[:, :size])
+            return
+        numbers = address >> numpy.uint64(self.page_shift)
+        columns = (offset // numpy.uint64(size)).astype(numpy.intp)
+        value = value & numpy.uint64(SIZE_MASKS[size])
+        unique = self.numbers(numbers)
+        for number in unique:
+            selected = slice(None) if len(unique) == 1 else numbers == number
+            self.page(int(number)).view(WORD_TYPES[size])[ids[selected], columns[selected]] = value[selected]
+
+    def gather(self, ids, address, size):
+        """
+        读出每条通道在各自地址上的 size 个字节
+        :param ids: 通道下标数组
+        :param address: 各通道的地址，numpy.uint64 数组
+        :return: (通道数, size) 的字节数组
+        """
+        offset = (address & self.offset_mask).astype(numpy.intp)
+        if (offset > self.page_size - size).any():
+            # 跨页访问逐字节读出
+            data = numpy.empty((len(ids), size), dtype=numpy.uint8)
+            for k in range(size):
+                data[:, k] = self.gather(ids, address + numpy.uint64(k), 1)[:, 0]
+            return data
+
+        numbers = address >> numpy.uint64(self.page_shift)
+        data = numpy.zeros((len(ids), size), dtype=numpy.uint8)
+        columns = offset[:, None] + numpy.arange(size)
+        unique = self.numbers(numbers)
+        for number in unique:
+            selected = slice(None) if len(unique) == 1 else numbers == number
+            page = self.pages.get(int(number))
+            if page is not None:
+                data[selected] = page[ids[selected][:, None], columns[selected]]
+            elif int(number) in self.shared:
+                data[selected] = self.shared[int(number)][columns[selected]]
+        return data
+
+    def scatter(self, ids, address, data):
+        """
+        将每条通道的字节写入各自的地址
+        :param data: (通道数, size) 的字节数组
+        """
+        size = data.shape[1]
+        offset = (address & self.offset_mask).astype(numpy.intp)
+        if (offset > self.page_size - size).any():
+            for k in range(size):
+                self.scatter(ids, address + numpy.uint64(k), data[:, k:k + 1])
+            return
+
+        numbers = address >> numpy.uint64(self.page_shift)
+        columns = offset[:, None] + numpy.arange(size)
+        unique = self.numbers(numbers)
+        for number in unique:
+            selected = slice(None) if len(unique) == 1 else numbers == number
+            self.page(int(number))[ids[selected][:, None], columns[selected]] = data[selected]
+
+    @staticmethod
+    def numbers(numbers):
+        """
+        访问涉及的页号，通常所有通道访问同一页
+        """
+        if (numbers == numbers[0]).all():
+            return numbers[:1]
+        return numpy.unique(numbers)
+
+
+class Lockstep:
+    """
+    锁步批量执行的状态，以一台装载完成的虚拟机为起点，每条通道由它的当前状态出发
+    :param machine: 已装载程序的虚拟机，其状态不会被修改
+    :param inputs: 每条通道的输入，形式与 Machine 的 stdin 相同，见 channels.inputSource
+    :param max_instructions: 每条通道最多执行的指令数，为None时不限
+    """
+
+    def __init__(self, machine, inputs, max_instructions=None):
+        requireNumpy()
+
+        count = len(inputs)
+        self.count = count
+        self.program = machine.program
+        self.owners = machine.owners
+        self.variables = machine.variables
+        self.handlers = [laneHandler(instruction) for instruction in self.program]
+        self.max_instructions = max_instructions
+        self.ids = numpy.arange(count)
+        self.stdin = [channels.inputSource(source) for source in inputs]
+
+        registers = machine.registers
+        self.registers = numpy.empty((GENERAL_REGISTERS, count), dtype=numpy.uint64)
+        self.registers[:] = numpy.array(registers[:GENERAL_REGISTERS], dtype=numpy.uint64)[:, None]
+        self.equal = numpy.full(count, interpreter.isEqual(registers), dtype=bool)
+        self.less = numpy.full(count, interpreter.isLess(registers), dtype=bool)
+        self.memory = LaneMemory(machine.memory, count)
+
+        self.index = numpy.full(count, machine.index, dtype=numpy.int64)
+        self.frames = numpy.zeros((max(interpreter.CALL_STACK_SIZE, 2 * machine.call_depth), count),
+                                  dtype=numpy.int64)
+        self.frames[:machine.call_depth] = numpy.array(machine.call_frames[:machine.call_depth],
+                                                       dtype=numpy.int64)[:, None]
+        self.depth = numpy.full(count, machine.call_depth, dtype=numpy.int64)
+        self.executed = numpy.full(count, machine.executed, dtype=numpy.int64)
+
+        self.alive = numpy.ones(count, dtype=bool)
+        self.outputs = [[] for t in range(count)]
+        self.return_values = numpy.zeros(count, dtype=numpy.uint64)
+        self.errors = [None] * count
+
+        self.next_line = 0  # 本步执行后各通道一致的下一行
+        self.scattered = False  # 本步执行后各通道的下一行不同，已分别写入 index
+        self.diverged = True  # 本步之后是否需要重新分组
+
+    # ---- 通道的读写 ----
+
+    def laneIds(self, lanes):
+        return self.ids if type(lanes) == slice else lanes
+
+    def read(self, operand, lanes):
+        """
+        读取寄存器或立即数操作数，立即数返回标量
+        """
+        if operand.is_register:
+            return self.get(operand.value, lanes)
+        return numpy.uint64(operand.value & MAX_64BIT_UNSIGNED_INT)
+
+    def get(self, register, lanes):
+        value = self.registers[register.index, lanes]
+        return value if register.size == 8 else value & numpy.uint64(register.mask)
+
+    def insert(self, register, lanes, value):
+        """
+        写入寄存器，保留未覆盖的高位，与 Register.insert 相同
+        """
+        if register.size == 8:
+            self.registers[register.index, lanes] = value
+        else:
+            row = self.registers[register.index]
+            row[lanes] = row[lanes] & numpy.uint64(register.keep) | value & numpy.uint64(register.mask)
+
+    def address(self, address, lanes):
+        """
+        计算各通道的内存操作数地址
+        """
+        value = numpy.uint64(address.displacement & MAX_64BIT_UNSIGNED_INT)
+        if address.base is not None:
+            value = self.get(interpreter.Register_Table[address.base], lanes) + value
+        if address.index is not None:
+            value = value + self.get(interpreter.Register_Table[address.index], lanes) * numpy.uint64(address.scale)
+        if numpy.ndim(value) == 0:
+            value = numpy.full(len(self.laneIds(lanes)), value, dtype=numpy.uint64)
+        return value
+
+    def checkAddress(self, lanes, address, size):
+        """
+        越界访问的通道出错停下，其地址改为0以便其余通道继续执行
+        """
+        bad = address > numpy.uint64(self.memory.size - size)
+        if bad.any():
+            ids = self.laneIds(lanes)
+            for lane, value in zip(ids[bad].tolist(), address[bad].tolist()):
+                if value > MAX_64BIT_INT:
+                    value -= MAX_64BIT_UNSIGNED_INT + 1
+                self.fail(lane, RuntimeError("内存访问越界: 地址 %d, 大小 %d" % (value, size)))
+            address = numpy.where(bad, numpy.uint64(0), address)
+        return address
+
+    def load(self, lanes, address, size):
+        """
+        读出各通道内存中的无符号整数，与 MemoryClass.get 相同
+        """
+        position = int(address[0])
+        if (address == address[0]).all() and position <= self.memory.size - size:
+            # 各通道访问同一地址，如调用栈深度相同时的局部变量
+            value = self.memory.readAt(lanes, position, size)
+            if value is not None:
+                return value
+        address = self.checkAddress(lanes, address, size)
+        return self.memory.read(self.laneIds(lanes), address, size)
+
+    def store(self, lanes, address, value, size):
+        """
+        写入各通道内存，与 MemoryClass.insert 相同
+        """
+        position = int(address[0])
+        if (address == address[0]).all() and position <= self.memory.size - size and \
+                self.memory.writeAt(lanes, position, value, size):
+            return
+        address = self.checkAddress(lanes, address, size)
+        self.memory.write(self.laneIds(lanes), address, value, size)
+
+    def emit(self, lanes, texts):
+        for lane, text in zip(self.laneIds(lanes).tolist(), texts):
+            self.outputs[lane].append(text)
+
+    def fail(self, lane, error):
+        if self.alive[lane]:
+            self.alive[lane] = False
+            self.errors[lane] = error
+            self.diverged = True
+
+    def jump(self, lanes, taken, target, line):
+        """
+        条件跳转：taken 为各通道是否跳转
+        """
+        if taken.all():
+            self.next_line = target
+        elif taken.any():
+            self.index[self.laneIds(lanes)] = numpy.where(taken, target, line + 1)
+            self.scattered = True
+
+    # ---- 执行 ----
+
+    def group(self):
+        """
+        选出下一步执行的通道：调用栈最深、位置最靠前的一组
+        :return: (通道, 所在行, 其余通道中最小的排序键)
+        """
+        finished = self.alive & (self.index >= len(self.program))
+        self.alive &= ~finished
+
+        live = numpy.flatnonzero(self.alive)
+        if len(live) == 0:
+            return None, None, None
+        keys = self.index[live] - self.depth[live] * (len(self.program) + 1)
+        key = keys.min()
+        selected = keys == key
+        if selected.all():
+            lanes = slice(None) if len(live) == self.count else live
+            rest = None
+        else:
+            lanes = live[selected]
+            rest = keys[~selected].min()
+        return lanes, int(self.index[live[selected.argmax()]]), rest
+
+    def run(self):
+        """
+        运行到所有通道结束或出错
+        同一组通道连续执行，直到分支使其分散、有通道出错停下，或其余通道中有排序键不大于本组的（此时两组汇合）
+        :return LockstepResult: 运行结果
+        """
+        program = self.program
+        program_size = len(program)
+        handlers = self.handlers
+        max_instructions = self.max_instructions
+        started = time.perf_counter()
+
+        def budgetExceeded(ids):
+            for lane in ids[self.executed[ids] >= max_instructions].tolist():
+                self.fail(lane, interpreter.BudgetExceeded(
+                    "instructions", int(self.executed[lane]), self.owners[min(int(self.index[lane]), program_size - 1)],
+                    time.perf_counter() - started, self.memory.allocated()))
+
+        if max_instructions is not None:
+            budgetExceeded(self.ids)
+
+        lanes = None
+        line = depth = 0
+        rest = None
+        executed = 0  # 本组通道自分组以来执行的指令数，重新分组时计入各通道
+        budget = None  # 本组通道中最先达到限额者还能执行的指令数
+
+        while True:
+            if self.diverged or self.scattered or line >= program_size or \
+                    rest is not None and line - depth * (program_size + 1) >= rest:
+                if lanes is not None:
+                    ids = self.laneIds(lanes)
+                    if not self.scattered:
+                        self.index[ids] = line
+                    self.executed[ids] += executed
+                    if budget is not None and executed >= budget:
+                        # 与 Machine.run 相同，达到限额的通道在这条指令之后停下
+                        budgetExceeded(ids)
+                self.diverged = self.scattered = False
+                lanes, line, rest = self.group()
+                if lanes is None:
+                    break
+                depth = int(self.depth[self.laneIds(lanes)[0]])
+                executed = 0
+                if max_instructions is not None:
+                    budget = max_instructions - int(self.executed[lanes].max())
+
+            instruction = program[line]
+            self.next_line = line + instruction.length
+            handlers[line](self, instruction, lanes, line)
+            executed += instruction.length
+
+            if not self.scattered:
+                if instruction.handler is interpreter.call and instruction.target is not None:
+                    depth += 1
+                line = self.next_line
+            if budget is not None and executed >= budget:
+                self.diverged = True
+
+        return LockstepResult(["".join(output) for output in self.outputs], self.return_values,
+                              self.executed, self.errors)
+
+
+def laneHandler(instruction):
+    """
+    查找指令的锁步处理函数，不支持的指令与操作数在执行到时使通道出错停下
+    """
+    parts = instruction.operands if instruction.length > 1 else (instruction,)
+    for part in parts:
+        reason = unsupported(part)
+        if reason is not None:
+            return lambda state, instruction, lanes, line: failLanes(state, lanes, RuntimeError(
+                "锁步批量执行不支持%s: %s" % (reason, part.text)))
+    if instruction.length > 1:
+        return fused
+    return lane_handlers[instruction.handler]
+
+
+# 操作数为标签或函数名的指令；push 的非整数常量由 lanePush 按解释器的方式处理
+SYMBOL_HANDLERS = (interpreter.jmp, interpreter.jne, interpreter.je, interpreter.call, interpreter.push)
+
+
+def unsupported(instruction):
+    if instruction.handler not in lane_handlers:
+        return "该指令"
+    for operand in instruction.operands:
+        if not isinstance(operand, interpreter.Operand):
+            continue
+        value = operand.value
+        if operand.is_register and value.index >= GENERAL_REGISTERS:
+            return "直接读写标志寄存器"
+        if operand.mode == AddressingMode.MEMORY and not value.linear:
+            return "该内存操作数"
+        if operand.mode == AddressingMode.IMMEDIATE and type(value) == float:
+            return "浮点数"
+        if operand.mode == AddressingMode.IMMEDIATE and type(value) == str and instruction.handler not in SYMBOL_HANDLERS:
+            return "非整数的常量"
+    if instruction.handler is interpreter.cmp and (
+            not instruction.operands[0].is_register and instruction.operands[0].value < 0
+            or not instruction.operands[1].is_register and instruction.operands[1].value > MAX_64BIT_UNSIGNED_INT):
+        return "该比较"
+    return None
+
+
+def failLanes(state, lanes, error):
+    for lane in state.laneIds(lanes).tolist():
+        state.fail(lane, error)
+
+
+def fused(state, instruction, lanes, line):
+    """
+    超级指令：依次执行组成它的指令
+    """
+    for k, part in enumerate(instruction.operands):
+        state.next_line = line + k + 1
+        lane_handlers[part.handler](state, part, lanes, line + k)
+        if state.scattered:
+            return
+
+
+@register_lane_handler(interpreter.nop, interpreter.cqo)
+def laneNop(state, instruction, lanes, line):
+    pass
+
+
+@register_lane_handler(interpreter.error)
+def laneError(state, instruction, lanes, line):
+    failLanes(state, lanes, RuntimeError(instruction.operands[0]))
+
+
+@register_lane_handler(interpreter.unknown)
+def laneUnknown(state, instruction, lanes, line):
+    for lane in state.laneIds(lanes):
+        print("无法识别的指令: ", instruction.operands[0])
+
+
+@register_lane_handler(interpreter.push)
+def lanePush(state, instruction, lanes, line):
+    source = instruction.operands[0]
+    if source.mode == AddressingMode.MEMORY:
+        value = state.load(lanes, state.address(source.value, lanes), 8)
+    elif source.mode == AddressingMode.OFFSET:
+        value = numpy.uint64(state.variables[source.value].pos)
+    elif source.mode == AddressingMode.IMMEDIATE and type(source.value) != int:
+        # codegen 对一元负号生成的 push None：与 Memory.insert 相同，只移动栈指针，不写入内存
+        state.registers[RSP, lanes] -= numpy.uint64(8)
+        return
+    else:
+        value = state.read(source, lanes)
+
+    stack_top = state.registers[RSP, lanes] - numpy.uint64(8)
+    state.registers[RSP, lanes] = stack_top
+    state.store(lanes, stack_top, value, 8)
+
+
+@register_lane_handler(interpreter.pop)
+def lanePop(state, instruction, lanes, line):
+    register = instruction.operands[0].value
+    stack_top = state.registers[RSP, lanes].copy()
+    value = state.load(lanes, stack_top, register.size)
+    if register.size == 8:
+        state.registers[register.index, lanes] = value
+    else:
+        row = state.registers[register.index]
+        row[lanes] = row[lanes] & numpy.uint64(register.keep) | value
+    state.registers[RSP, lanes] = stack_top + numpy.uint64(8)
+
+
+def arithmetic(operation):
+    def laneArithmetic(state, instruction, lanes, line):
+        destination, source = instruction.operands
+        register = destination.value
+        state.insert(register, lanes, operation(state.read(destination, lanes), state.read(source, lanes)))
+
+    return laneArithmetic
+
+
+# 无符号64位整数的运算按 2^64 取模，与解释器中先运算再按寄存器宽度掩码的结果相同
+register_lane_handler(interpreter.add)(arithmetic(lambda a, b: a + b))
+register_lane_handler(interpreter.sub)(arithmetic(lambda a, b: a - b))
+register_lane_handler(interpreter.imul)(arithmetic(lambda a, b: a * b))
+register_lane_handler(interpreter.and_)(arithmetic(lambda a, b: a & b))
+register_lane_handler(interpreter.or_)(arithmetic(lambda a, b: a | b))
+register_lane_handler(interpreter.xor)(arithmetic(lambda a, b: a ^ b))
+# 移位数不小于64时结果为0，与 Python 整数移位后掩码的结果相同
+register_lane_handler(interpreter.shl)(arithmetic(
+    lambda a, b: numpy.where(b < 64, a << numpy.minimum(b, numpy.uint64(63)), numpy.uint64(0))))
+register_lane_handler(interpreter.shr)(arithmetic(
+    lambda a, b: numpy.where(b < 64, a >> numpy.minimum(b, numpy.uint64(63)), numpy.uint64(0))))
+
+
+@register_lane_handler(interpreter.not_)
+def laneNot(state, instruction, lanes, line):
+    register = instruction.operands[0].value
+    state.insert(register, lanes, ~state.read(instruction.operands[0], lanes))
+
+
+@register_lane_handler(interpreter.idiv)
+def laneIdiv(state, instruction, lanes, line):
+    src = state.registers[RAX, lanes].copy()  # 全部通道参与时取到的是视图
+    divisor = state.read(instruction.operands[0], lanes)
+    zero = divisor == 0
+    if zero.any():
+        for lane in state.laneIds(lanes)[zero].tolist():
+            state.fail(lane, ZeroDivisionError("integer division or modulo by zero"))
+        divisor = numpy.where(zero, numpy.uint64(1), divisor)
+    state.registers[RAX, lanes] = src // divisor
+    state.registers[RDX, lanes] = src % divisor
+
+
+@register_lane_handler(interpreter.cmp)
+def laneCmp(state, instruction, lanes, line):
+    operand1, operand2 = instruction.operands
+    a = state.read(operand1, lanes)
+    if not operand2.is_register and operand2.value < 0:
+        # 差值为正且不为0，只有溢出标志位取决于差值的大小
+        state.equal[lanes] = False
+        state.less[lanes] = a > numpy.uint64(max(MAX_64BIT_INT + operand2.value, 0)) \
+            if -operand2.value <= MAX_64BIT_INT else True
+        return
+    b = state.read(operand2, lanes)
+    below = a < b
+    difference = numpy.where(below, b - a, a - b)
+    # isLess 为 SF != OF：SF 即 a < b，OF 为差值的绝对值超过 MAX_64BIT_INT
+    state.equal[lanes] = a == b
+    state.less[lanes] = below != (difference > numpy.uint64(MAX_64BIT_INT))
+
+
+def setCondition(condition):
+    def laneSet(state, instruction, lanes, line):
+        state.insert(instruction.operands[0].value, lanes, condition(state, lanes).astype(numpy.uint64))
+
+    return laneSet
+
+
+register_lane_handler(interpreter.sete)(setCondition(lambda state, lanes: state.equal[lanes]))
+register_lane_handler(interpreter.setne)(setCondition(lambda state, lanes: ~state.equal[lanes]))
+register_lane_handler(interpreter.setl)(setCondition(lambda state, lanes: state.less[lanes]))
+register_lane_handler(interpreter.setle)(setCondition(lambda state, lanes: state.equal[lanes] | state.less[lanes]))
+
+
+@register_lane_handler(interpreter.movzb, interpreter.movss, interpreter.movsd)
+def laneMove(state, instruction, lanes, line):
+    destination, source = instruction.operands
+    state.insert(destination.value, lanes, state.read(source, lanes))
+
+
+@register_lane_handler(interpreter.movsx, interpreter.movsxd)
+def laneExtend(state, instruction, lanes, line):
+    destination, source = instruction.operands
+    if source.mode == AddressingMode.MEMORY:
+        default_size = 1 if instruction.handler is interpreter.movsx else 4
+        value = state.load(lanes, state.address(source.value, lanes), source.value.size or default_size)
+    else:
+        value = state.read(source, lanes)
+    state.insert(destination.value, lanes, value)
+
+
+@register_lane_handler(interpreter.mov)
+def laneMov(state, instruction, lanes, line):
+    destination, source = instruction.operands
+    if destination.is_register:
+        register = destination.value
+        if source.mode == AddressingMode.MEMORY:
+            value = state.load(lanes, state.address(source.value, lanes), register.size)
+        else:
+            value = state.read(source, lanes)
+        state.insert(register, lanes, value)
+    else:
+        register = source.value
+        state.store(lanes, state.address(destination.value, lanes), state.read(source, lanes), register.size)
+
+
+@register_lane_handler(interpreter.lea)
+def laneLea(state, instruction, lanes, line):
+    destination, source = instruction.operands
+    state.insert(destination.value, lanes, state.address(source.value, lanes))
+
+
+@register_lane_handler(interpreter.print_)
+def lanePrint(state, instruction, lanes, line):
+    state.emit(lanes, ["print rax value:%d\n" % value for value in state.registers[RAX, lanes].tolist()])
+
+
+@register_lane_handler(interpreter.jmp)
+def laneJmp(state, instruction, lanes, line):
+    state.next_line = instruction.target
+
+
+@register_lane_handler(interpreter.je)
+def laneJe(state, instruction, lanes, line):
+    state.jump(lanes, state.equal[lanes], instruction.target, line)
+
+
+@register_lane_handler(interpreter.jne)
+def laneJne(state, instruction, lanes, line):
+    state.jump(lanes, ~state.equal[lanes], instruction.target, line)
+
+
+@register_lane_handler(interpreter.call)
+def laneCall(state, instruction, lanes, line):
+    ids = state.laneIds(lanes)
+    if instruction.target is None:  # 内置函数
+        if instruction.operands[0].value == 'read':
+            laneRead(state, ids)
+        else:
+            state.emit(ids, ["%d\n" % value for value in state.registers[RDI, ids].tolist()])
+        return
+
+    depth = state.depth[ids]
+    if depth.max() >= len(state.frames):
+        state.frames = numpy.concatenate([state.frames, numpy.zeros_like(state.frames)])
+    state.frames[depth, ids] = line + 1
+    state.depth[ids] = depth + 1
+    state.next_line = instruction.target
+
+
+def laneRead(state, ids):
+    values = []
+    for lane in ids.tolist():
+        try:
+            values.append(state.stdin[lane].request_input())
+        except Exception as e:
+            state.fail(lane, e)
+            values.append(0)
+    # 与 MemoryClass.insert 相同，非整数的输入不写入内存
+    written = numpy.array([type(value) == int for value in values], dtype=bool)
+    for value in values:
+        if type(value) != int:
+            print("value:", value)
+    if written.any():
+        ids = ids[written]
+        values = [value & MAX_64BIT_UNSIGNED_INT for value, keep in zip(values, written) if keep]
+        state.store(ids, state.registers[RDI, ids], numpy.array(values, dtype=numpy.uint64), 8)
+
+
+@register_lane_handler(interpreter.ret)
+def laneRet(state, instruction, lanes, line):
+    ids = state.laneIds(lanes)
+    if state.owners[line] == 'main':
+        values = state.registers[RAX, ids]
+        state.emit(ids, ["return value:%d\n" % value for value in values.tolist()])
+        state.return_values[ids] = values
+        state.next_line = len(state.program)
+        return
+
+    depth = state.depth[ids] - 1
+    state.depth[ids] = depth
+    state.index[ids] = state.frames[depth, ids]
+    state.scattered = True
+
+
+def run(code, inputs, max_instructions=None, lanes=LANES, memory_size=interpreter.MEMORY_SIZE, stack_top=None,
+        data_base=0):
+    """
+    以每组输入各运行一次汇编代码
+    :param code: 要执行的汇编代码
+    :param inputs: 每条通道的输入，形式与 Machine 的 stdin 相同
+    :param max_instructions: 每条通道最多执行的指令数，为None时不限
+    :param lanes: 每批最多同时运行的通道数
+    :return LockstepResult: 运行结果
+    """
+    requireNumpy()
+    machine = interpreter.Machine(memory_size, stack_top, data_base)
+    machine.load(code)
+    inputs = list(inputs)
+    results = [Lockstep(machine, inputs[start:start + lanes], max_instructions).run()
+               for start in range(0, len(inputs), lanes)]
+    if not results:
+        return LockstepResult([], numpy.zeros(0, dtype=numpy.uint64), numpy.zeros(0, dtype=numpy.int64), [])
+    return LockstepResult.concatenate(results)
+
+
+def main(argv=None):
+    from compiler import batch
+
+    parser = argparse.ArgumentParser(prog="python -m compiler.lockstep", description="以多组输入锁步运行同一个 C 程序")
+    parser.add_argument("source", help="C 源文件")
+    parser.add_argument("--inputs", required=True, help="输入文件，每行为一条通道的输入，各次 read 的输入以空白分隔")
+    parser.add_argument("--max-instructions", type=int, default=None, help="每条通道最多执行的指令数")
+    parser.add_argument("--lanes", type=int, default=LANES, help="每批最多同时运行的通道数")
+    args = parser.parse_args(argv)
+
+    with open(args.source, encoding='utf-8') as f:
+        assembly = batch.compileSource(f.read())
+    with open(args.inputs, encoding='utf-8') as f:
+        inputs = [line.split() for line in f if line.strip() != '']
+
+    start = time.perf_counter()
+    result = run(assembly, inputs, args.max_instructions, args.lanes)
+    for lane in range(len(result)):
+        entry = {"lane": lane, "ok": result.errors[lane] is None, "output": result.outputs[lane],
+                 "return_value": int(result.return_values[lane]), "instructions": int(result.executed[lane])}
+        if result.errors[lane] is not None:
+            entry["error"] = "%s: %s" % (type(result.errors[lane]).__name__, result.errors[lane])
+        sys.stdout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    sys.stderr.write("%d lanes, %.2fs\n" % (len(result), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
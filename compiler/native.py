@@ -0,0 +1,530 @@
+"""
+    本机执行后端
+
+    codegen 生成的是 Intel 语法的 x86-64 汇编代码，在 x86-64 Linux 上可以交给本机的 gcc/as 汇编，
+    与一个很小的运行时（程序入口与内置函数 read/write，不依赖 C 标准库）链接为静态可执行文件，
+    以子进程运行，并以 resource 限制其 CPU 时间与地址空间。同一段汇编代码只构建一次，之后可反复运行。
+
+    运行结果的格式与解释器相同：write 每次输出一行数值，main 返回时输出 "return value:N"。
+    crossCheck 以同一输入分别在解释器与本机上运行，比较两者的输出与返回值，
+    解释器对有符号运算的模拟还不完整（如 idiv、sar、movsx），两者不一致时可据此定位。
+
+    codegen 的输出中有几种本机汇编器不接受的写法（push/pop 子寄存器、mov cl, rdi、超出32位的立即数压栈），
+    构建前由 legalize 改写为等价的指令序列；浮点数常量以不带前缀的十六进制压栈，本机后端不支持；
+    一元负号 -x 生成的 push None 按 0 - x 的本意改写为 push 0。
+
+    用法（在仓库根目录下执行）：
+        python -m compiler.native example/fibonacci.c --input 15
+        python -m compiler.native example/rsa.c --check
+"""
+import argparse
+import hashlib
+import os
+import platform
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from compiler import interpreter
+
+COMPILER = "gcc"
+COMPILE_FLAGS = ["-nostdlib", "-static", "-no-pie", "-fno-pie", "-ffreestanding", "-fno-stack-protector",
+                 "-mgeneral-regs-only", "-O2"]
+CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), "pybicc-native")
+
+# 运行时：程序入口与内置函数，以系统调用直接读写标准输入输出
+# read 与解释器相同：逐行读取输入，跳过空行，按 channels.parseInput 的规则解析，向 [rdi] 写入8个字节
+RUNTIME_SOURCE = r'''
+typedef unsigned long u64;
+
+static long syscall3(long number, long a, long b, long c) {
+    long result;
+    __asm__ volatile ("syscall" : "=a"(result) : "a"(number), "D"(a), "S"(b), "d"(c) : "rcx", "r11", "memory");
+    return result;
+}
+
+static char output[8192];
+static long output_length;
+
+static void flush(void) {
+    long offset = 0;
+    while (offset < output_length) {
+        long written = syscall3(1, 1, (long)(output + offset), output_length - offset);
+        if (written <= 0)
+            break;
+        offset += written;
+    }
+    output_length = 0;
+}
+
+static void put(const char *text, long length) {
+    for (long i = 0; i < length; i++) {
+        if (output_length == sizeof(output))
+            flush();
+        output[output_length++] = text[i];
+    }
+}
+
+static void putUnsigned(u64 value) {
+    char digits[24];
+    int i = 24;
+    do {
+        digits[--i] = '0' + value % 10;
+        value /= 10;
+    } while (value);
+    put(digits + i, 24 - i);
+}
+
+static long length(const char *text) {
+    long n = 0;
+    while (text[n])
+        n++;
+    return n;
+}
+
+__attribute__((noreturn)) static void fail(const char *message, const char *detail) {
+    flush();
+    syscall3(1, 2, (long)message, length(message));
+    syscall3(1, 2, (long)detail, length(detail));
+    syscall3(1, 2, (long)"\n", 1);
+    syscall3(231, 1, 0, 0);
+    for (;;) {
+    }
+}
+
+static char input[4096];
+static long input_length, input_position;
+static int input_closed;
+
+static int nextChar(void) {
+    if (input_position == input_length) {
+        long n;
+        if (input_closed)
+            return -1;
+        n = syscall3(0, 0, (long)input, sizeof(input));
+        if (n <= 0) {
+            input_closed = 1;
+            return -1;
+        }
+        input_length = n;
+        input_position = 0;
+    }
+    return (unsigned char)input[input_position++];
+}
+
+static int isSpace(int c) {
+    return c == ' ' || c == '\t' || c == '\r' || c == '\n' || c == '\v' || c == '\f';
+}
+
+static int digitValue(int c) {
+    if (c >= '0' && c <= '9')
+        return c - '0';
+    if (c >= 'a' && c <= 'z')
+        return c - 'a' + 10;
+    if (c >= 'A' && c <= 'Z')
+        return c - 'A' + 10;
+    return 99;
+}
+
+static u64 parseDigits(const char *line, const char *text, int base) {
+    u64 value = 0;
+    if (*text == 0)
+        fail("无法识别的输入: ", line);
+    for (; *text; text++) {
+        int digit = digitValue(*text);
+        if (digit >= base)
+            fail("无法识别的输入: ", line);
+        value = value * base + digit;
+    }
+    return value;
+}
+
+static int contains(const char *text, char c) {
+    for (; *text; text++)
+        if (*text == c)
+            return 1;
+    return 0;
+}
+
+static u64 parseInput(const char *line) {
+    int digits = 1;
+    for (const char *p = line; *p; p++)
+        if (*p < '0' || *p > '9')
+            digits = 0;
+    if (digits)
+        return parseDigits(line, line, 10);
+    if (line[0] == '0' && line[1] == 'x')
+        return parseDigits(line, line + 2, 16);
+    if (contains(line, '.') || contains(line, 'e') || contains(line, 'E') || contains(line, 'f') ||
+        contains(line, 'd'))
+        fail("本机后端不支持浮点数输入: ", line);
+    if (line[0] == '0')
+        return parseDigits(line, line + 1, 8);
+    if (line[0] == 'b')
+        return parseDigits(line, line + 1, 2);
+    if (line[0] == '-')
+        return -parseDigits(line, line + 1, 10);
+    if (line[0] == '+')
+        return parseDigits(line, line + 1, 10);
+    return parseDigits(line, line, 10);
+}
+
+__attribute__((weak)) u64 read(u64 *address) {
+    char line[256];
+    long start, end;
+    for (;;) {
+        int c = nextChar();
+        end = 0;
+        if (c < 0)
+            fail("输入已耗尽", "");
+        while (c >= 0 && c != '\n') {
+            if (end < (long)sizeof(line) - 1)
+                line[end++] = c;
+            c = nextChar();
+        }
+        start = 0;
+        while (start < end && isSpace(line[start]))
+            start++;
+        while (end > start && isSpace(line[end - 1]))
+            end--;
+        if (end > start)
+            break;
+    }
+    line[end] = 0;
+    *address = parseInput(line + start);
+    return 0;
+}
+
+__attribute__((weak)) u64 write(u64 value) {
+    putUnsigned(value);
+    put("\n", 1);
+    return 0;
+}
+
+void __pybicc_exit(u64 value) {
+    put("return value:", 13);
+    putUnsigned(value);
+    put("\n", 1);
+    flush();
+    syscall3(231, 0, 0, 0);
+}
+
+__asm__(".text\n"
+        ".global _start\n"
+        "_start:\n"
+        "    xor %ebp, %ebp\n"
+        "    and $-16, %rsp\n"
+        "    call main\n"
+        "    mov %rax, %rdi\n"
+        "    call __pybicc_exit\n"
+        "    hlt\n");
+'''
+
+PTR_NAMES = {1: "byte", 2: "word", 4: "dword", 8: "qword"}
+RETURN_VALUE = re.compile(r"^return value:(\d+)$", re.M)
+
+
+def available():
+    """
+    本机后端是否可用：x86-64 Linux 且安装了 gcc
+    """
+    return sys.platform.startswith("linux") and platform.machine().lower() in ("x86_64", "amd64") \
+        and shutil.which(COMPILER) is not None
+
+
+def registerView(register, size):
+    """
+    与寄存器共用同一项、宽度为 size 的寄存器名
+    """
+    for name, view in interpreter.Register_Table.items():
+        if view.index == register.index and view.size == size:
+            return name
+    return None
+
+
+def legalizeLine(line):
+    """
+    将一行本机汇编器不接受的汇编代码改写为等价的指令序列，不改变标志位
+    :return: 改写后的各行
+    """
+    segment = line.strip().split(" ", 1)
+    if len(segment) != 2:
+        return [line]
+    name, operands = segment[0], segment[1].strip()
+
+    if name == "push" and operands == "None":
+        # codegen 对一元负号 -x 生成 push None 作为 0 - x 的被减数，本机按其本意压入0
+        # 解释器执行该行时只移动栈指针、不写入内存，栈上残留的值为0时两者一致
+        return ["  push 0"]
+
+    if name in ("push", "pop"):
+        register = interpreter.Register_Table.get(operands)
+        if register is not None and register.size != 8 and register.index < interpreter.CF:
+            ptr = PTR_NAMES[register.size]
+            if name == "pop":
+                # 与解释器相同，弹出栈顶的低位，栈指针加8
+                return ["  mov %s, %s ptr [rsp]" % (operands, ptr), "  lea rsp, [rsp+8]"]
+            # 与解释器相同，压入零扩展到8字节的值
+            return ["  lea rsp, [rsp-8]", "  mov qword ptr [rsp], 0", "  mov %s ptr [rsp], %s" % (ptr, operands)]
+        if name == "push" and register is None:
+            try:
+                value = int(operands, 0)
+            except ValueError:
+                return [line]
+            if not -2 ** 31 <= value < 2 ** 31:
+                return ["  mov r11, %s" % operands, "  push r11"]
+
+    elif name == "mov":
+        parts = [part.strip() for part in operands.split(",")]
+        if len(parts) == 2 and parts[0] in interpreter.Register_Table and parts[1] in interpreter.Register_Table:
+            destination = interpreter.Register_Table[parts[0]]
+            source = interpreter.Register_Table[parts[1]]
+            if destination.size != source.size:
+                # 与解释器相同，取源寄存器的低位
+                return ["  mov %s, %s" % (parts[0], registerView(source, destination.size))]
+    return [line]
+
+
+def legalize(code):
+    """
+    将 codegen 生成的汇编代码改写为本机汇编器接受的形式
+    :param code: 汇编代码
+    :return: 改写后的汇编代码
+    """
+    lines = []
+    for line in code.split("\n"):
+        lines.extend(legalizeLine(line))
+    lines.append('.section .note.GNU-stack,"",@progbits')
+    return "\n".join(lines) + "\n"
+
+
+def compileFiles(arguments, output):
+    """
+    调用 gcc，失败时以其报错抛出 RuntimeError
+    """
+    process = subprocess.run([COMPILER] + arguments + ["-o", output], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError("本机构建失败:\n%s" % process.stderr.strip())
+
+
+class NativeResult:
+    """
+    一次本机运行的结果
+    :param output: 程序的标准输出
+    :param returncode: 进程的退出码，被信号终止时为负的信号编号
+    :param error: 运行时报告的错误，正常结束时为None
+    :param elapsed: 墙钟时间（秒）
+    """
+
+    def __init__(self, output, returncode, error, elapsed):
+        self.output = output
+        self.returncode = returncode
+        self.error = error
+        self.elapsed = elapsed
+
+    def returnValue(self):
+        return returnValue(self.output)
+
+
+def returnValue(output):
+    """
+    从输出中取出 main 函数的返回值，没有返回时为None
+    """
+    values = RETURN_VALUE.findall(output)
+    return int(values[-1]) if values else None
+
+
+class NativeProgram:
+    """
+    构建完成的本机程序，可反复运行
+    :param path: 可执行文件路径
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def execute(self, stdin='', max_time=None, max_memory=None):
+        """
+        以子进程运行程序
+        :param stdin: 输入，文本、bytes 或逐次 read 的输入组成的列表
+        :param max_time: 最长的运行时间（秒），同时限制 CPU 时间与墙钟时间，为None时不限
+        :param max_memory: 地址空间的上限（字节），为None时不限
+        :return NativeResult: 运行结果；超出运行时间时抛出 BudgetExceeded
+        """
+        if isinstance(stdin, (list, tuple)):
+            stdin = "".join("%s\n" % value for value in stdin)
+        if isinstance(stdin, str):
+            stdin = stdin.encode('utf-8')
+
+        def limit():
+            import resource
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+            if max_time is not None:
+                seconds = int(max_time) + 1
+                resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds))
+            if max_memory is not None:
+                resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+        start = time.perf_counter()
+        try:
+            process = subprocess.run([self.path], input=stdin or b'', capture_output=True, timeout=max_time,
+                                     preexec_fn=limit)
+        except subprocess.TimeoutExpired:
+            raise interpreter.BudgetExceeded("time", 0, None, time.perf_counter() - start, 0)
+        elapsed = time.perf_counter() - start
+
+        if process.returncode == -signal.SIGXCPU:
+            raise interpreter.BudgetExceeded("time", 0, None, elapsed, 0)
+        error = None
+        if process.returncode < 0:
+            error = "程序因信号 %s 终止" % signal.Signals(-process.returncode).name
+        elif process.returncode != 0:
+            error = process.stderr.decode('utf-8', 'replace').strip() or "程序的退出码为%d" % process.returncode
+        return NativeResult(process.stdout.decode('utf-8', 'replace'), process.returncode, error, elapsed)
+
+    def run(self, stdin='', max_time=None, max_memory=None):
+        """
+        运行程序，与 Machine.run 相同返回输出，出错时抛出 RuntimeError
+        """
+        result = self.execute(stdin, max_time, max_memory)
+        if result.error is not None:
+            raise RuntimeError(result.error)
+        return result.output
+
+
+def build(code, directory=None):
+    """
+    构建本机程序，以改写后的汇编代码与运行时的摘要为名缓存在目录中，同一段汇编代码只构建一次
+    :param code: codegen 生成的汇编代码
+    :param directory: 缓存目录，默认为临时目录下的 pybicc-native
+    :return NativeProgram: 本机程序
+    """
+    if not available():
+        raise RuntimeError("本机后端需要 x86-64 Linux 与 %s" % COMPILER)
+    directory = directory or CACHE_DIRECTORY
+    os.makedirs(directory, exist_ok=True)
+
+    # 以改写后的汇编代码与运行时为键，legalize 或运行时改变后不会取到旧的构建
+    legalized = legalize(code)
+    runtime_key = hashlib.sha256((RUNTIME_SOURCE + " ".join(COMPILE_FLAGS)).encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(directory, hashlib.sha256((runtime_key + legalized).encode('utf-8')).hexdigest()[:32])
+    if os.path.exists(path):
+        return NativeProgram(path)
+
+    runtime = os.path.join(directory, "runtime-%s.o" % runtime_key)
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        if not os.path.exists(runtime):
+            source = os.path.join(work, "runtime.c")
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(RUNTIME_SOURCE)
+            compileFiles(COMPILE_FLAGS + ["-c", source], os.path.join(work, "runtime.o"))
+            os.replace(os.path.join(work, "runtime.o"), runtime)
+
+        assembly = os.path.join(work, "program.s")
+        with open(assembly, 'w', encoding='utf-8') as f:
+            f.write(legalized)
+        compileFiles(COMPILE_FLAGS + [assembly, runtime], os.path.join(work, "program"))
+        os.replace(os.path.join(work, "program"), path)
+    return NativeProgram(path)
+
+
+class CrossCheck:
+    """
+    同一输入在解释器与本机上的运行结果
+    :param interpreted: 解释器的输出
+    :param interpreted_error: 解释器抛出的错误，正常结束时为None
+    :param native: 本机运行的 NativeResult
+    """
+
+    def __init__(self, interpreted, interpreted_error, native):
+        self.interpreted = interpreted
+        self.interpreted_error = interpreted_error
+        self.native = native
+
+    def matches(self):
+        """
+        两者的输出（含返回值）相同，且都正常结束或都出错
+        """
+        return self.interpreted == self.native.output and \
+            (self.interpreted_error is None) == (self.native.error is None)
+
+    def report(self):
+        """
+        不一致时给出第一处不同的输出行
+        """
+        if self.matches():
+            return "一致，返回值 %s" % returnValue(self.interpreted)
+        lines = []
+        interpreted = self.interpreted.split("\n")
+        native = self.native.output.split("\n")
+        for number, (left, right) in enumerate(zip(interpreted, native)):
+            if left != right:
+                lines.append("第%d行输出不同: 解释器 %r, 本机 %r" % (number + 1, left, right))
+                break
+        else:
+            if len(interpreted) != len(native):
+                lines.append("输出行数不同: 解释器 %d行, 本机 %d行" % (len(interpreted), len(native)))
+        lines.append("返回值: 解释器 %s, 本机 %s" % (returnValue(self.interpreted), self.native.returnValue()))
+        if self.interpreted_error is not None or self.native.error is not None:
+            lines.append("错误: 解释器 %s, 本机 %s" % (self.interpreted_error, self.native.error))
+        return "\n".join(lines)
+
+
+def crossCheck(code, stdin='', program=None, max_instructions=None, max_time=None):
+    """
+    以同一输入分别在解释器与本机上运行，比较输出与返回值
+    :param code: 汇编代码
+    :param stdin: 输入，文本或逐次 read 的输入组成的列表
+    :param program: 已构建的本机程序，为None时构建
+    :param max_instructions: 解释器最多执行的指令数
+    :param max_time: 两者各自最长的运行时间（秒）
+    :return CrossCheck: 比较结果
+    """
+    if program is None:
+        program = build(code)
+    machine = interpreter.Machine(stdin=stdin, max_instructions=max_instructions, max_time=max_time)
+    error = None
+    try:
+        machine.run(code)
+    except Exception as e:
+        error = e
+    return CrossCheck(machine.output, error, program.execute(stdin, max_time))
+
+
+def main(argv=None):
+    from compiler import batch
+
+    parser = argparse.ArgumentParser(prog="python -m compiler.native", description="将 C 程序构建为本机程序并运行")
+    parser.add_argument("source", help="C 源文件或汇编文件（.s）")
+    parser.add_argument("--input", action="append", default=[], help="程序的一行输入，可重复给出")
+    parser.add_argument("--check", action="store_true", help="同时在解释器中运行并比较结果")
+    parser.add_argument("--timeout", type=float, default=None, help="最长的运行时间（秒）")
+    parser.add_argument("--max-memory", type=int, default=None, help="地址空间的上限（字节）")
+    args = parser.parse_args(argv)
+
+    with open(args.source, encoding='utf-8') as f:
+        code = f.read()
+    if not args.source.endswith(".s"):
+        code = batch.compileSource(code)
+    program = build(code)
+
+    if args.check:
+        check = crossCheck(code, args.input, program, max_time=args.timeout)
+        sys.stdout.write(check.native.output)
+        print(check.report())
+        return 0 if check.matches() else 1
+
+    result = program.execute(args.input, args.timeout, args.max_memory)
+    sys.stdout.write(result.output)
+    if result.error is not None:
+        sys.stderr.write(result.error + "\n")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+    目标文件格式与装载缓存
+
+    目标文件保存装载完成时虚拟机的全部静态内容：译码后的指令记录（含融合的超级指令与已解析的跳转目标）、
+    数据段的内存页、函数表（入口、返回位置、标签）与全局变量表。装载目标文件只需一次读取与反序列化，
+    不再对汇编代码做文本解析。
+
+    文件布局（小端序）：
+        头部  magic "PYBO" | 版本 u16 | marshal 格式版本 u16 | 数据段基址 u64 | 汇编代码的 SHA-256 | 正文长度 u32 | 正文 CRC32 u32
+        正文  marshal 序列化的元组：内存操作数、操作数与指令记录三张表（见 ObjectWriter），程序各行引用的指令，
+              各行所属的函数，函数表，全局变量表，数据段的内存页，以及入口位置等装载状态
+
+    装载缓存以汇编代码与虚拟机布局的哈希为键：命中内存中的快照时直接恢复，否则读取缓存目录中的目标文件，
+    都没有时才装载汇编代码，并写出目标文件供下次使用。
+
+    用法（在仓库根目录下执行）：
+        python -m compiler.objfile example/rsa.c -o rsa.o
+        python -m compiler.objfile rsa.o --run
+"""
+import argparse
+import hashlib
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+from compiler import interpreter
+
+OBJECT_MAGIC = b"PYBO"
+OBJECT_VERSION = 1
+HEADER = struct.Struct("<4sHHQ32sII")
+
+NOP_REFERENCE = -1  # 程序中被超级指令覆盖的行
+
+
+def assemblyHash(code):
+    """
+    汇编代码的 SHA-256 摘要
+    """
+    return hashlib.sha256(code.encode('utf-8')).digest()
+
+
+class ObjectWriter:
+    """
+    将指令记录展开为只含基本类型的表，交给 marshal 序列化
+    相同的内存操作数与操作数只写入一次，指令记录的操作数以表中的下标引用：
+        非负数为操作数表的下标，负数 -(k+1) 为指令表中第 k 条指令（超级指令的组成指令）
+    """
+
+    def __init__(self):
+        self.addresses = {}  # 内存操作数的字段 -> 下标
+        self.operands = {}  # 操作数的字段 -> 下标
+        self.instructions = []
+
+    def address(self, address):
+        if address.linear:
+            fields = (address.text, address.size, address.base, address.index, address.scale,
+                      address.displacement)
+        else:
+            fields = (address.text,)
+        return self.addresses.setdefault(fields, len(self.addresses))
+
+    def operand(self, operand):
+        if type(operand) in (int, float, str):
+            # 未知指令与译码错误的操作数为原文或错误信息
+            fields = (None, 'f' if type(operand) == float else 'v', operand)
+            return self.operands.setdefault(fields, len(self.operands))
+        value = operand.value
+        if isinstance(value, interpreter.Register):
+            fields = (operand.mode.value, 'r', value.name)
+        elif isinstance(value, interpreter.MemoryAddress):
+            fields = (operand.mode.value, 'm', self.address(value))
+        elif type(value) == float:
+            fields = (operand.mode.value, 'f', value)  # 与值相等的整数区分开
+        elif value is None or type(value) in (int, str):
+            fields = (operand.mode.value, 'v', value)
+        else:
+            raise RuntimeError("无法写入目标文件的操作数: %s" % operand.value)
+        return self.operands.setdefault(fields, len(self.operands))
+
+    def instruction(self, instruction):
+        if instruction is interpreter.NOP_INSTRUCTION:
+            return NOP_REFERENCE
+        references = []
+        for operand in instruction.operands:
+            if isinstance(operand, interpreter.Instruction):
+                references.append(-self.instruction(operand) - 1)
+            else:
+                references.append(self.operand(operand))
+        self.instructions.append((interpreter.instruction_names[instruction.op], instruction.text,
+                                  instruction.length, instruction.target, tuple(references)))
+        return len(self.instructions) - 1
+
+    def tables(self):
+        return tuple(self.addresses), tuple(self.operands), tuple(self.instructions)
+
+
+class ObjectReader:
+    """
+    由 ObjectWriter 写出的表重建指令记录
+    相同的操作数在重建后共用同一个对象，与译码时 compileMemoryAddress 的缓存效果相同
+    """
+
+    def __init__(self, addresses, operands, instructions):
+        self.addresses = [self.address(fields) for fields in addresses]
+        self.operands = [self.operand(*fields) for fields in operands]
+        self.instructions = []
+        for name, text, length, target, references in instructions:
+            self.instructions.append(self.instruction(name, text, length, target, references))
+
+    @staticmethod
+    def address(fields):
+        if len(fields) == 1:
+            # 无法化简的表达式没有可保存的求值形式，读出时重新编译
+            return interpreter.compileMemoryAddress(fields[0])
+        return interpreter.MemoryAddress(*fields)
+
+    def operand(self, mode, kind, value):
+        if kind == 'r':
+            value = interpreter.Register_Table[value]
+        elif kind == 'm':
+            value = self.addresses[value]
+        if mode is None:
+            return value
+        return interpreter.Operand(interpreter.AddressingMode(mode), value)
+
+    def instruction(self, name, text, length, target, references):
+        op = interpreter.opcode_table.get(name)
+        if op is None:
+            raise RuntimeError("目标文件中有未知的指令: %s" % name)
+        operands = tuple(self.operands[k] if k >= 0 else self.instructions[-k - 1] for k in references)
+        instruction = interpreter.Instruction(op, operands, text, length)
+        instruction.target = target
+        return instruction
+
+    def program(self, references):
+        instructions = self.instructions
+        nop = interpreter.NOP_INSTRUCTION
+        return [instructions[k] if k != NOP_REFERENCE else nop for k in references]
+
+
+def dumpObject(machine, code):
+    """
+    将刚装载完、尚未运行的虚拟机写为目标文件
+    :param machine: 已调用 load(code) 的虚拟机
+    :param code: 装载的汇编代码，其摘要写入头部
+    :return: 目标文件的内容
+    """
+    writer = ObjectWriter()
+    program = tuple(writer.instruction(instruction) for instruction in machine.program)
+    functions = tuple((name, func.entry, func.ret, tuple(func.labels.items()))
+                      for name, func in machine.functions.items())
+    variables = tuple((name, var.pos, var.size) for name, var in machine.variables.items())
+    pages = tuple(sorted(machine.memory.snapshot().items()))
+
+    body = marshal.dumps((writer.tables(), program, tuple(machine.owners), functions, variables, pages,
+                          machine.index, machine.data_size, machine.fused_instructions))
+    header = HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, marshal.version, machine.data_base, assemblyHash(code),
+                         len(body), zlib.crc32(body))
+    return header + body
+
+
+def readHeader(data):
+    """
+    检查目标文件的头部与校验和
+    :return: (数据段基址, 汇编代码的摘要, 正文)
+    """
+    if len(data) < HEADER.size:
+        raise RuntimeError("目标文件已损坏: 长度不足")
+    magic, version, marshal_version, data_base, digest, length, checksum = HEADER.unpack_from(data, 0)
+    if magic != OBJECT_MAGIC:
+        raise RuntimeError("不是目标文件")
+    if version != OBJECT_VERSION or marshal_version != marshal.version:
+        raise RuntimeError("目标文件的版本为%d.%d，当前支持的版本为%d.%d" % (
+            version, marshal_version, OBJECT_VERSION, marshal.version))
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != length or zlib.crc32(body) != checksum:
+        raise RuntimeError("目标文件已损坏: 校验和不一致")
+    return data_base, digest, body
+
+
+def loadObject(machine, data):
+    """
+    将目标文件装入虚拟机，效果与 machine.load(code) 相同
+    :param machine: 虚拟机，数据段基址须与生成目标文件时相同
+    :param data: 目标文件的内容
+    :return: 指令记录列表
+    """
+    data_base, digest, body = readHeader(data)
+    if data_base != machine.data_base:
+        raise RuntimeError("目标文件的数据段基址为%d，与虚拟机不一致" % data_base)
+
+    tables, program, owners, functions, variables, pages, index, data_size, fused_instructions = \
+        marshal.loads(body)
+    program = ObjectReader(*tables).program(program)
+
+    machine.reset()
+    for name, entry, ret, labels in functions:
+        func = interpreter.Func()
+        func.entry = entry
+        func.ret = ret
+        func.labels = dict(labels)
+        machine.functions[name] = func
+    for name, pos, size in variables:
+        var = interpreter.Vars(name, size)
+        var.pos = pos
+        machine.variables[name] = var
+    machine.memory.restore(dict(pages))
+    machine.program = program
+    machine.owners = list(owners)
+    machine.index = index
+    machine.data_size = data_size
+    machine.fused_instructions = fused_instructions
+    return machine.program
+
+
+def writeObject(path, machine, code):
+    with open(path, 'wb') as f:
+        f.write(dumpObject(machine, code))
+
+
+def readObject(path, machine):
+    """
+    一次读出目标文件并装入虚拟机
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return loadObject(machine, data)
+
+
+class LoadCache:
+    """
+    装载缓存，以汇编代码与虚拟机布局的哈希为键
+    内存中保存装载完成时的快照，命中时只需恢复快照；给出缓存目录时另将目标文件写入目录，供其他进程与下次运行使用
+    :param directory: 目标文件的缓存目录，为None时只在内存中缓存
+    :param capacity: 内存中最多保存的快照数
+    """
+
+    def __init__(self, directory=None, capacity=64):
+        self.directory = directory
+        self.capacity = capacity
+        self.snapshots = {}
+        self.hits = 0
+        self.object_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, machine, code):
+        layout = "%d:%d:%d:%d:%d:" % (OBJECT_VERSION, machine.memory_size, machine.stack_top, machine.data_base,
+                                      interpreter.FUSE_SUPERINSTRUCTIONS)
+        return hashlib.sha256(layout.encode('utf-8') + assemblyHash(code)).hexdigest()
+
+    def load(self, machine, code):
+        """
+        装载汇编代码，效果与 machine.load(code) 相同
+        :return: 指令记录列表
+        """
+        key = self.key(machine, code)
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is not None:
+            self.hits += 1
+            self.snapshots[key] = snapshot  # 移到最近使用的位置
+            machine.restore(snapshot)
+            return machine.program
+
+        path = os.path.join(self.directory, key + ".o") if self.directory is not None else None
+        if path is not None and os.path.exists(path):
+            try:
+                readObject(path, machine)
+            except RuntimeError:
+                pass  # 损坏或版本不符的目标文件，重新装载后覆盖
+            else:
+                self.object_hits += 1
+                self.remember(key, machine)
+                return machine.program
+
+        self.misses += 1
+        machine.load(code)
+        if path is not None:
+            writeObject(path, machine, code)
+        self.remember(key, machine)
+        return machine.program
+
+    def remember(self, key, machine):
+        self.snapshots[key] = machine.snapshot()
+        if len(self.snapshots) > self.capacity:
+            del self.snapshots[next(iter(self.snapshots))]
+
+
+def main(argv=None):
+    from compiler import batch
+
+    parser = argparse.ArgumentParser(prog="python -m compiler.objfile", description="生成或运行目标文件")
+    parser.add_argument("source", help="C 源文件、汇编文件（.s）或目标文件（.o）")
+    parser.add_argument("-o", "--output", help="写出的目标文件")
+    parser.add_argument("--run", action="store_true", help="装载后运行")
+    args = parser.parse_args(argv)
+
+    machine = interpreter.Machine()
+    if args.source.endswith(".o"):
+        readObject(args.source, machine)
+    else:
+        with open(args.source, encoding='utf-8') as f:
+            code = f.read()
+        if args.source.endswith(".c"):
+            code = batch.compileSource(code)
+        machine.load(code)
+        if args.output:
+            writeObject(args.output, machine, code)
+
+    if args.run:
+        sys.stdout.write(machine.run())
+
+
+if __name__ == '__main__':
+    main()
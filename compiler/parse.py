@@ -4,14 +4,12 @@ from compiler import tokenize, type
 
 
 class TagScope:
-    next = None
     name = None
     ty = None
     depth = 0
 
 
 class VarScope:
-    next = None
     name = None
     depth = 0
 
@@ -21,9 +19,47 @@ class VarScope:
     enum_val = None
 
 
+class SymbolTable:
+    """
+    按作用域嵌套的符号表：名字 -> 绑定的栈，栈顶为最内层的绑定，查找只需一次字典访问
+    trail按顺序记录压入的名字，进入作用域时记下trail的长度，离开时弹出此后压入的名字
+    """
+
+    def __init__(self):
+        self.bindings = {}
+        self.trail = []
+
+    def push(self, name, sc):
+        stack = self.bindings.get(name)
+        if stack is None:
+            self.bindings[name] = [sc]
+        else:
+            stack.append(sc)
+        self.trail.append(name)
+
+    def find(self, name):
+        stack = self.bindings.get(name)
+        if stack is None:
+            return None
+        return stack[-1]
+
+    def mark(self):
+        return len(self.trail)
+
+    def leave(self, mark):
+        bindings = self.bindings
+        trail = self.trail
+        while len(trail) > mark:
+            name = trail.pop()
+            stack = bindings[name]
+            stack.pop()
+            if not stack:
+                del bindings[name]
+
+
 class Scope:
-    var_scope = VarScope()
-    tag_scope = TagScope()
+    var_scope = 0  # 进入作用域时变量符号表的位置
+    tag_scope = 0  # 进入作用域时标签符号表的位置
 
 
 class NodeKind(Enum):
@@ -129,6 +165,9 @@ class Function:
     locals = None
     is_static = False
 
+    # 函数名的token
+    tok = None
+
     def __init__(self, next=None, name=None, node=None,
                  locals=None, stack_size=None):
         self.next = next
@@ -202,64 +241,7 @@ class Node:
         self.tok = tok
 
 
-cnt = 0
-
-locals = VarList()
-globals = VarList()
-
-var_scope = VarScope()
-tag_scope = TagScope()
-scope_depth = 0
-
-current_switch = None
-
-
-def enter_scope():
-    global scope_depth
-    sc = Scope()
-    sc.var_scope = var_scope
-    sc.tag_scope = tag_scope
-    scope_depth += 1
-    return sc
-
-
-def leave_scope(sc):
-    global var_scope, tag_scope, scope_depth
-    var_scope = sc.var_scope
-    tag_scope = sc.tag_scope
-    scope_depth -= 1
-
-
-def new_label():
-    global cnt
-    buf = ".L.data." + str(cnt)
-    cnt += 1
-    return buf
-
-
-def find_var(tok=tokenize.token):
-    global var_scope
-    sc = var_scope
-    while sc is not None:
-        if sc.name == tok.str:
-            return sc
-        sc = sc.next
-    return None
-
-
-def find_tag(tok):
-    global tag_scope
-    tag = tag_scope
-    while tag is not None:
-        if tag.name == tok.str:
-            return tag
-        tag = tag.next
-    return None
-
-
 def new_var(name, ty, is_local):
-    global var_scope
-
     var = Var()
     var.name = name
     var.ty = ty
@@ -268,981 +250,995 @@ def new_var(name, ty, is_local):
     return var
 
 
-def new_lvar(name, ty):
-    global locals
-
-    var = new_var(name, ty, True)
-    sc = push_scope(name)
-    sc.var = var
-
-    vl = VarList()
-    vl.var = var
-    vl.next = locals
-    locals = vl
-    return var
-
-
-def new_gvar(name, ty, emit, val=None):
-    global globals
-
-    var = new_var(name, ty, False)
-    if val is not None:
-        var.val = val
-    sc = push_scope(name)
-    sc.var = var
-
-    if emit:
-        vl = VarList()
-        vl.var = var
-        vl.next = globals
-        globals = vl
-    return var
-
-
-def find_typedef(tok):
-    if tok.kind == tokenize.TokenKind.TK_IDENT:
-        sc = find_var(tok)
-        if sc is not None:
-            return sc.typedef
-    return None
-
-
-def new_node(kind, tok=tokenize.token):
+def new_node(kind, tok=None):
     return Node(kind, tok=tok)
 
 
-def new_binary(kind, lhs, rhs, tok=tokenize.token):
+def new_binary(kind, lhs, rhs, tok=None):
     return Node(kind, 0, lhs, rhs, tok=tok)
 
 
-def new_unary(kind, lhs, tok=tokenize.token):
+def new_unary(kind, lhs, tok=None):
     return Node(kind, 0, lhs, tok=tok)
 
 
-def new_num(val=None, tok=tokenize.token):
-    if val is None:
-        if tokenize.token.kind != tokenize.TokenKind.TK_NUM:
-            if tokenize.token.kind == tokenize.TokenKind.TK_RESERVED:
-                if tokenize.token.str == "true":
-                    node = Node(NodeKind.ND_NUM, val=1, tok=tokenize.token)
-                    tokenize.token = tokenize.token.next
-                    return node
-                if tokenize.token.str == "false":
-                    node = Node(NodeKind.ND_NUM, val=0, tok=tokenize.token)
-                    tokenize.token = tokenize.token.next
-                    return node
-            raise RuntimeError("Error: expected a number, but got %s" % tokenize.token.str)
-        if {'e', 'E', '.', 'f', "F"} & set(str(tokenize.token.str)):
-            if 'f' in tokenize.token.str or 'F' in tokenize.token.str:
-                node = Node(NodeKind.ND_NUM, val=float(tokenize.token.str[:-1]), tok=tokenize.token)
-                node.ty = type.float_type
-                tokenize.token = tokenize.token.next
-                return node
-            else:
-                node = Node(NodeKind.ND_NUM, val=float(tokenize.token.str), tok=tokenize.token)
-                node.ty = type.double_type
-                tokenize.token = tokenize.token.next
-                return node
-        else:
-            node = Node(NodeKind.ND_NUM, val=int(tokenize.token.str), tok=tokenize.token)
-            tokenize.token = tokenize.token.next
-            return node
-    else:
-        return Node(NodeKind.ND_NUM, val=val)
-
-
-def new_var_node(var, tok=tokenize.token):
+def new_var_node(var, tok=None):
     return Node(NodeKind.ND_VAR, var=var, tok=tok)
 
 
-def push_scope(name):
-    global var_scope
-    sc = VarScope()
-    sc.next = var_scope
-    sc.name = name
-    var_scope = sc
-    return sc
+def find_member(ty, name):
+    mem = ty.members
+    while mem is not None:
+        if mem.name == name:
+            return mem
+        mem = mem.next
+    return None
 
 
-def read_expr_stmt():
-    return new_unary(NodeKind.ND_EXPR_STMT, expr(), tok=tokenize.token)
+class Parser:
+    """
+    语法分析器，一次语法分析的全部状态都保存在实例中
+    不同的实例互不影响，可以在多个线程中同时分析不同的源代码
+    :param stream: 要分析的token序列，tokenize.TokenStream
+    """
 
+    def __init__(self, stream):
+        self.stream = stream
 
-# type-suffix = ("[" num? "]" type-suffix)?
-def type_suffix(base):
-    if not tokenize.consume('['):
-        return base
+        self.cnt = 0  # 字符串字面值的标签序号
+        self.locals = None  # 当前函数的局部变量
+        self.globals = None  # 全局变量
 
-    sz = 0
-    is_incomplete = True
+        self.var_scope = SymbolTable()
+        self.tag_scope = SymbolTable()
+        self.scope_depth = 0
 
-    if not tokenize.consume(']'):
-        sz = tokenize.expect_number()
-        is_incomplete = False
-        tokenize.expect(']')
+        self.current_switch = None  # 当前所在的switch语句
 
-    ty = type_suffix(base)
+    def enter_scope(self):
+        sc = Scope()
+        sc.var_scope = self.var_scope.mark()
+        sc.tag_scope = self.tag_scope.mark()
+        self.scope_depth += 1
+        return sc
 
-    if ty.is_incomplete:
-        raise RuntimeError("incomplete element type")
+    def leave_scope(self, sc):
+        self.var_scope.leave(sc.var_scope)
+        self.tag_scope.leave(sc.tag_scope)
+        self.scope_depth -= 1
 
-    ty = type.array_of(ty, sz)
-    ty.is_incomplete = is_incomplete
+    def new_label(self):
+        buf = ".L.data." + str(self.cnt)
+        self.cnt += 1
+        return buf
 
-    return ty
+    def find_var(self, tok=None):
+        return self.var_scope.find(tok.str)
 
+    def find_tag(self, tok):
+        return self.tag_scope.find(tok.str)
 
-def push_tag_scope(tok, ty):
-    global tag_scope, scope_depth
-    sc = TagScope()
-    sc.next = tag_scope
-    sc.name = tok.str
-    sc.depth = scope_depth
-    sc.ty = ty
-    tag_scope = sc
+    def new_lvar(self, name, ty):
+        var = new_var(name, ty, True)
+        sc = self.push_scope(name)
+        sc.var = var
 
+        vl = VarList()
+        vl.var = var
+        vl.next = self.locals
+        self.locals = vl
+        return var
+
+    def new_gvar(self, name, ty, emit, val=None):
+        var = new_var(name, ty, False)
+        if val is not None:
+            var.val = val
+        sc = self.push_scope(name)
+        sc.var = var
+
+        if emit:
+            vl = VarList()
+            vl.var = var
+            vl.next = self.globals
+            self.globals = vl
+        return var
+
+    def find_typedef(self, tok):
+        if tok.kind == tokenize.TokenKind.TK_IDENT:
+            sc = self.find_var(tok)
+            if sc is not None:
+                return sc.typedef
+        return None
 
-# struct-decl = "struct" ident? ("{" struct-member "}")?
-def struct_decl():
-    tag = tokenize.consume_ident()
+    def new_num(self, val=None, tok=None):
+        if val is None:
+            tok = self.stream.current()
+            if tok.kind != tokenize.TokenKind.TK_NUM:
+                if tok.kind == tokenize.TokenKind.TK_RESERVED:
+                    if tok.str == "true":
+                        self.stream.advance()
+                        return Node(NodeKind.ND_NUM, val=1, tok=tok)
+                    if tok.str == "false":
+                        self.stream.advance()
+                        return Node(NodeKind.ND_NUM, val=0, tok=tok)
+                raise RuntimeError("Error: expected a number, but got %s" % tok.str)
+            self.stream.advance()
+            if {'e', 'E', '.', 'f', "F"} & set(str(tok.str)):
+                if 'f' in tok.str or 'F' in tok.str:
+                    node = Node(NodeKind.ND_NUM, val=float(tok.str[:-1]), tok=tok)
+                    node.ty = type.float_type
+                    return node
+                else:
+                    node = Node(NodeKind.ND_NUM, val=float(tok.str), tok=tok)
+                    node.ty = type.double_type
+                    return node
+            else:
+                return Node(NodeKind.ND_NUM, val=int(tok.str), tok=tok)
+        else:
+            return Node(NodeKind.ND_NUM, val=val)
 
-    if tag is not None and not tokenize.peek("{"):
-        sc = find_tag(tag)
-        if sc is None:
-            ty = type.struct_type()
-            push_tag_scope(tag, ty)
-            return ty
+    def push_scope(self, name):
+        sc = VarScope()
+        sc.name = name
+        self.var_scope.push(name, sc)
+        return sc
 
-        if sc.ty.kind != type.TypeKind.TY_STRUCT:
-            raise RuntimeError("not a struct", tokenize.token)
-        return sc.ty
+    def read_expr_stmt(self):
+        return new_unary(NodeKind.ND_EXPR_STMT, self.expr(), tok=None)
 
-    if not tokenize.consume("{"):
-        return type.struct_type()
+    # type-suffix = ("[" num? "]" type-suffix)?
+    def type_suffix(self, base):
+        if not self.stream.consume('['):
+            return base
 
-    sc = None
+        sz = 0
+        is_incomplete = True
 
-    if tag is not None:
-        sc = find_tag(tag)
+        if not self.stream.consume(']'):
+            sz = self.stream.expect_number()
+            is_incomplete = False
+            self.stream.expect(']')
 
-    if sc is not None and sc.depth == scope_depth:
-        if sc.ty.kind != type.TypeKind.TY_STRUCT:
-            raise RuntimeError("not a struct", tokenize.token)
-        ty = sc.ty
-    else:
-        ty = type.struct_type()
-        if tag is not None:
-            push_tag_scope(tag, ty)
+        ty = self.type_suffix(base)
 
-    # 读取结构体成员
-    head = type.Member()
-    cur = head
+        if ty.is_incomplete:
+            raise RuntimeError("incomplete element type")
 
-    while not tokenize.consume('}'):
-        cur.next = struct_member()
-        cur = cur.next
+        ty = type.array_of(ty, sz)
+        ty.is_incomplete = is_incomplete
 
-    ty.members = head.next
+        return ty
 
-    offset = 0
-    mem = ty.members
-    while mem is not None:
-        offset = type.align_to(offset, mem.ty.align)
-        mem.offset = offset
-        offset += mem.ty.size
+    def push_tag_scope(self, tok, ty):
+        sc = TagScope()
+        sc.name = tok.str
+        sc.depth = self.scope_depth
+        sc.ty = ty
+        self.tag_scope.push(sc.name, sc)
 
-        if ty.align < mem.ty.align:
-            ty.align = mem.ty.align
+    # struct-decl = "struct" ident? ("{" struct-member "}")?
+    def struct_decl(self):
+        tag = self.stream.consume_ident()
 
-        mem = mem.next
+        if tag is not None and not self.stream.peek("{"):
+            sc = self.find_tag(tag)
+            if sc is None:
+                ty = type.struct_type()
+                self.push_tag_scope(tag, ty)
+                return ty
 
-    ty.size = type.align_to(offset, ty.align)
-    ty.is_incomplete = False
+            if sc.ty.kind != type.TypeKind.TY_STRUCT:
+                raise RuntimeError("not a struct", self.stream.current())
+            return sc.ty
 
-    return ty
+        if not self.stream.consume("{"):
+            return type.struct_type()
 
+        sc = None
 
-def union_decl():
-    tag = tokenize.consume_ident()
+        if tag is not None:
+            sc = self.find_tag(tag)
 
-    if tag is not None and not tokenize.peek("{"):
-        sc = find_tag(tag)
-        if sc is None:
+        if sc is not None and sc.depth == self.scope_depth:
+            if sc.ty.kind != type.TypeKind.TY_STRUCT:
+                raise RuntimeError("not a struct", self.stream.current())
+            ty = sc.ty
+        else:
             ty = type.struct_type()
-            push_tag_scope(tag, ty)
-            return ty
+            if tag is not None:
+                self.push_tag_scope(tag, ty)
 
-        if sc.ty.kind != type.TypeKind.TY_STRUCT:
-            raise RuntimeError("not a struct", tokenize.token)
-        return sc.ty
+        # 读取结构体成员
+        head = type.Member()
+        cur = head
 
-    if not tokenize.consume("{"):
-        return type.struct_type()
+        while not self.stream.consume('}'):
+            cur.next = self.struct_member()
+            cur = cur.next
 
-    sc = TagScope()
+        ty.members = head.next
 
-    if tag is not None:
-        sc = find_tag(tag)
+        offset = 0
+        mem = ty.members
+        while mem is not None:
+            offset = type.align_to(offset, mem.ty.align)
+            mem.offset = offset
+            offset += mem.ty.size
 
-    if sc is not None and sc.depth == scope_depth:
-        if sc.ty.kind != type.TypeKind.TY_STRUCT:
-            raise RuntimeError("not a struct", tokenize.token)
-        ty = sc.ty
-    else:
-        ty = type.struct_type()
-        if tag is not None:
-            push_tag_scope(tag, ty)
+            if ty.align < mem.ty.align:
+                ty.align = mem.ty.align
 
-    # 读取结构体成员
-    head = type.Member()
-    cur = head
+            mem = mem.next
 
-    while not tokenize.consume('}'):
-        cur.next = struct_member()
-        cur = cur.next
+        ty.size = type.align_to(offset, ty.align)
+        ty.is_incomplete = False
 
-    ty.members = head.next
+        return ty
 
-    offset = 0
-    mem = ty.members
-    while mem is not None:
-        offset = type.align_to(offset, mem.ty.align)
-        mem.offset = offset
-        offset += mem.ty.size
+    def union_decl(self):
+        tag = self.stream.consume_ident()
 
-        if ty.align < mem.ty.align:
-            ty.align = mem.ty.align
+        if tag is not None and not self.stream.peek("{"):
+            sc = self.find_tag(tag)
+            if sc is None:
+                ty = type.struct_type()
+                self.push_tag_scope(tag, ty)
+                return ty
 
-        mem = mem.next
+            if sc.ty.kind != type.TypeKind.TY_STRUCT:
+                raise RuntimeError("not a struct", self.stream.current())
+            return sc.ty
 
-    ty.size = type.align_to(offset, ty.align)
-    ty.is_incomplete = False
-    return ty
-
-
-def enum_specifier():
-    ty = type.enum_type()
-    tag = tokenize.consume_ident()
-    if tag is not None and not tokenize.peek("{"):
-        sc = find_tag(tag)
-        if sc is None:
-            raise RuntimeError("unknown enum type", tokenize.token)
-        if sc.ty.kind != type.TypeKind.TY_ENUM:
-            raise RuntimeError("not an enum type", tokenize.token)
-        return sc.ty
-    tokenize.expect("{")
-    cnt = 0
-    while not tokenize.consume("}"):
-        name = tokenize.expect_ident()
-        if tokenize.consume("="):
-            cnt = tokenize.expect_number()
-        sc = push_scope(name)
-        sc.enum_ty = ty
-        sc.enum_val = cnt
-        cnt += 1
-        if not tokenize.consume(","):
-            tokenize.expect("}")
-            break
-    if tag is not None:
-        push_tag_scope(tag, ty)
-    return ty
-
-
-def struct_member():
-    mem = type.Member()
-    mem.ty = basetype()
-    mem.name = tokenize.expect_ident()
-    mem.ty = type_suffix(mem.ty)
-    tokenize.expect(';')
-    return mem
-
-
-def read_func_param():
-    ty = basetype()
-    name = tokenize.expect_ident()
-    ty = type_suffix(ty)
-
-    if ty.kind == type.TypeKind.TY_ARRAY:
-        ty = type.pointer_to(ty.base)
-
-    vl = VarList()
-    vl.var = new_lvar(name, ty)
-    return vl
-
-
-def read_func_params():
-    if tokenize.consume(')'):
-        return None
+        if not self.stream.consume("{"):
+            return type.struct_type()
 
-    head = read_func_param()
-    cur = head
+        sc = TagScope()
 
-    while not tokenize.consume(')'):
-        tokenize.expect(',')
-        cur.next = read_func_param()
-        cur = cur.next
-
-    return head
+        if tag is not None:
+            sc = self.find_tag(tag)
 
+        if sc is not None and sc.depth == self.scope_depth:
+            if sc.ty.kind != type.TypeKind.TY_STRUCT:
+                raise RuntimeError("not a struct", self.stream.current())
+            ty = sc.ty
+        else:
+            ty = type.struct_type()
+            if tag is not None:
+                self.push_tag_scope(tag, ty)
 
-def logor():
-    node = logand()
-    while tokenize.consume('||'):
-        node = new_binary(NodeKind.ND_LOGOR, node, logand(), tokenize.token)
-    return node
+        # 读取结构体成员
+        head = type.Member()
+        cur = head
 
+        while not self.stream.consume('}'):
+            cur.next = self.struct_member()
+            cur = cur.next
 
-def logand():
-    node = bitor()
-    while tokenize.consume('&&'):
-        node = new_binary(NodeKind.ND_LOGAND, node, bitor(), tokenize.token)
-    return node
+        ty.members = head.next
+
+        offset = 0
+        mem = ty.members
+        while mem is not None:
+            offset = type.align_to(offset, mem.ty.align)
+            mem.offset = offset
+            offset += mem.ty.size
+
+            if ty.align < mem.ty.align:
+                ty.align = mem.ty.align
+
+            mem = mem.next
+
+        ty.size = type.align_to(offset, ty.align)
+        ty.is_incomplete = False
+        return ty
+
+    def enum_specifier(self):
+        ty = type.enum_type()
+        tag = self.stream.consume_ident()
+        if tag is not None and not self.stream.peek("{"):
+            sc = self.find_tag(tag)
+            if sc is None:
+                raise RuntimeError("unknown enum type", self.stream.current())
+            if sc.ty.kind != type.TypeKind.TY_ENUM:
+                raise RuntimeError("not an enum type", self.stream.current())
+            return sc.ty
+        self.stream.expect("{")
+        cnt = 0
+        while not self.stream.consume("}"):
+            name = self.stream.expect_ident()
+            if self.stream.consume("="):
+                cnt = self.stream.expect_number()
+            sc = self.push_scope(name)
+            sc.enum_ty = ty
+            sc.enum_val = cnt
+            cnt += 1
+            if not self.stream.consume(","):
+                self.stream.expect("}")
+                break
+        if tag is not None:
+            self.push_tag_scope(tag, ty)
+        return ty
 
+    def struct_member(self):
+        mem = type.Member()
+        mem.ty = self.basetype()
+        mem.name = self.stream.expect_ident()
+        mem.ty = self.type_suffix(mem.ty)
+        self.stream.expect(';')
+        return mem
 
-def bitor():
-    node = bitxor()
-    while tokenize.consume('|'):
-        node = new_binary(NodeKind.ND_BITOR, node, bitxor(), tokenize.token)
-    return node
+    def read_func_param(self):
+        ty = self.basetype()
+        name = self.stream.expect_ident()
+        ty = self.type_suffix(ty)
 
+        if ty.kind == type.TypeKind.TY_ARRAY:
+            ty = type.pointer_to(ty.base)
 
-def bitxor():
-    node = bitand()
-    while tokenize.consume('^'):
-        node = new_binary(NodeKind.ND_BITXOR, node, bitxor(), tokenize.token)
-    return node
+        vl = VarList()
+        vl.var = self.new_lvar(name, ty)
+        return vl
 
+    def read_func_params(self):
+        if self.stream.consume(')'):
+            return None
 
-def bitand():
-    node = equality()
-    while tokenize.consume('&'):
-        node = new_binary(NodeKind.ND_BITAND, node, equality(), tokenize.token)
-    return node
+        head = self.read_func_param()
+        cur = head
 
+        while not self.stream.consume(')'):
+            self.stream.expect(',')
+            cur.next = self.read_func_param()
+            cur = cur.next
 
-prog = None
+        return head
 
+    def logor(self):
+        node = self.logand()
+        while True:
+            tok = self.stream.current()
+            if not self.stream.consume('||'):
+                return node
+            node = new_binary(NodeKind.ND_LOGOR, node, self.logand(), tok=tok)
 
-def global_var():
-    ty = basetype()
-    name = tokenize.expect_ident()
-    ty = type_suffix(ty)
+    def logand(self):
+        node = self.bitor()
+        while True:
+            tok = self.stream.current()
+            if not self.stream.consume('&&'):
+                return node
+            node = new_binary(NodeKind.ND_LOGAND, node, self.bitor(), tok=tok)
 
-    if tokenize.peek('='):
-        tokenize.consume('=')
-        val = tokenize.expect_number()
-        new_gvar(name, ty, True, val=val)
-        tokenize.expect(';')
-        return
+    def bitor(self):
+        node = self.bitxor()
+        while True:
+            tok = self.stream.current()
+            if not self.stream.consume('|'):
+                return node
+            node = new_binary(NodeKind.ND_BITOR, node, self.bitxor(), tok=tok)
 
-    tokenize.expect(';')
-    new_gvar(name, ty, True)
+    def bitxor(self):
+        node = self.bitand()
+        while True:
+            tok = self.stream.current()
+            if not self.stream.consume('^'):
+                return node
+            node = new_binary(NodeKind.ND_BITXOR, node, self.bitxor(), tok=tok)
 
+    def bitand(self):
+        node = self.equality()
+        while True:
+            tok = self.stream.current()
+            if not self.stream.consume('&'):
+                return node
+            node = new_binary(NodeKind.ND_BITAND, node, self.equality(), tok=tok)
+
+    def global_var(self):
+        ty = self.basetype()
+        name = self.stream.expect_ident()
+        ty = self.type_suffix(ty)
+
+        if self.stream.peek('='):
+            self.stream.consume('=')
+            val = self.stream.expect_number()
+            self.new_gvar(name, ty, True, val=val)
+            self.stream.expect(';')
+            return
+
+        self.stream.expect(';')
+        self.new_gvar(name, ty, True)
+
+    # 决定最外层的是函数还是全局变量。
+    def is_function(self):
+        pos = self.stream.mark()
+        self.stream.consume('static')
+        self.basetype()
+        isfunc = self.stream.consume_ident() and self.stream.consume('(')
+        self.stream.rewind(pos)
+        return isfunc
+
+    # program = (typedef | global-var | function)*
+    def program(self):
+        head = Function()
+        cur = head
+        self.globals = None
+
+        while True:
+            if self.stream.at_eof():
+                break
+            if self.stream.consume('typedef'):
+                self.typedef()
+
+            if self.is_function():
+                fn = self.function()
+                if fn is not None:
+                    cur.next = fn
+                    cur = cur.next
+            else:
+                self.global_var()
 
-# 决定最外层的是函数还是全局变量。
-def is_function():
-    tok = tokenize.token
-    tokenize.consume('static')
-    basetype()
-    isfunc = tokenize.consume_ident() and tokenize.consume('(')
-    tokenize.token = tok
-    return isfunc
+        prog = Program()
+        prog.globals = self.globals
+        prog.fns = head.next
 
+        return prog
 
-# program = (typedef | global-var | function)*
-def program():
-    global globals
-    head = Function()
-    cur = head
-    globals = None
+    # typdef basetype ident ";"
+    def typedef(self):
+        ty = self.basetype()
+        ty = self.type_suffix(ty)
+        name = self.stream.expect_ident()
 
-    while True:
-        if tokenize.at_eof():
-            break
-        if tokenize.consume('typedef'):
-            typedef()
+        sc = self.push_scope(name)
+        sc.typedef = ty
 
-        if is_function():
-            fn = function()
-            if fn is not None:
-                cur.next = fn
-                cur = cur.next
+        self.stream.expect(';')
+
+    # basetype = builtin-type | struct-decl | typedef-name | enum-specifier  "*"*
+    # builtin-type = "void" | "_Bool" | "char" | "short" | "int" | "long"
+    def basetype(self):
+        if not self.is_typename():
+            raise RuntimeError("typename expected, but got %s", self.stream.current().str)
+        if self.stream.consume('void'):
+            ty = type.void_type
+        elif self.stream.consume('bool'):
+            ty = type.bool_type
+        elif self.stream.consume('char'):
+            ty = type.char_type
+        elif self.stream.consume('short'):
+            ty = type.short_type
+        elif self.stream.consume('int'):
+            ty = type.int_type
+        elif self.stream.consume('long'):
+            self.stream.consume('long')
+            ty = type.long_type
+        elif self.stream.consume('struct'):
+            ty = self.struct_decl()
+        elif self.stream.consume('union'):
+            ty = self.union_decl()
+        elif self.stream.consume('enum'):
+            ty = self.enum_specifier()
+        elif self.stream.consume('float'):
+            ty = type.float_type
+        elif self.stream.consume('double'):
+            ty = type.double_type
         else:
-            global_var()
-
-    prog = Program()
-    prog.globals = globals
-    prog.fns = head.next
-
-    return prog
-
-# typdef basetype ident ";"
-def typedef():
-    ty = basetype()
-    ty = type_suffix(ty)
-    name = tokenize.expect_ident()
-
-    push_scope(name)
-    var_scope.typedef = ty
-
-    tokenize.expect(';')
-
-
-# basetype = builtin-type | struct-decl | typedef-name | enum-specifier  "*"*
-# builtin-type = "void" | "_Bool" | "char" | "short" | "int" | "long"
-def basetype():
-    if not is_typename():
-        raise RuntimeError("typename expected, but got %s", tokenize.token.str)
-    if tokenize.consume('void'):
-        ty = type.void_type
-    elif tokenize.consume('bool'):
-        ty = type.bool_type
-    elif tokenize.consume('char'):
-        ty = type.char_type
-    elif tokenize.consume('short'):
-        ty = type.short_type
-    elif tokenize.consume('int'):
-        ty = type.int_type
-    elif tokenize.consume('long'):
-        tokenize.consume('long')
-        ty = type.long_type
-    elif tokenize.consume('struct'):
-        ty = struct_decl()
-    elif tokenize.consume('union'):
-        ty = union_decl()
-    elif tokenize.consume('enum'):
-        ty = enum_specifier()
-    elif tokenize.consume('float'):
-        ty = type.float_type
-    elif tokenize.consume('double'):
-        ty = type.double_type
-    else:
-        ty = find_var(tokenize.consume_ident())
-        ty = ty.typedef
-    if ty is None:
-        raise RuntimeError("unknown type name", tokenize.token)
-
-    while tokenize.consume('*'):
-        ty = type.pointer_to(ty)
-    return ty
-
-
-# function = static? basetype declaration "(" params? ")" ("{" stmt* "}" | ";")
-# params   = param ("," param)*
-# param    = basetype ident
-def function():
-    global locals
-
-    locals = None
-
-    is_static = tokenize.consume('static')
-
-    ty = basetype()
-    fn = Function(name=tokenize.expect_ident())
-    fn.is_static = is_static
-
-    new_gvar(fn.name, type.func_type(ty), False)
-
-    tokenize.expect('(')
-
-    sc = enter_scope()
-    fn.params = read_func_params()
+            ty = self.find_var(self.stream.consume_ident())
+            ty = ty.typedef
+        if ty is None:
+            raise RuntimeError("unknown type name", self.stream.current())
 
-    if tokenize.consume(';'):
-        leave_scope(sc)
-        return None
+        while self.stream.consume('*'):
+            ty = type.pointer_to(ty)
+        return ty
 
-    # 读取函数体
-    head = Node(NodeKind.ND_DEFAULT)
-    cur = head
-    tokenize.expect('{')
-    while not tokenize.consume('}'):
-        cur.next = stmt()
-        cur = cur.next
-    leave_scope(sc)
-
-    fn.node = head.next
-    fn.locals = locals
-
-    return fn
-
-
-# declaration = basetype ident ("[" num "]")* ("=" expr) ";"
-#             | basetype ";"
-def declaration():
-    ty = basetype()
-    if tokenize.consume(';'):
-        return new_node(NodeKind.ND_NULL)
-
-    name = tokenize.expect_ident()
-    ty = type_suffix(ty)
-    var = new_lvar(name, ty)
-
-    if tokenize.consume(';'):
-        return new_node(NodeKind.ND_NULL)
-
-    tokenize.expect('=')
-    lhs = new_var_node(var, tokenize.token)
-    rhs = expr()
-    tokenize.expect(';')
-    node = new_binary(NodeKind.ND_ASSIGN, lhs, rhs, tokenize.token)
-    return new_unary(NodeKind.ND_EXPR_STMT, node, tokenize.token)
-
-
-def is_typename():
-    return (tokenize.peek("int")
-            or tokenize.peek("char")
-            or tokenize.peek("struct")
-            or tokenize.peek("short")
-            or tokenize.peek("long")
-            or tokenize.peek("void")
-            or tokenize.peek("bool")
-            or tokenize.peek("enum")
-            or tokenize.peek("union")
-            or find_typedef(tokenize.token))
-
-
-def stmt():
-    node = stmt2()
-    type.add_type(node)
-    return node
-
-
-# stmt2 = "return" expr ";"
-#      | "if" "(" expr ")" stmt ("else" stmt)?
-#      | "switch" "(" expr ")" stmt
-#      | "case" num ":" stmt
-#      | "default" ":" stmt
-#      | "while" "(" expr ")" stmt
-#      | "for" "(" (expr? ";" | declaration) expr? ";" expr? ")" stmt
-#      | "{" stmt* "}"
-#      | "typedef" basetype ident ("[" num "]")* ";"
-#      | "break" ";"
-#      | "continue" ";"
-#      | "goto.c" ident ";"
-#      | ident ":" stmt
-#      | declaration
-#      | expr ";"
-def stmt2():
-    global current_switch
-
-    if tokenize.consume("return"):
-        node = new_unary(NodeKind.ND_RETURN, expr(), tok=tokenize.token)
-        tokenize.expect(";")
-        return node
+    # function = static? basetype declaration "(" params? ")" ("{" stmt* "}" | ";")
+    # params   = param ("," param)*
+    # param    = basetype ident
+    def function(self):
+        self.locals = None
 
-    if tokenize.consume("if"):
-        node = new_node(NodeKind.ND_IF)
-        tokenize.expect("(")
-        node.cond = expr()
-        tokenize.expect(")")
-        node.then = stmt()
-        if tokenize.consume("else"):
-            node.els = stmt()
-        return node
+        is_static = self.stream.consume('static')
 
-    if tokenize.consume("switch"):
-        node = new_node(NodeKind.ND_SWITCH)
-        tokenize.expect("(")
-        node.cond = expr()
+        ty = self.basetype()
+        tok = self.stream.current()
+        fn = Function(name=self.stream.expect_ident())
+        fn.tok = tok
+        fn.is_static = is_static
 
-        tokenize.expect(")")
+        self.new_gvar(fn.name, type.func_type(ty), False)
 
-        sw = current_switch
-        current_switch = node
-        node.then = stmt()
-        current_switch = sw
-        return node
+        self.stream.expect('(')
 
-    if tokenize.consume("case"):
-        if current_switch is None:
-            raise RuntimeError("stray case", tokenize.token)
-        val = tokenize.expect_number()
-        tokenize.expect(":")
-        node = new_unary(NodeKind.ND_CASE, stmt())
-        node.val = val
-        node.case_next = current_switch.case_next
-        current_switch.case_next = node
-        return node
+        sc = self.enter_scope()
+        fn.params = self.read_func_params()
 
-    if tokenize.consume("default"):
-        if current_switch is None:
-            raise RuntimeError("stray default", tokenize.token)
-        tokenize.expect(":")
+        if self.stream.consume(';'):
+            self.leave_scope(sc)
+            return None
 
-        node = new_unary(NodeKind.ND_DEFAULT, stmt())
-        current_switch.default_case = node
-        return node
-
-    if tokenize.consume("while"):
-        node = new_node(NodeKind.ND_WHILE)
-        tokenize.expect("(")
-        node.cond = expr()
-        tokenize.expect(")")
-        node.then = stmt()
-        return node
-
-    if tokenize.consume("for"):
-        node = new_node(NodeKind.ND_FOR)
-
-        tokenize.expect("(")
-        sc = enter_scope()
-        if not tokenize.consume(";"):
-            if is_typename():
-                node.init = declaration()
-            else:
-                node.init = read_expr_stmt()
-                tokenize.expect(";")
-        if not tokenize.consume(";"):
-            node.cond = expr()
-            tokenize.expect(";")
-        if not tokenize.consume(")"):
-            node.inc = read_expr_stmt()
-            tokenize.expect(")")
-        node.then = stmt()
-
-        leave_scope(sc)
-        return node
-
-    if tokenize.consume("{"):
-        head = new_node(NodeKind.ND_DEFAULT)
+        # 读取函数体
+        head = Node(NodeKind.ND_DEFAULT)
         cur = head
-
-        sc = enter_scope()
-        while not tokenize.consume("}"):
-            cur.next = stmt()
+        self.stream.expect('{')
+        while not self.stream.consume('}'):
+            cur.next = self.stmt()
             cur = cur.next
-        leave_scope(sc)
-
-        node = new_node(NodeKind.ND_BLOCK)
-        node.body = head.next
-
+        self.leave_scope(sc)
+
+        fn.node = head.next
+        fn.locals = self.locals
+
+        return fn
+
+    # declaration = basetype ident ("[" num "]")* ("=" expr) ";"
+    #             | basetype ";"
+    def declaration(self):
+        ty = self.basetype()
+        if self.stream.consume(';'):
+            return new_node(NodeKind.ND_NULL)
+
+        ident = self.stream.current()
+        name = self.stream.expect_ident()
+        ty = self.type_suffix(ty)
+        var = self.new_lvar(name, ty)
+
+        if self.stream.consume(';'):
+            return new_node(NodeKind.ND_NULL)
+
+        tok = self.stream.current()
+        self.stream.expect('=')
+        lhs = new_var_node(var, ident)
+        rhs = self.expr()
+        self.stream.expect(';')
+        node = new_binary(NodeKind.ND_ASSIGN, lhs, rhs, tok=tok)
+        return new_unary(NodeKind.ND_EXPR_STMT, node, tok=tok)
+
+    def is_typename(self):
+        return (self.stream.peek("int")
+                or self.stream.peek("char")
+                or self.stream.peek("struct")
+                or self.stream.peek("short")
+                or self.stream.peek("long")
+                or self.stream.peek("void")
+                or self.stream.peek("bool")
+                or self.stream.peek("enum")
+                or self.stream.peek("union")
+                or self.find_typedef(self.stream.current()))
+
+    def stmt(self):
+        tok = self.stream.current()
+        node = self.stmt2()
+        type.add_type(node)
+        # 语句节点记录语句的第一个token，codegen据此将汇编代码对应到源代码行
+        node.tok = tok
         return node
 
-    if tokenize.consume("typedef"):
-        ty = basetype()
-        name = tokenize.expect_ident()
-        ty = type_suffix(ty)
-        tokenize.expect(";")
-        sc = push_scope(name)
-        sc.typedef = ty
-        return new_node(NodeKind.ND_NULL)
+    # stmt2 = "return" expr ";"
+    #      | "if" "(" expr ")" stmt ("else" stmt)?
+    #      | "switch" "(" expr ")" stmt
+    #      | "case" num ":" stmt
+    #      | "default" ":" stmt
+    #      | "while" "(" expr ")" stmt
+    #      | "for" "(" (expr? ";" | declaration) expr? ";" expr? ")" stmt
+    #      | "{" stmt* "}"
+    #      | "typedef" basetype ident ("[" num "]")* ";"
+    #      | "break" ";"
+    #      | "continue" ";"
+    #      | "goto.c" ident ";"
+    #      | ident ":" stmt
+    #      | declaration
+    #      | expr ";"
+    def stmt2(self):
+        if self.stream.consume("return"):
+            node = new_unary(NodeKind.ND_RETURN, self.expr(), tok=None)
+            self.stream.expect(";")
+            return node
 
-    if is_typename():
-        return declaration()
+        if self.stream.consume("if"):
+            node = new_node(NodeKind.ND_IF)
+            self.stream.expect("(")
+            node.cond = self.expr()
+            self.stream.expect(")")
+            node.then = self.stmt()
+            if self.stream.consume("else"):
+                node.els = self.stmt()
+            return node
 
-    if tokenize.consume("break"):
-        tokenize.expect(";")
-        return new_node(NodeKind.ND_BREAK)
+        if self.stream.consume("switch"):
+            node = new_node(NodeKind.ND_SWITCH)
+            self.stream.expect("(")
+            node.cond = self.expr()
 
-    if tokenize.consume("continue"):
-        tokenize.expect(";")
-        return new_node(NodeKind.ND_CONTINUE)
+            self.stream.expect(")")
 
-    if tokenize.consume("goto.c"):
-        node = new_node(NodeKind.ND_GOTO)
-        node.label_name = tokenize.expect_ident()
-        tokenize.expect(";")
-        return node
+            sw = self.current_switch
+            self.current_switch = node
+            node.then = self.stmt()
+            self.current_switch = sw
+            return node
 
-    tok = tokenize.token
-    name = tokenize.consume_ident()
-    if name is not None:
-        if tokenize.consume(":"):
-            node = new_unary(NodeKind.ND_LABEL, stmt())
-            node.label_name = name.strFc
+        if self.stream.consume("case"):
+            if self.current_switch is None:
+                raise RuntimeError("stray case", self.stream.current())
+            val = self.stream.expect_number()
+            self.stream.expect(":")
+            node = new_unary(NodeKind.ND_CASE, self.stmt())
+            node.val = val
+            node.case_next = self.current_switch.case_next
+            self.current_switch.case_next = node
             return node
-        tokenize.token = tok
-
-    node = read_expr_stmt()
-    tokenize.expect(";")
-    return node
-
-
-# expr = assign ("," assign)*
-def expr():
-    node = assign()
-    while tokenize.consume(","):
-        node = new_unary(NodeKind.ND_EXPR_STMT, node)
-        node = new_binary(NodeKind.ND_COMMA, node, assign())
-    return node
-
-
-# assign    = logor (assign-op assign)?
-# assign-op = "=" | "+=" | "-=" | "*=" | %= | "/=" | "<<=" | ">>="
-def assign():
-    node = logor()
-    if tokenize.consume("="):
-        return new_binary(NodeKind.ND_ASSIGN, node, assign(), tok=tokenize.token)
-    if tokenize.consume("*="):
-        return new_binary(NodeKind.ND_MUL_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume("/="):
-        return new_binary(NodeKind.ND_DIV_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume("%="):
-        return new_binary(NodeKind.ND_MOD_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume("<<="):
-        return new_binary(NodeKind.ND_SHL_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume(">>="):
-        return new_binary(NodeKind.ND_SHR_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume("+="):
-        type.add_type(node)
-        if node.ty.base is not None:
-            return new_binary(NodeKind.ND_PTR_ADD_EQ, node, assign(), tok=tokenize.token)
-        return new_binary(NodeKind.ND_ADD_EQ, node, assign(), tok=tokenize.token)
-    if tokenize.consume("-="):
-        type.add_type(node)
-        if node.ty.base is not None:
-            return new_binary(NodeKind.ND_PTR_SUB_EQ, node, assign(), tok=tokenize.token)
-        return new_binary(NodeKind.ND_SUB_EQ, node, assign(), tok=tokenize.token)
-    return node
 
+        if self.stream.consume("default"):
+            if self.current_switch is None:
+                raise RuntimeError("stray default", self.stream.current())
+            self.stream.expect(":")
 
-# equality = relational ("==" relational | "!=" relational)*
-def equality():
-    node = relational()
+            node = new_unary(NodeKind.ND_DEFAULT, self.stmt())
+            self.current_switch.default_case = node
+            return node
 
-    while True:
-        if tokenize.consume("=="):
-            node = new_binary(NodeKind.ND_EQ, node, relational(), tok=tokenize.token)
-        elif tokenize.consume("!="):
-            node = new_binary(NodeKind.ND_NE, node, relational(), tok=tokenize.token)
-        else:
+        if self.stream.consume("while"):
+            node = new_node(NodeKind.ND_WHILE)
+            self.stream.expect("(")
+            node.cond = self.expr()
+            self.stream.expect(")")
+            node.then = self.stmt()
             return node
 
+        if self.stream.consume("for"):
+            node = new_node(NodeKind.ND_FOR)
+
+            self.stream.expect("(")
+            sc = self.enter_scope()
+            if not self.stream.consume(";"):
+                if self.is_typename():
+                    node.init = self.declaration()
+                else:
+                    node.init = self.read_expr_stmt()
+                    self.stream.expect(";")
+            if not self.stream.consume(";"):
+                node.cond = self.expr()
+                self.stream.expect(";")
+            if not self.stream.consume(")"):
+                node.inc = self.read_expr_stmt()
+                self.stream.expect(")")
+            node.then = self.stmt()
+
+            self.leave_scope(sc)
+            return node
 
-# relational = shift ("<" shift | "<=" shift | ">" shift | ">=" shift)*
-def relational():
-    node = shift()
+        if self.stream.consume("{"):
+            head = new_node(NodeKind.ND_DEFAULT)
+            cur = head
 
-    while True:
-        if tokenize.consume("<"):
-            node = new_binary(NodeKind.ND_LT, node, shift(), tok=tokenize.token)
-        elif tokenize.consume("<="):
-            node = new_binary(NodeKind.ND_LE, node, shift(), tok=tokenize.token)
-        elif tokenize.consume(">"):
-            node = new_binary(NodeKind.ND_LT, shift(), node, tok=tokenize.token)
-        elif tokenize.consume(">="):
-            node = new_binary(NodeKind.ND_LE, shift(), node, tok=tokenize.token)
-        else:
-            return node
+            sc = self.enter_scope()
+            while not self.stream.consume("}"):
+                cur.next = self.stmt()
+                cur = cur.next
+            self.leave_scope(sc)
 
+            node = new_node(NodeKind.ND_BLOCK)
+            node.body = head.next
 
-# shift = add ("<<" add | ">>" add)*
-def shift():
-    node = add()
+            return node
 
-    while True:
-        if tokenize.consume("<<"):
-            node = new_binary(NodeKind.ND_SHL, node, add(), tok=tokenize.token)
-        elif tokenize.consume(">>"):
-            node = new_binary(NodeKind.ND_SHR, node, add(), tok=tokenize.token)
-        else:
+        if self.stream.consume("typedef"):
+            ty = self.basetype()
+            name = self.stream.expect_ident()
+            ty = self.type_suffix(ty)
+            self.stream.expect(";")
+            sc = self.push_scope(name)
+            sc.typedef = ty
+            return new_node(NodeKind.ND_NULL)
+
+        if self.is_typename():
+            return self.declaration()
+
+        if self.stream.consume("break"):
+            self.stream.expect(";")
+            return new_node(NodeKind.ND_BREAK)
+
+        if self.stream.consume("continue"):
+            self.stream.expect(";")
+            return new_node(NodeKind.ND_CONTINUE)
+
+        if self.stream.consume("goto.c"):
+            node = new_node(NodeKind.ND_GOTO)
+            node.label_name = self.stream.expect_ident()
+            self.stream.expect(";")
             return node
 
+        pos = self.stream.mark()
+        name = self.stream.consume_ident()
+        if name is not None:
+            if self.stream.consume(":"):
+                node = new_unary(NodeKind.ND_LABEL, self.stmt())
+                node.label_name = name.strFc
+                return node
+            self.stream.rewind(pos)
 
-def new_add(lhs, rhs, tok=tokenize.token):
-    type.add_type(lhs)
-    type.add_type(rhs)
+        node = self.read_expr_stmt()
+        self.stream.expect(";")
+        return node
 
-    if type.is_integer(lhs.ty) and type.is_integer(rhs.ty):
-        return new_binary(NodeKind.ND_ADD, lhs, rhs, tok)
-    elif lhs.ty.base is not None and type.is_integer(rhs.ty):
-        return new_binary(NodeKind.ND_PTR_ADD, lhs, rhs, tok)
-    elif rhs.ty.base is not None and type.is_integer(lhs.ty):
-        return new_binary(NodeKind.ND_PTR_ADD, rhs, lhs, tok)
-    else:
-        raise RuntimeError("invalid operands, %s", tok.str)
+    # expr = assign ("," assign)*
+    def expr(self):
+        node = self.assign()
+        while self.stream.consume(","):
+            node = new_unary(NodeKind.ND_EXPR_STMT, node)
+            node = new_binary(NodeKind.ND_COMMA, node, self.assign())
+        return node
 
+    # assign    = logor (assign-op assign)?
+    # assign-op = "=" | "+=" | "-=" | "*=" | %= | "/=" | "<<=" | ">>="
+    def assign(self):
+        node = self.logor()
+        tok = self.stream.current()
+        if self.stream.consume("="):
+            return new_binary(NodeKind.ND_ASSIGN, node, self.assign(), tok=tok)
+        if self.stream.consume("*="):
+            return new_binary(NodeKind.ND_MUL_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume("/="):
+            return new_binary(NodeKind.ND_DIV_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume("%="):
+            return new_binary(NodeKind.ND_MOD_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume("<<="):
+            return new_binary(NodeKind.ND_SHL_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume(">>="):
+            return new_binary(NodeKind.ND_SHR_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume("+="):
+            type.add_type(node)
+            if node.ty.base is not None:
+                return new_binary(NodeKind.ND_PTR_ADD_EQ, node, self.assign(), tok=tok)
+            return new_binary(NodeKind.ND_ADD_EQ, node, self.assign(), tok=tok)
+        if self.stream.consume("-="):
+            type.add_type(node)
+            if node.ty.base is not None:
+                return new_binary(NodeKind.ND_PTR_SUB_EQ, node, self.assign(), tok=tok)
+            return new_binary(NodeKind.ND_SUB_EQ, node, self.assign(), tok=tok)
+        return node
 
-def new_sub(lhs, rhs, tok):
-    type.add_type(lhs)
-    type.add_type(rhs)
+    # equality = relational ("==" relational | "!=" relational)*
+    def equality(self):
+        node = self.relational()
 
-    if type.is_integer(lhs.ty) and type.is_integer(rhs.ty):
-        return new_binary(NodeKind.ND_SUB, lhs, rhs, tok)
-    elif lhs.ty.base is not None and type.is_integer(rhs.ty):
-        return new_binary(NodeKind.ND_PTR_SUB, lhs, rhs, tok)
-    elif lhs.ty.base is not None and rhs.ty.base is not None:
-        return new_binary(NodeKind.ND_PTR_DIFF, lhs, rhs, tok)
-    else:
-        tokenize.error("invalid operands, %s", tok)
+        while True:
+            tok = self.stream.current()
+            if self.stream.consume("=="):
+                node = new_binary(NodeKind.ND_EQ, node, self.relational(), tok=tok)
+            elif self.stream.consume("!="):
+                node = new_binary(NodeKind.ND_NE, node, self.relational(), tok=tok)
+            else:
+                return node
 
+    # relational = shift ("<" shift | "<=" shift | ">" shift | ">=" shift)*
+    def relational(self):
+        node = self.shift()
+
+        while True:
+            tok = self.stream.current()
+            if self.stream.consume("<"):
+                node = new_binary(NodeKind.ND_LT, node, self.shift(), tok=tok)
+            elif self.stream.consume("<="):
+                node = new_binary(NodeKind.ND_LE, node, self.shift(), tok=tok)
+            elif self.stream.consume(">"):
+                node = new_binary(NodeKind.ND_LT, self.shift(), node, tok=tok)
+            elif self.stream.consume(">="):
+                node = new_binary(NodeKind.ND_LE, self.shift(), node, tok=tok)
+            else:
+                return node
 
-# add = mul ("+" mul | "-" mul)*
-def add():
-    node = mul()
+    # shift = add ("<<" add | ">>" add)*
+    def shift(self):
+        node = self.add()
 
-    while True:
-        if tokenize.consume("+"):
-            node = new_add(node, mul(), tok=tokenize.token)
-        elif tokenize.consume("-"):
-            node = new_sub(node, mul(), tok=tokenize.token)
-        else:
-            return node
+        while True:
+            tok = self.stream.current()
+            if self.stream.consume("<<"):
+                node = new_binary(NodeKind.ND_SHL, node, self.add(), tok=tok)
+            elif self.stream.consume(">>"):
+                node = new_binary(NodeKind.ND_SHR, node, self.add(), tok=tok)
+            else:
+                return node
 
+    def new_add(self, lhs, rhs, tok=None):
+        type.add_type(lhs)
+        type.add_type(rhs)
 
-# mul = cast ("*" cast | "/" cast | "%" cast)*
-def mul():
-    node = unary()
-    while True:
-        if tokenize.consume("*"):
-            node = new_binary(NodeKind.ND_MUL, node, cast(), tok=tokenize.token)
-        elif tokenize.consume("/"):
-            node = new_binary(NodeKind.ND_DIV, node, cast(), tok=tokenize.token)
-        elif tokenize.consume("%"):
-            node = new_binary(NodeKind.ND_MOD, node, cast(), tok=tokenize.token)
+        if type.is_integer(lhs.ty) and type.is_integer(rhs.ty):
+            return new_binary(NodeKind.ND_ADD, lhs, rhs, tok)
+        elif lhs.ty.base is not None and type.is_integer(rhs.ty):
+            return new_binary(NodeKind.ND_PTR_ADD, lhs, rhs, tok)
+        elif rhs.ty.base is not None and type.is_integer(lhs.ty):
+            return new_binary(NodeKind.ND_PTR_ADD, rhs, lhs, tok)
         else:
-            return node
+            raise RuntimeError("invalid operands, %s", tok.str)
+
+    def new_sub(self, lhs, rhs, tok):
+        type.add_type(lhs)
+        type.add_type(rhs)
+
+        if type.is_integer(lhs.ty) and type.is_integer(rhs.ty):
+            return new_binary(NodeKind.ND_SUB, lhs, rhs, tok)
+        elif lhs.ty.base is not None and type.is_integer(rhs.ty):
+            return new_binary(NodeKind.ND_PTR_SUB, lhs, rhs, tok)
+        elif lhs.ty.base is not None and rhs.ty.base is not None:
+            return new_binary(NodeKind.ND_PTR_DIFF, lhs, rhs, tok)
+        else:
+            tokenize.error("invalid operands, %s", tok)
+
+    # add = mul ("+" mul | "-" mul)*
+    def add(self):
+        node = self.mul()
+
+        while True:
+            tok = self.stream.current()
+            if self.stream.consume("+"):
+                node = self.new_add(node, self.mul(), tok=tok)
+            elif self.stream.consume("-"):
+                node = self.new_sub(node, self.mul(), tok=tok)
+            else:
+                return node
 
+    # mul = cast ("*" cast | "/" cast | "%" cast)*
+    def mul(self):
+        node = self.unary()
+        while True:
+            tok = self.stream.current()
+            if self.stream.consume("*"):
+                node = new_binary(NodeKind.ND_MUL, node, self.cast(), tok=tok)
+            elif self.stream.consume("/"):
+                node = new_binary(NodeKind.ND_DIV, node, self.cast(), tok=tok)
+            elif self.stream.consume("%"):
+                node = new_binary(NodeKind.ND_MOD, node, self.cast(), tok=tok)
+            else:
+                return node
 
-# cast = "(" type-name ")" cast | unary
-def cast():
-    tok = tokenize.token
+    # cast = "(" type-name ")" cast | unary
+    def cast(self):
+        pos = self.stream.mark()
+
+        if self.stream.consume('('):
+            if self.is_typename():
+                ty = self.basetype()
+                self.stream.expect(')')
+                node = new_unary(NodeKind.ND_CAST, self.cast())
+                type.add_type(node.lhs)
+                node.ty = ty
+                return node
+            self.stream.rewind(pos)
+        return self.unary()
+
+    # unary = ("+" | "-" | "*" | "&" | "!")? cast
+    # | ("++" | "--") unary
+    # | postfix
+    def unary(self):
+        if self.stream.consume("+"):
+            return self.unary()
+        if self.stream.consume("-"):
+            return new_binary(NodeKind.ND_SUB,
+                              new_node(NodeKind.ND_NUM, 0),
+                              self.primary())
+        if self.stream.consume("&"):
+            return new_unary(NodeKind.ND_ADDR, self.unary())
+        if self.stream.consume("*"):
+            return new_unary(NodeKind.ND_DEREF, self.unary())
+        if self.stream.consume("!"):
+            return new_unary(NodeKind.ND_NOT, self.unary())
+        if self.stream.consume("++"):
+            return new_unary(NodeKind.ND_PRE_INC, self.unary())
+        if self.stream.consume("--"):
+            return new_unary(NodeKind.ND_PRE_DEC, self.unary())
+
+        return self.postfix()
+
+    def struct_ref(self, lhs):
+        type.add_type(lhs)
+        if lhs.ty.kind != type.TypeKind.TY_STRUCT:
+            raise RuntimeError("not a struct", lhs.tok)
+
+        mem = find_member(lhs.ty, self.stream.expect_ident())
+        if mem is None:
+            raise RuntimeError("no such member", self.stream.current())
+
+        node = new_unary(NodeKind.ND_MEMBER, lhs)
+        node.member = mem
+        return node
 
-    if tokenize.consume('('):
-        if is_typename():
-            ty = basetype()
-            tokenize.expect(')')
-            node = new_unary(NodeKind.ND_CAST, cast())
-            type.add_type(node.lhs)
-            node.ty = ty
+    # postfix = primary ("[" expr "]" | "." ident | "->" ident | "++" | "--")*
+    def postfix(self):
+        node = self.primary()
+
+        while True:
+            if self.stream.consume('['):
+                exp = self.new_add(node, self.expr())
+                self.stream.expect(']')
+                node = new_unary(NodeKind.ND_DEREF, exp)
+                continue
+            elif self.stream.consume('.'):
+                node = self.struct_ref(node)
+                continue
+            elif self.stream.consume('->'):
+                node = new_unary(NodeKind.ND_DEREF, node)
+                node = self.struct_ref(node)
+                continue
+            elif self.stream.consume("++"):
+                node = new_unary(NodeKind.ND_POST_INC, node)
+                continue
+            elif self.stream.consume("--"):
+                node = new_unary(NodeKind.ND_POST_DEC, node)
+                continue
             return node
-        tokenize.token = tok
-    return unary()
-
-
-# unary = ("+" | "-" | "*" | "&" | "!")? cast
-# | ("++" | "--") unary
-# | postfix
-def unary():
-    if tokenize.consume("+"):
-        return unary()
-    if tokenize.consume("-"):
-        return new_binary(NodeKind.ND_SUB,
-                          new_node(NodeKind.ND_NUM, 0),
-                          primary())
-    if tokenize.consume("&"):
-        return new_unary(NodeKind.ND_ADDR, unary())
-    if tokenize.consume("*"):
-        return new_unary(NodeKind.ND_DEREF, unary())
-    if tokenize.consume("!"):
-        return new_unary(NodeKind.ND_NOT, unary())
-    if tokenize.consume("++"):
-        return new_unary(NodeKind.ND_PRE_INC, unary())
-    if tokenize.consume("--"):
-        return new_unary(NodeKind.ND_PRE_DEC, unary())
-
-    return postfix()
 
+    # func-args = "(" (assign ("," assign)*)? ")"
+    def func_args(self):
+        if self.stream.consume(')'):
+            return None
 
-def find_member(ty, name):
-    mem = ty.members
-    while mem is not None:
-        if mem.name == name:
-            return mem
-        mem = mem.next
-    return None
-
-
-def struct_ref(lhs):
-    type.add_type(lhs)
-    if lhs.ty.kind != type.TypeKind.TY_STRUCT:
-        raise RuntimeError("not a struct", lhs.tok)
-
-    mem = find_member(lhs.ty, tokenize.expect_ident())
-    if mem is None:
-        raise RuntimeError("no such member", tokenize.token)
-
-    node = new_unary(NodeKind.ND_MEMBER, lhs)
-    node.member = mem
-    return node
-
-
-# postfix = primary ("[" expr "]" | "." ident | "->" ident | "++" | "--")*
-def postfix():
-    node = primary()
-
-    while True:
-        if tokenize.consume('['):
-            exp = new_add(node, expr())
-            tokenize.expect(']')
-            node = new_unary(NodeKind.ND_DEREF, exp)
-            continue
-        elif tokenize.consume('.'):
-            node = struct_ref(node)
-            continue
-        elif tokenize.consume('->'):
-            node = new_unary(NodeKind.ND_DEREF, node)
-            node = struct_ref(node)
-            continue
-        elif tokenize.consume("++"):
-            node = new_unary(NodeKind.ND_POST_INC, node)
-            continue
-        elif tokenize.consume("--"):
-            node = new_unary(NodeKind.ND_POST_DEC, node)
-            continue
-        return node
-
+        head = self.assign()
+        cur = head
 
-# func-args = "(" (assign ("," assign)*)? ")"
-def func_args():
-    if tokenize.consume(')'):
-        return None
+        while self.stream.consume(','):
+            cur.next = self.assign()
+            cur = cur.next
 
-    head = assign()
-    cur = head
+        self.stream.expect(')')
+        return head
+
+    # primary = "(" expr ")"
+    #         | "sizeof" unary
+    #         | ident func-args?
+    #         | str
+    #         | num
+    def primary(self):
+        if self.stream.consume("("):
+            node = self.expr()
+            self.stream.expect(")")
+            return node
 
-    while tokenize.consume(','):
-        cur.next = assign()
-        cur = cur.next
+        if self.stream.consume("sizeof"):
+            node = self.unary()
+            type.add_type(node)
+            return self.new_num(node.ty.size)
+
+        ident = self.stream.consume_ident()
+        if ident is not None:
+            # 函数调用
+            if self.stream.consume('('):
+                node = new_node(NodeKind.ND_FUNCALL, tok=ident)
+                node.funcname = ident.str
+                node.args = self.func_args()
+                return node
 
-    tokenize.expect(')')
-    return head
+            # 变量
+            sc = self.find_var(ident)
+            if sc is not None:
+                if sc.var is not None:
+                    return new_var_node(sc.var, tok=ident)
+                elif sc.enum_ty is not None:
+                    return self.new_num(sc.enum_val, tok=ident)
+            else:
+                raise RuntimeError("undefined variable: %s", ident.str)
 
+        tok = self.stream.current()
+        if tok.kind == tokenize.TokenKind.TK_STR:
+            self.stream.advance()
 
-# primary = "(" expr ")"
-#         | "sizeof" unary
-#         | ident func-args?
-#         | str
-#         | num
-def primary():
-    if tokenize.consume("("):
-        node = expr()
-        tokenize.expect(")")
-        return node
+            ty = type.array_of(type.char_type, tok.cont_len)
+            var = self.new_gvar(self.new_label(), ty, True)
+            var.contents = tok.contents
+            var.cont_len = tok.cont_len
+            return new_var_node(var, tok=tok)
 
-    if tokenize.consume("sizeof"):
-        node = unary()
-        type.add_type(node)
-        return new_num(node.ty.size)
-
-    ident = tokenize.consume_ident()
-    if ident is not None:
-        # 函数调用
-        if tokenize.consume('('):
-            node = new_node(NodeKind.ND_FUNCALL)
-            node.funcname = ident.str
-            node.args = func_args()
-            return node
+        return self.new_num()
 
-        # 变量
-        sc = find_var(ident)
-        if sc is not None:
-            if sc.var is not None:
-                return new_var_node(sc.var, tok=ident)
-            elif sc.enum_ty is not None:
-                return new_num(sc.enum_val, tok=ident)
-        else:
-            raise RuntimeError("undefined variable: %s", ident.str)
 
-    tok = tokenize.token
-    if tok.kind == tokenize.TokenKind.TK_STR:
-        tokenize.token = tokenize.token.next
+prog = None
 
-        ty = type.array_of(type.char_type, tok.cont_len)
-        var = new_gvar(new_label(), ty, True)
-        var.contents = tok.contents
-        var.cont_len = tok.cont_len
-        return new_var_node(var, tok=tok)
 
-    return new_num()
+def program():
+    """
+    对tokenize.stream进行语法分析，每次调用都使用新的Parser
+    """
+    return Parser(tokenize.stream).program()
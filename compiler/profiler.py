@@ -0,0 +1,226 @@
+"""
+    客户程序性能剖析
+
+    以单独的执行循环运行虚拟机，统计每行汇编代码与每个函数执行的指令数，
+    函数的调用次数、包含与不包含被调函数的指令数，并可导出火焰图所用的折叠栈格式。
+    借助 Compiler.line_map，每行汇编代码的执行次数可在报告时汇总到C源代码行。
+    剖析只在调用 profile 时进行，Machine.run 的执行循环不受影响。
+
+    用法（在仓库根目录下执行）：
+        python -m compiler.profiler example/rsa.c
+        python -m compiler.profiler example/fibonacci.c --input 15 --collapsed fib.folded
+        flamegraph.pl fib.folded > fib.svg
+"""
+import argparse
+import sys
+
+from compiler import interpreter
+
+
+class FunctionProfile:
+    """
+    函数的剖析结果
+    :param name: 函数名
+    :param calls: 调用次数
+    :param exclusive: 函数自身执行的指令数
+    :param inclusive: 函数及其调用的函数执行的指令数，递归调用只计一次
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.exclusive = 0
+        self.inclusive = 0
+
+
+class Profile:
+    """
+    一次运行的剖析结果
+    :param program: 指令记录列表
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.line_counts = [0 for t in range(len(program))]  # 每行汇编代码执行的次数
+        self.stacks = []  # 调用栈编号 -> 调用栈（函数名元组）
+        self.stack_counts = []  # 调用栈编号 -> 在该调用栈上执行的指令数
+        self.functions = {}  # 函数名 -> FunctionProfile
+
+    def total(self):
+        return sum(self.stack_counts)
+
+    def summarize(self):
+        """
+        由各调用栈上的指令数汇总出每个函数的包含与不包含被调函数的指令数
+        """
+        for function in self.functions.values():
+            function.exclusive = 0
+            function.inclusive = 0
+        for stack, count in zip(self.stacks, self.stack_counts):
+            self.function(stack[-1]).exclusive += count
+            for name in set(stack):
+                self.function(name).inclusive += count
+
+    def function(self, name):
+        function = self.functions.get(name)
+        if function is None:
+            function = self.functions[name] = FunctionProfile(name)
+        return function
+
+    def collapsed(self):
+        """
+        导出火焰图的折叠栈格式，每行为 "main;foo;bar 指令数"
+        """
+        return "".join("%s %d\n" % (";".join(stack), count)
+                       for stack, count in zip(self.stacks, self.stack_counts) if count > 0)
+
+    def sourceCounts(self, line_map):
+        """
+        将每行汇编代码的执行次数汇总到C源代码行
+        :param line_map: 汇编代码行到源代码范围的对应表，即 Compiler.line_map
+        :return: 源代码行号 -> 执行的指令数
+        """
+        counts = {}
+        for index, count in enumerate(self.line_counts):
+            if count == 0 or index >= len(line_map) or line_map[index] is None:
+                continue
+            line = line_map[index][0]
+            counts[line] = counts.get(line, 0) + count
+        return counts
+
+    def report(self, lines=20, line_map=None, source=None):
+        """
+        生成文本报告：各函数的调用次数与指令数，以及执行最多的若干行汇编代码
+        给出 line_map 时另列出执行最多的若干行C源代码
+        :param lines: 列出的代码行数
+        :param line_map: 汇编代码行到源代码范围的对应表，即 Compiler.line_map
+        :param source: C源代码，用于在报告中显示源代码行的内容
+        """
+        total = self.total() or 1
+        result = ["%-24s %10s %12s %8s %12s %8s" % ("function", "calls", "inclusive", "%", "exclusive", "%")]
+        for function in sorted(self.functions.values(), key=lambda f: -f.inclusive):
+            result.append("%-24s %10d %12d %7.1f%% %12d %7.1f%%" % (
+                function.name, function.calls, function.inclusive, function.inclusive * 100 / total,
+                function.exclusive, function.exclusive * 100 / total))
+
+        result.append("")
+        result.append("%6s %12s %8s  %s" % ("line", "count", "%", "instruction"))
+        hot = sorted(range(len(self.line_counts)), key=lambda i: -self.line_counts[i])[:lines]
+        for index in hot:
+            if self.line_counts[index] == 0:
+                break
+            instruction = self.program[index]
+            text = instruction.operands[0].text if instruction.length > 1 else instruction.text
+            result.append("%6d %12d %7.1f%%  %s" % (index + 1, self.line_counts[index],
+                                                   self.line_counts[index] * 100 / total, text))
+
+        if line_map is not None:
+            source_lines = source.split("\n") if source is not None else []
+            counts = self.sourceCounts(line_map)
+            result.append("")
+            result.append("%6s %12s %8s  %s" % ("source", "count", "%", "code"))
+            for line in sorted(counts, key=lambda l: -counts[l])[:lines]:
+                text = source_lines[line - 1].strip() if line <= len(source_lines) else ''
+                result.append("%6d %12d %7.1f%%  %s" % (line, counts[line], counts[line] * 100 / total, text))
+        return "\n".join(result)
+
+
+def profile(machine, code=None):
+    """
+    剖析执行虚拟机中的程序，结果与 Machine.run 相同，限额同样生效
+    :param machine: 虚拟机
+    :param code: 要执行的汇编代码，为None时从当前位置继续执行已装载的程序
+    :return Profile: 剖析结果，执行中途出错时可从异常的 profile 属性取得已统计的部分
+    """
+    if code is not None:
+        machine.load(code)
+
+    program = machine.program
+    program_size = len(program)
+    result = Profile(program)
+    line_counts = result.line_counts
+    stack_counts = result.stack_counts
+
+    stack_ids = {}  # 调用栈 -> 编号
+
+    def enter(stack):
+        stack_id = stack_ids.get(stack)
+        if stack_id is None:
+            stack_id = stack_ids[stack] = len(result.stacks)
+            result.stacks.append(stack)
+            stack_counts.append(0)
+        return stack_id
+
+    stack = tuple(machine.callers()) + (machine.current_func,)
+    for name in stack:
+        result.function(name).calls += 1
+    stack_id = enter(stack)
+    depth = machine.call_depth
+
+    executed = machine.executed
+    checkpoint = machine.startBudget()
+    try:
+        while machine.index < program_size:
+            index = machine.index
+            instruction = program[index]
+            machine.index += 1
+            # 调用指令计入调用者，返回指令计入被调用者
+            stack_counts[stack_id] += instruction.length
+            if instruction.length == 1:
+                line_counts[index] += 1
+            else:
+                for line in range(index, index + instruction.length):
+                    line_counts[line] += 1
+            instruction.handler(machine, instruction)
+            executed += instruction.length
+
+            if machine.call_depth != depth:
+                if machine.call_depth > depth:
+                    stack = stack + (machine.current_func,)
+                    result.function(machine.current_func).calls += 1
+                else:
+                    stack = stack[:-1]
+                depth = machine.call_depth
+                stack_id = enter(stack)
+
+            if executed >= checkpoint:
+                checkpoint = machine.checkBudget(executed)
+    except Exception as e:
+        result.summarize()
+        e.profile = result
+        raise
+    finally:
+        machine.executed = executed
+        machine.flushOutput()
+
+    result.summarize()
+    return result
+
+
+def main(argv=None):
+    from compiler import driver
+
+    parser = argparse.ArgumentParser(prog="python -m compiler.profiler", description="剖析 C 程序在解释器中的执行")
+    parser.add_argument("source", help="C 源文件")
+    parser.add_argument("--input", action="append", default=[], help="程序的一行输入，可重复给出")
+    parser.add_argument("--lines", type=int, default=20, help="报告中列出的代码行数")
+    parser.add_argument("--collapsed", help="将折叠栈写入该文件，可交给 flamegraph.pl 生成火焰图")
+    args = parser.parse_args(argv)
+
+    with open(args.source, encoding='utf-8') as f:
+        source = f.read()
+    cc = driver.Compiler()
+    assembly = cc.compile(source)
+
+    machine = interpreter.Machine(stdin=args.input)
+    result = profile(machine, assembly)
+
+    sys.stdout.write(machine.output)
+    print(result.report(args.lines, cc.line_map, source))
+    if args.collapsed:
+        with open(args.collapsed, 'w', encoding='utf-8') as f:
+            f.write(result.collapsed())
+
+
+if __name__ == '__main__':
+    main()
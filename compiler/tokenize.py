@@ -1,16 +1,18 @@
+import re
+import sys
 from enum import Enum
 
 """
     词法分析生成Token
 """
 
-token = None
+punctuators = frozenset(['+', '-', '*', '/', '%', '(', ')', '<', '>', '=',
+                         '!', '[', ']', '{', '}', '&', '|', '~', '^',
+                         ',', '.', ':', ';', ])
 
 
 def ispunct(c):
-    return c in ['+', '-', '*', '/', '%', '(', ')', '<', '>', '=',
-                 '!', '[', ']', '{', '}', '&', '|', '~', '^',
-                 ',', '.', ':', ';', ]
+    return c in punctuators
 
 
 keywords = ["return", "if", "else", "while", "for",
@@ -27,6 +29,23 @@ ops = ["==", "!=", "<=", ">=", "->", "++", "--",
        "*=", "/=", "%=", "+=", "-=", "&=", "^=", "|=", ]
 
 
+keyword_set = frozenset(keywords)
+
+# 词法分析的主正则：先跳过空白字符与注释，再按顺序尝试各分支，每次匹配一个token
+# 运算符按长度从长到短排列，正则依次尝试各分支，即为最长匹配
+scanner = re.compile(r"""
+    (?:\s+|//[^\n]*|/\*.*?\*/)*
+    (?:
+        (?P<string>")
+      | (?P<char>')
+      | (?P<word>[^\W\d_]\w*)
+      | (?P<unclosed>/\*)
+      | (?P<reserved>%s)
+      | (?P<number>\d)
+    )?
+""" % "|".join(re.escape(op) for op in sorted(set(ops) | punctuators, key=len, reverse=True)), re.S | re.X)
+
+
 class TokenKind(Enum):
     TK_RESERVED = 1  # Keywords or punctuators 关键字或者标点符号
     TK_NUM = 2  # Integer literals 整数字面量
@@ -37,105 +56,311 @@ class TokenKind(Enum):
 
 
 class Token:
-    def __init__(self, kind, str, next):
+    __slots__ = ('kind', 'str', 'val', 'contents', 'cont_len', 'loc', 'len', 'line', 'col')
+
+    def __init__(self, kind, str):
         self.kind = kind
         self.str = str
-        self.next = next
+        self.val = None
         self.contents = None
         self.cont_len = None
 
+        # 在源代码中的位置，行号与列号从1开始
+        self.loc = None
+        self.len = 0
+        self.line = None
+        self.col = None
+
+
+class TokenStream:
+    """
+    词法分析的结果：token按顺序保存在列表中，以EOF结尾，pos为当前token的下标
+    向前查看任意个token与回溯都只需读写下标
+
+    编辑源代码后以edit增量地重新分析：只重新扫描受影响的一段，其后的token原样保留。
+    保留的token的位置不立即改写，而是记为自下标gap起的token的偏移与行号尚需加上gap_loc、gap_line，
+    下次编辑时只需改写两次编辑位置之间的token，在同一处连续编辑的开销与文件的长度无关；
+    读取token的位置之前须调用settle。
+    :param tokens: token列表
+    :param source: 源代码
+    """
+    __slots__ = ('tokens', 'pos', 'source', 'gap', 'gap_loc', 'gap_line')
+
+    def __init__(self, tokens, source=None):
+        self.tokens = tokens
+        self.pos = 0
+        self.source = source
+        self.gap = len(tokens)
+        self.gap_loc = 0
+        self.gap_line = 0
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __iter__(self):
+        self.settle()
+        return iter(self.tokens)
+
+    def settle(self):
+        """
+        补上所有token尚未改写的位置
+        """
+        self.move_gap(len(self.tokens))
+        self.gap_loc = self.gap_line = 0
+
+    def move_gap(self, index):
+        """
+        将尚未改写位置的token的起点移到下标index处
+        """
+        tokens = self.tokens
+        if index > self.gap:
+            shift, lines = self.gap_loc, self.gap_line
+            if shift or lines:
+                for i in range(self.gap, index):
+                    tok = tokens[i]
+                    tok.loc += shift
+                    tok.line += lines
+        elif index < self.gap:
+            shift, lines = self.gap_loc, self.gap_line
+            if shift or lines:
+                for i in range(index, self.gap):
+                    tok = tokens[i]
+                    tok.loc -= shift
+                    tok.line -= lines
+        self.gap = index
+
+    def end(self, i):
+        """
+        第i个token在当前源代码中的结束偏移
+        """
+        tok = self.tokens[i]
+        return tok.loc + tok.len + (self.gap_loc if i >= self.gap else 0)
+
+    def edit(self, offset, removed, inserted):
+        """
+        将源代码中自offset起的removed个字符替换为inserted，只重新扫描受影响的token
+        从编辑位置之前最后一个未受影响的token之后开始扫描，直到新的token与原有的token重新对齐：
+        起点相同且位于编辑结束处的下一行之后时，其后的扫描结果必然与原来相同，不再继续
+        出错时（如出现无法识别的token）与tokenize抛出相同的异常，并保持编辑前的状态
+        :param offset: 编辑的位置
+        :param removed: 删除的字符数
+        :param inserted: 插入的文本
+        :return: (first, last)，新扫描出的token为tokens[first:last]
+        """
+        source = self.source
+        if offset < 0 or removed < 0 or offset + removed > len(source):
+            raise RuntimeError("编辑超出了源代码的范围: %d, %d" % (offset, removed))
+        raw = source[:offset] + inserted + source[offset + removed:]
+        delta = len(inserted) - removed
+        lines = inserted.count("\n") - source.count("\n", offset, offset + removed)
+        tokens = self.tokens
+
+        # 第一个可能受影响的token：结束处不在编辑位置之前（紧挨着编辑位置的token可能被延长）
+        low, high = 0, len(tokens) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.end(middle) < offset:
+                low = middle + 1
+            else:
+                high = middle
+        first = low
+        # 读数字时会越过数字本身向后查看（如0x1f读作0与x1f），紧挨着的数字也可能受影响
+        while first > 0 and tokens[first - 1].kind == TokenKind.TK_NUM and \
+                self.end(first - 1) == tokens[first].loc + (self.gap_loc if first >= self.gap else 0):
+            first -= 1
+        if self.gap < first:
+            self.move_gap(first)
+
+        if first > 0:
+            previous = tokens[first - 1]
+            p = previous.loc + previous.len
+            line = previous.line + raw.count("\n", previous.loc, p)
+        else:
+            p, line = 0, 1
+
+        # 未被编辑、且位于编辑结束处的下一行之后的原有token可用于对齐，对齐后其行号整体平移、列号不变
+        edit_end = offset + removed
+        newline = raw.find("\n", offset + len(inserted))
+        stable = newline if newline >= 0 else len(raw)
+        eof = len(tokens) - 1
+        last = first
+        fresh = []
+        for tok in scan(raw, p, line, raw.rfind("\n", 0, p) + 1):
+            if tok.kind == TokenKind.TK_EOF:
+                last = len(tokens)
+                fresh.append(tok)
+                break
+            start = tok.loc
+            while last < eof:
+                old_start = tokens[last].loc + (self.gap_loc if last >= self.gap else 0)
+                if old_start >= edit_end and old_start + delta >= start:
+                    break
+                last += 1
+            if start > stable and last < eof and old_start + delta == start:
+                break
+            fresh.append(tok)
+
+        # 其后的token整体平移
+        if self.gap > last:
+            self.move_gap(last)
+        tokens[first:last] = fresh
+        self.gap = first + len(fresh)
+        self.gap_loc += delta
+        self.gap_line += lines
+        if self.gap == len(tokens):
+            self.gap_loc = self.gap_line = 0
+        self.source = raw
+        self.pos = 0
+        return first, self.gap
+
+    def current(self):
+        return self.tokens[self.pos]
+
+    def look(self, k):
+        """
+        当前token之后的第k个token，越过结尾时为EOF
+        """
+        return self.tokens[min(self.pos + k, len(self.tokens) - 1)]
+
+    def advance(self):
+        """
+        消耗当前的token并返回，停在EOF处
+        """
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_EOF:
+            self.pos += 1
+        return tok
+
+    def mark(self):
+        """
+        记下当前位置，供rewind回溯
+        """
+        return self.pos
+
+    def rewind(self, pos):
+        self.pos = pos
+
+    # Consumes the current token if it matches `op`.
+    # 如果当前的token匹配op，就消耗掉这个token，返回True
+    def consume(self, op):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_RESERVED or tok.str != op:
+            return None
+        self.pos += 1
+        return tok
+
+    # 如果当前的token是op，返回token，否则返回None
+    def peek(self, s):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_RESERVED or tok.str != s:
+            return None
+        return tok
+
+    def peek_ident(self):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_IDENT:
+            return None
+        return tok
+
+    def consume_ident(self):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_IDENT:
+            return None
+        self.pos += 1
+        return tok
+
+    # Ensure that the current token is `op`.
+    # 确保当前的token是op
+    def expect(self, op):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_RESERVED or tok.str != op:
+            raise RuntimeError("Error: expected '%s', but got '%s'" % (op, tok.str))
+        self.pos += 1
+
+    # Ensure that the current token is TK_NUM.
+    # 确保当前的token是数字
+    def expect_number(self):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_NUM:
+            raise RuntimeError("Error: expected a number, but got %s" % tok.str)
+        self.pos += 1
+        return int(tok.str)
+
+    # 确保当前的Token为标识符
+    def expect_ident(self):
+        tok = self.tokens[self.pos]
+        if tok.kind != TokenKind.TK_IDENT:
+            raise RuntimeError("Error: expected an identifier, but got %s" % tok.str)
+        self.pos += 1
+        return tok.str
+
+    def at_eof(self):
+        return self.tokens[self.pos].kind == TokenKind.TK_EOF
+
+
+# 语法分析所读的token序列，以下函数读写其当前位置
+stream = None
+
+
+def current():
+    return stream.tokens[stream.pos]
+
+
+def advance():
+    return stream.advance()
+
+
+def mark():
+    return stream.mark()
+
+
+def rewind(pos):
+    stream.rewind(pos)
 
-# Consumes the current token if it matches `op`.
-# 如果当前的token匹配op，就消耗掉这个token，返回True
-def consume(op):
-    global token
-    if token is None:
-        return None
-
-    if token.kind != TokenKind.TK_RESERVED or token.str != op:
-        return None
-
-    t = token
 
-    token = token.next
-    return t
+def consume(op):
+    return stream.consume(op)
 
 
-# 如果当前的token是op，返回token，否则返回None
 def peek(s):
-    global token
-    if token.kind != TokenKind.TK_RESERVED or token.str != s:
-        return None
-    return token
+    return stream.peek(s)
 
 
 def peek_ident():
-    global token
-    if token.kind != TokenKind.TK_IDENT:
-        return None
-    return token
+    return stream.peek_ident()
 
 
 def consume_ident():
-    global token
-
-    if token is None:
-        return False
-
-    if token.kind != TokenKind.TK_IDENT:
-        return None
+    return stream.consume_ident()
 
-    ident = token
-    token = token.next
 
-    return ident
-
-
-# Ensure that the current token is `op`.
-# 确保当前的token是op
 def expect(op):
-    global token
-    if peek(op) is None:
-        raise RuntimeError("Error: expected '%s', but got '%s'" % (op, token.str))
-    token = token.next
+    stream.expect(op)
 
 
-# Ensure that the current token is TK_NUM.
-# 确保当前的token是数字
 def expect_number():
-    global token
-    if token.kind != TokenKind.TK_NUM:
-        raise RuntimeError("Error: expected a number, but got %s" % token.str)
-
-    val = int(token.str)
-    token = token.next
-    return val
+    return stream.expect_number()
 
 
-# 确保当前的Token为标识符
 def expect_ident():
-    global token
-    if token.kind != TokenKind.TK_IDENT:
-        raise RuntimeError("Error: expected an identifier, but got %s" % token.str)
-    ident = token.str
-    token = token.next
-    return ident
+    return stream.expect_ident()
 
 
 def at_eof():
-    global token
-    if token is None:
-        return True
-    return token.kind == TokenKind.TK_EOF
+    return stream.at_eof()
 
 
 def starts_with_reserved(p, raw):
-    for keyword in keywords:
-        if raw[p:p + len(keyword)] == keyword and not raw[p + len(keyword)].isalnum():
-            return keyword, p + len(keyword)
-    for op in ops:
-        if raw[p:p + len(op)] == op:
-            return op, p + len(op)
+    """
+    raw在p处是否以关键字或运算符开始
+    :return: (关键字或运算符, 其后的位置)，不是时为(None, p)
+    """
+    m = scanner.match(raw, p)
+    kind = m.lastgroup
+    if kind not in ('word', 'reserved') or m.start(kind) != p:
+        return None, p
+    if kind == 'reserved' or m.group(kind) in keyword_set:
+        return m.group(kind), m.end()
     return None, p
 
 
@@ -168,7 +393,7 @@ def read_float_literal(raw, start):
     if raw[p] in ['f', 'F']:
         p += 1
 
-    tok = Token(TokenKind.TK_NUM, raw[start:p], None)
+    tok = Token(TokenKind.TK_NUM, raw[start:p])
     return tok, p
 
 
@@ -194,7 +419,7 @@ def read_int_literal(raw, start):
 
     val = int(raw[start:p], base)
 
-    tok = Token(TokenKind.TK_NUM, val, None)
+    tok = Token(TokenKind.TK_NUM, val)
     tok.val = val
     return tok, p
 
@@ -239,7 +464,7 @@ def read_char_literal(raw, start):
     if raw[q] != "'":
         raise RuntimeError("char literal too long")
 
-    tok = Token(TokenKind.TK_NUM, ord(c), None)
+    tok = Token(TokenKind.TK_NUM, ord(c))
     return tok, q + 1
 
 
@@ -260,80 +485,83 @@ def read_string_literal(raw, start):
             buf += raw[q]
             q += 1
 
-    tok = Token(TokenKind.TK_STR, raw[p + 1:q], None)
+    tok = Token(TokenKind.TK_STR, raw[p + 1:q])
     tok.contents = raw[p + 1:q]
     tok.cont_len = q - p - 1
 
     return tok
 
 
-# Tokenize `raw` and returns new tokens.
-# 对raw进行tokenize，返回生成的tokens
-def tokenize(raw):
-    p = 0
-    head = Token(TokenKind.TK_RESERVED, None, None)
-    cur = head
-    while p < len(raw):
-        # 空白字符
-        if raw[p].isspace():
-            p += 1
-            continue
-
-        if raw[p:p + 2] == '//':
-            p += 2
-            while raw[p] != '\n':
-                p += 1
-            continue
-
-        if raw[p:p + 2] == '/*':
-            p += 2
-            while raw[p:p + 2] != '*/':
-                p += 1
-            p += 2
-            continue
-
-        # 字符串字面值
-        if raw[p] == '"':
-            cur.next = read_string_literal(raw, p)
-            cur = cur.next
-            p += cur.cont_len + 2
-            continue
-
-        if raw[p] == "'":
-            cur.next, p = read_char_literal(raw, p)
-            cur = cur.next
-            continue
-
-        # 关键字
-        reserved, p = starts_with_reserved(p, raw)
-        if reserved is not None:
-            cur.next = Token(TokenKind.TK_RESERVED, reserved, None)
-            cur = cur.next
-            continue
-
-        # 变量标识符
-        if raw[p].isalpha():
-            q = p
-            while q < len(raw) and (raw[q].isalnum() or raw[q] == '_'):
-                q += 1
-            cur.next = Token(TokenKind.TK_IDENT, raw[p:q], None)
-            cur = cur.next
-            p = q
-            continue
-
-        # 单字符运算符
-        if ispunct(raw[p]):
-            cur.next = Token(TokenKind.TK_RESERVED, raw[p], None)
-            cur = cur.next
-            p += 1
-            continue
+def scan(raw, p=0, line=1, line_start=0):
+    """
+    以主正则从p开始从左到右扫描，逐个生成token并记录其位置，最后生成EOF
+    关键字由标识符查表得到，运算符由正则做最长匹配
+    :param raw: 源代码
+    :param p: 开始扫描的偏移
+    :param line: p所在的行号
+    :param line_start: 第line行起始的偏移
+    """
+    end = len(raw)
+    match = scanner.match
+    count = raw.count
+    intern = sys.intern
+    last = p  # 已统计过换行符的位置
+    while True:
+        m = match(raw, p)
+        kind = m.lastgroup
+        if kind is None:
+            # 空白字符与注释之后没有token
+            p = m.end()
+            if p < end:
+                raise RuntimeError("invalid token: %s" % raw[p])
+            tok = Token(TokenKind.TK_EOF, None)
+            start = end
+
+        else:
+            start = m.start(kind)
+
+            # 关键字与变量标识符，名字驻留后相同的名字共用同一个字符串
+            if kind == 'word':
+                p = m.end()
+                word = intern(m.group(kind))
+                tok = Token(TokenKind.TK_RESERVED if word in keyword_set else TokenKind.TK_IDENT, word)
+
+            # 运算符
+            elif kind == 'reserved':
+                p = m.end()
+                tok = Token(TokenKind.TK_RESERVED, intern(m.group(kind)))
+
+            # 字符串字面值
+            elif kind == 'string':
+                tok = read_string_literal(raw, start)
+                p = start + tok.cont_len + 2
+
+            elif kind == 'char':
+                tok, p = read_char_literal(raw, start)
+
+            # 数字
+            elif kind == 'number':
+                tok, p = read_number(raw, start)
+
+            else:
+                raise RuntimeError("unclosed comment")
+
+        # 记录token在源代码中的位置
+        newlines = count("\n", last, start)
+        if newlines:
+            line += newlines
+            line_start = raw.rfind("\n", last, start) + 1
+        last = start
+        tok.loc = start
+        tok.len = p - start
+        tok.line = line
+        tok.col = start - line_start + 1
+        yield tok
+        if tok.kind == TokenKind.TK_EOF:
+            return
 
-        # 数字
-        if raw[p].isdigit() or (raw[p] == '.' and raw[p + 1].isdigit()):
-            cur.next, p = read_number(raw, p)
-            cur = cur.next
-            continue
 
-        raise RuntimeError("invalid token: %s" % raw[p])
-    cur.next = Token(TokenKind.TK_EOF, None, None)
-    return head.next
+# Tokenize `raw` and returns new tokens.
+# 对raw进行tokenize，返回生成的TokenStream
+def tokenize(raw):
+    return TokenStream(list(scan(raw)), raw)
@@ -0,0 +1,367 @@
+"""
+    基本块翻译：解释器之上的可选执行层
+
+    以标签与跳转、调用、返回指令为界，将程序划分为基本块。
+    基本块被执行的次数达到阈值后，翻译为一个 Python 函数并缓存至本次运行结束，之后整块执行，不再逐条取指、分派。
+    常用指令（push、pop、mov、add、sub、cmp、跳转等）直接生成等价的 Python 代码，其余指令在块内直接调用其处理函数。
+
+    用法：
+        translate.run(code)                 # 与 interpreter.run(code) 相同，结果在 interpreter.output 中
+        translate.stats                     # 本次运行的翻译统计
+        translate.execute(machine)          # 以翻译方式执行已装载程序的虚拟机，返回翻译统计
+"""
+from compiler import interpreter
+from compiler.interpreter import AddressingMode, MAX_64BIT_UNSIGNED_INT, MEMORY_SIZE, RSP, FLAGS, ZF
+
+HOT_THRESHOLD = 16  # 基本块执行多少次后翻译
+
+# 结束基本块的指令，执行后可能改变下一条指令的位置
+BRANCH_MNEMONICS = {"jmp", "jnz", "jne", "je", "call", "ret"}
+
+block_translators = {}  # 处理函数 -> 翻译函数
+
+
+class TranslationStats:
+    """
+    翻译统计
+    :param blocks: 已翻译的基本块数
+    :param translated: 在翻译后的代码中执行的指令数
+    :param interpreted: 逐条解释执行的指令数
+    """
+
+    def __init__(self):
+        self.blocks = 0
+        self.translated = 0
+        self.interpreted = 0
+
+    def share(self):
+        """
+        在翻译后的代码中执行的指令所占的比例
+        """
+        total = self.translated + self.interpreted
+        return self.translated / total if total else 0.0
+
+    def __str__(self):
+        return "translated blocks:%d, translated instructions:%d/%d (%.1f%%)" % (
+            self.blocks, self.translated, self.translated + self.interpreted, self.share() * 100)
+
+
+stats = TranslationStats()
+
+
+def register_translator(handler):
+    """
+    为指令的处理函数注册翻译函数
+    翻译函数接收指令记录与块内序号，返回等价的代码行；返回 None 时退化为调用处理函数
+    指令记录的处理函数被替换（如被包装）时，不会匹配到翻译函数，同样退化为调用处理函数
+    """
+
+    def decorator(translator):
+        block_translators[handler] = translator
+        return translator
+
+    return decorator
+
+
+def readRegister(register):
+    """
+    读取寄存器的代码
+    """
+    if register.mask == MAX_64BIT_UNSIGNED_INT:
+        return "registers[%d]" % register.index
+    return "(registers[%d] & %d)" % (register.index, register.mask)
+
+
+def writeRegister(register, value):
+    """
+    写入寄存器的代码，保留未被写入的高位
+    """
+    if register.keep == 0:
+        return "registers[%d] = (%s) & %d" % (register.index, value, register.mask)
+    return "registers[%d] = registers[%d] & %d | (%s) & %d" % (
+        register.index, register.index, register.keep, value, register.mask)
+
+
+def readValue(operand):
+    """
+    读取寄存器或立即数操作数的代码，无法翻译时返回 None
+    """
+    if operand.is_register:
+        return readRegister(operand.value)
+    if operand.mode == AddressingMode.IMMEDIATE and type(operand.value) == int:
+        return repr(operand.value)
+    return None
+
+
+def blockEnd(program, start, labels):
+    """
+    计算从 start 开始的基本块的结束位置（不含）
+    :param labels: 所有标签的跳转位置
+    """
+    end = start
+    while end < len(program):
+        instruction = program[end]
+        end += 1
+        if interpreter.instruction_names[instruction.op] in BRANCH_MNEMONICS or end in labels:
+            break
+    return end
+
+
+def translateBlock(machine, program, start, end):
+    """
+    将 program[start:end] 翻译为一个无参函数，在 machine 上整块运行，并将下一条指令的位置设为 end（跳转指令可再修改）
+    生成的代码中，_m<k> 为块内第 k 条指令的内存操作数的求值函数，_h<k>/_o<k> 为其处理函数与指令记录
+    """
+    prelude = ["def make(_i, machine):",
+               "    registers = machine.registers",
+               "    _load = machine.memory.get",
+               "    _store = machine.memory.insert"]
+    body = ["    def block():",
+            "        machine.index = %d" % end]
+    # 超级指令所在的行换回序列的第一条指令，其余行本就保留着原指令，块内按原指令逐条翻译
+    instructions = [instruction.operands[0] if instruction.length > 1 else instruction
+                    for instruction in program[start:end]]
+    for k, instruction in enumerate(instructions):
+        for position, operand in enumerate(instruction.operands):
+            if isinstance(operand, interpreter.Operand) and operand.mode == AddressingMode.MEMORY:
+                prelude.append("    _m%d = _i[%d].operands[%d].value.evaluate" % (k, k, position))
+        translator = block_translators.get(instruction.handler)
+        code = translator(instruction, k) if translator is not None else None
+        if code is None:
+            prelude.append("    _h%d = _i[%d].handler" % (k, k))
+            prelude.append("    _o%d = _i[%d]" % (k, k))
+            code = ["_h%d(machine, _o%d)" % (k, k)]
+        body.extend("        " + line for line in code)
+    body.append("    return block")
+
+    namespace = {}
+    source = "\n".join(prelude + body)
+    exec(compile(source, "<block %d-%d>" % (start, end), "exec"), interpreter.__dict__, namespace)
+    return namespace["make"](instructions, machine)
+
+
+def execute(machine, threshold=HOT_THRESHOLD, stats=None):
+    """
+    以基本块翻译的方式执行虚拟机中已装载的程序，输出与逐条解释执行相同
+    :param machine: 已装载程序的虚拟机
+    :param threshold: 基本块执行多少次后翻译，为0时首次执行即翻译
+    :param stats: 累计翻译统计的对象，执行中途出错时仍保留已执行的部分；为None时新建
+    :return TranslationStats: 本次执行的翻译统计
+    """
+    if stats is None:
+        stats = TranslationStats()
+
+    program = machine.program
+    program_size = len(program)
+    labels = set()
+    for func in machine.functions.values():
+        labels.update(func.labels.values())
+
+    block_ends = {}  # 基本块起始位置 -> 结束位置
+    block_counts = {}  # 基本块起始位置 -> 执行次数
+    blocks = {}  # 基本块起始位置 -> 翻译后的函数
+
+    # 限额按基本块检查：每个块执行前比较一次已执行的指令数
+    executed = machine.executed
+    checkpoint = machine.startBudget()
+    try:
+        while machine.index < program_size:
+            if executed >= checkpoint:
+                checkpoint = machine.checkBudget(executed)
+            start = machine.index
+            block = blocks.get(start)
+            if block is not None:
+                end = block_ends[start]
+                block()
+                executed += end - start
+                stats.translated += end - start
+                continue
+
+            end = block_ends.get(start)
+            if end is None:
+                end = block_ends[start] = blockEnd(program, start, labels)
+            count = block_counts.get(start, 0) + 1
+            block_counts[start] = count
+            if count > threshold:
+                blocks[start] = translateBlock(machine, program, start, end)
+                stats.blocks += 1
+                continue
+
+            # 未翻译的块逐条解释执行，超级指令一次执行多行
+            index = start
+            while index < end:
+                instruction = program[index]
+                machine.index = index + 1
+                instruction.handler(machine, instruction)
+                index += instruction.length
+            executed += end - start
+            stats.interpreted += end - start
+    finally:
+        machine.executed = executed
+        machine.flushOutput()
+
+    return stats
+
+
+def run(code, memory_size=MEMORY_SIZE, stack_top=None, data_base=0, threshold=HOT_THRESHOLD):
+    """
+    以基本块翻译的方式执行汇编代码，与 interpreter.run 相同，输出保存在 interpreter.output 中
+    :param code: 要执行的汇编代码
+    :param threshold: 基本块执行多少次后翻译，为0时首次执行即翻译
+    """
+    global stats
+
+    machine = interpreter.machine = interpreter.Machine(memory_size, stack_top, data_base,
+                                                        interpreter.CompileController)
+    machine.load(code)
+    try:
+        stats = execute(machine, threshold)
+    finally:
+        interpreter.output = machine.output
+
+
+@register_translator(interpreter.nop)
+def translateNop(instruction, k):
+    return []
+
+
+@register_translator(interpreter.push)
+def translatePush(instruction, k):
+    source = instruction.operands[0]
+    if source.mode == AddressingMode.MEMORY:
+        value = "_load(_m%d(registers), 8)" % k
+    else:
+        value = readValue(source)
+    if value is None:
+        return None
+    # 先读出操作数再修改 rsp，以免 push [rsp] 读到移动后的栈顶
+    return ["stack_top = (registers[%d] - 8) & %d" % (RSP, MAX_64BIT_UNSIGNED_INT),
+            "_store(stack_top, %s, 8)" % value,
+            "registers[%d] = stack_top" % RSP]
+
+
+@register_translator(interpreter.pop)
+def translatePop(instruction, k):
+    register = instruction.operands[0].value
+    return ["stack_top = registers[%d]" % RSP,
+            writeRegister(register, "_load(stack_top, %d)" % register.size),
+            "registers[%d] = (stack_top + 8) & %d" % (RSP, MAX_64BIT_UNSIGNED_INT)]
+
+
+@register_translator(interpreter.add)
+def translateAdd(instruction, k):
+    destination, source = instruction.operands
+    value = readValue(source)
+    if value is None:
+        return None
+    return [writeRegister(destination.value, "%s + %s" % (readRegister(destination.value), value))]
+
+
+@register_translator(interpreter.sub)
+def translateSub(instruction, k):
+    destination, source = instruction.operands
+    value = readValue(source)
+    if value is None:
+        return None
+    return [writeRegister(destination.value, "%s - %s" % (readRegister(destination.value), value))]
+
+
+@register_translator(interpreter.cmp)
+def translateCmp(instruction, k):
+    operand1, operand2 = instruction.operands
+    value1 = readValue(operand1)
+    value2 = readValue(operand2)
+    if value1 is None or value2 is None:
+        return None
+    return ["registers[%d] = %s - %s" % (FLAGS, value1, value2)]
+
+
+@register_translator(interpreter.sete)
+def translateSete(instruction, k):
+    return [writeRegister(instruction.operands[0].value, "1 if isEqual(registers) else 0")]
+
+
+@register_translator(interpreter.setne)
+def translateSetne(instruction, k):
+    return [writeRegister(instruction.operands[0].value, "0 if isEqual(registers) else 1")]
+
+
+@register_translator(interpreter.setl)
+def translateSetl(instruction, k):
+    return [writeRegister(instruction.operands[0].value, "1 if isLess(registers) else 0")]
+
+
+@register_translator(interpreter.setle)
+def translateSetle(instruction, k):
+    return [writeRegister(instruction.operands[0].value, "1 if isLessEqual(registers) else 0")]
+
+
+@register_translator(interpreter.movzb)
+def translateMovzb(instruction, k):
+    destination, source = instruction.operands
+    value = readValue(source)
+    if value is None:
+        return None
+    return [writeRegister(destination.value, value)]
+
+
+def translateExtend(instruction, k, default_size):
+    destination, source = instruction.operands
+    if source.mode == AddressingMode.MEMORY:
+        value = "_load(_m%d(registers), %d)" % (k, source.value.size or default_size)
+    else:
+        value = readValue(source)
+        if value is None:
+            return None
+    return [writeRegister(destination.value, value)]
+
+
+@register_translator(interpreter.movsx)
+def translateMovsx(instruction, k):
+    return translateExtend(instruction, k, 1)
+
+
+@register_translator(interpreter.movsxd)
+def translateMovsxd(instruction, k):
+    return translateExtend(instruction, k, 4)
+
+
+@register_translator(interpreter.mov)
+def translateMov(instruction, k):
+    destination, source = instruction.operands
+    if destination.is_register:
+        register = destination.value
+        if source.mode == AddressingMode.MEMORY:
+            value = "_load(_m%d(registers), %d)" % (k, register.size)
+        else:
+            value = readValue(source)
+            if value is None:
+                return None
+        return [writeRegister(register, value)]
+    register = source.value
+    return ["_store(_m%d(registers), %s, %d)" % (k, readRegister(register), register.size)]
+
+
+@register_translator(interpreter.lea)
+def translateLea(instruction, k):
+    destination, source = instruction.operands
+    return [writeRegister(destination.value, "_m%d(registers)" % k)]
+
+
+@register_translator(interpreter.jmp)
+def translateJmp(instruction, k):
+    return ["machine.index = %d" % instruction.target]
+
+
+@register_translator(interpreter.jne)
+def translateJne(instruction, k):
+    return ["cmp_result = registers[%d]" % FLAGS,
+            "if cmp_result != 0 and (cmp_result is not None or registers[%d] == 0):" % ZF,
+            "    machine.index = %d" % instruction.target]
+
+
+@register_translator(interpreter.je)
+def translateJe(instruction, k):
+    return ["cmp_result = registers[%d]" % FLAGS,
+            "if cmp_result == 0 or cmp_result is None and registers[%d] == 1:" % ZF,
+            "    machine.index = %d" % instruction.target]
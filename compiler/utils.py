@@ -146,12 +146,10 @@ def save_node_result(node):
 tokenize_result = ""
 
 
-def save_tokenize_result(token):
+def save_tokenize_result(stream):
     global tokenize_result
-    tokenize_result = ""
-    while token.next is not None:
-        tokenize_result += str(token.kind) + " " + str(token.str) + "\n"
-        token = token.next
+    # 不含结尾的EOF
+    tokenize_result = "".join(str(token.kind) + " " + str(token.str) + "\n" for token in stream.tokens[:-1])
 
 
 # 前序遍历输出node，用于调试
@@ -101,6 +101,7 @@ class Window(FramelessWindow):
             self.comm.beforeCut.connect(self.cutManager.cut)
 
             self.comm.onActiveFileChange[str].connect(self.dataTraveler.changeActiveFileContent)
+            self.comm.onActiveFileEdit.connect(self.compileController.edit)
             self.comm.onActiveCompileFileChange[str].connect(self.dataTraveler.changeActiveCompileFileContent)
 
             self.comm.beforeCompile.connect(
@@ -1,40 +1,54 @@
 from qfluentwidgets import MessageBox
 
-from compiler import interpreter, tokenize, codegen, parse, utils
+from compiler import driver, interpreter, objfile, tokenize, utils
+
+# 反复运行同一段汇编代码时跳过装载
+load_cache = objfile.LoadCache()
 
 
 class CompileController:
     def __init__(self, parent):
         self.parent = parent
+        # 随编辑器的每次编辑增量更新的词法分析结果，编辑失败时置为None，编译时重新分析
+        self.stream = None
+
+    def edit(self, offset, removed, inserted):
+        """
+        编辑器中的源代码被编辑：自offset起的removed个字符替换为inserted
+        """
+        if self.stream is None:
+            return
+        try:
+            self.stream.edit(offset, removed, inserted)
+        except Exception:
+            self.stream = None  # 编辑中途的代码可能无法通过词法分析
 
     def compile(self, code):
-        tokenize.token = tokenize.tokenize(code)
+        if self.stream is None or self.stream.source != code:
+            self.stream = tokenize.tokenize(code)
+        self.stream.settle()
+        compiler = driver.Compiler()
 
-        utils.save_tokenize_result(tokenize.token)
+        utils.save_tokenize_result(self.stream)
         tokenize_result = utils.tokenize_result
         self.parent.comm.changeTokenizeResult.emit(tokenize_result)
 
-        parse.prog = parse.program()
-        utils.save_parse_result(parse.prog)
+        prog = compiler.parse(self.stream)
+        utils.save_parse_result(prog)
         parse_result = utils.parse_result
         self.parent.comm.changeParseResult.emit(parse_result)
 
-        fn = parse.prog.fns
-        while fn is not None:
-            offset = 0
-            vl = fn.locals
-            while vl is not None:
-                offset += vl.var.ty.size
-                vl.var.offset = offset
-                vl = vl.next
-            fn.stack_size = utils.align_to(offset, 8)
-            fn = fn.next
-        return codegen.codegen(parse.prog)
+        return compiler.codegen()
 
     def run(self, assembly):
-        interpreter.CompileController = self
-        interpreter.run(assembly)
-        return interpreter.output
+        machine = interpreter.Machine(controller=self)
+        load_cache.load(machine, assembly)
+        try:
+            machine.run()
+        finally:
+            interpreter.machine = machine
+            interpreter.output = machine.output
+        return machine.output
 
     def request_input(self):
         userInput = self.parent.showInputMessageBox()
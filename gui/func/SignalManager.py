@@ -13,6 +13,7 @@ class Communicate(QObject):
     afterOpenFile = pyqtSignal(dict)
 
     onActiveFileChange = pyqtSignal(str)
+    onActiveFileEdit = pyqtSignal(int, int, str)
     afterActiveFileChange = pyqtSignal(str)
 
     onActiveCompileFileChange = pyqtSignal(str)
@@ -89,6 +89,9 @@ class CodeEditor(QFrame):
         self.vBoxLayout.addWidget(self.text_edit)
 
         self.text_edit.textChanged.connect(lambda: self.comm.onActiveFileChange.emit(self.text_edit.toPlainText()))
+        self.text_edit.document().contentsChange.connect(
+            lambda position, removed, added: self.comm.onActiveFileEdit.emit(
+                position, removed, self.text_edit.toPlainText()[position:position + added]))
         self.comm.afterActiveFileChange[str].connect(self.changeToActiveFile)
 
         self.comm.afterCreateNewFile[str].connect(self.addTab)
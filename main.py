@@ -4,7 +4,7 @@
     ## 代码结构：
     ---
         - main.py           编译器程序入口
-        - compiler\tokenize.py       词法分析，将源代码转换为链表存储的Token
+        - compiler\tokenize.py       词法分析，将源代码转换为列表存储的Token
         - compiler\parse.py:         语法分析，将Token转换为抽象语法树
         - compiler\codegen.py        语义生成，将抽象语法树转换为汇编代码
         - compiler\simulator.py      汇编代码解释器
@@ -46,15 +46,13 @@ if __name__ == '__main__':
     print(codeToCompile)
     print("======词法分析开始======")
     # 词法分析
-    tokenize.token = tokenize.tokenize(codeToCompile)
+    tokenize.stream = tokenize.tokenize(codeToCompile)
 
     if DEBUG:
         # 输出token，用于调试
         print("======词法分析结果======")
-        token = tokenize.token
-        while token.next is not None:
+        for token in tokenize.stream.tokens[:-1]:
             print(token.kind, token.str)
-            token = token.next
 
     print("======语法分析开始======")
     parse.prog = parse.program()
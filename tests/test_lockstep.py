@@ -0,0 +1,36 @@
+"""
+    锁步批量执行与逐个运行 Machine 的结果比较
+
+    用法（在仓库根目录下执行）：
+        python -m pytest tests
+"""
+import pytest
+
+from compiler import batch, interpreter, lockstep
+
+pytest.importorskip("numpy")
+
+# codegen 对一元负号生成 push None，解释器执行时只移动栈指针、不写入内存
+NEGATE_SOURCE = """
+int main() {
+    int x;
+    read(&x);
+    int y = -x;
+    write(y);
+    return y;
+}
+"""
+
+
+def runMachine(assembly, stdin):
+    machine = interpreter.Machine(stdin=stdin)
+    machine.run(assembly)
+    return machine.output
+
+
+def testNegateMatchesMachine():
+    assembly = batch.compileSource(NEGATE_SOURCE)
+    inputs = [['3'], ['4'], ['0'], ['123']]
+    result = lockstep.run(assembly, inputs)
+    assert result.errors == [None] * len(inputs)
+    assert result.outputs == [runMachine(assembly, stdin) for stdin in inputs]
@@ -0,0 +1,74 @@
+"""
+    本机后端与解释器的交叉检查
+
+    用法（在仓库根目录下执行）：
+        python -m pytest tests
+"""
+import pytest
+
+from compiler import batch, native
+
+pytestmark = pytest.mark.skipif(not native.available(), reason="本机后端需要 x86-64 Linux 与 gcc")
+
+READ_WRITE_SOURCE = """
+int main() {
+    int x;
+    read(&x);
+    write(x);
+    return x;
+}
+"""
+
+# codegen 对一元负号生成 push None，本机改写为 push 0
+NEGATE_SOURCE = """
+int main() {
+    int x;
+    read(&x);
+    int y = -x;
+    write(y);
+    return y;
+}
+"""
+
+# push None 位于执行不到的 continue 之后
+DEAD_NEGATE_SOURCE = """
+int main() {
+    int i;
+    i = 5;
+    while (i > 0) {
+        i = i - 1;
+        if (i == 3) {
+            continue;
+            i *= -2;
+        }
+    }
+    write(i);
+    return 0;
+}
+"""
+
+
+def testReadWriteMatches(tmp_path):
+    code = batch.compileSource(READ_WRITE_SOURCE)
+    check = native.crossCheck(code, ['12'], native.build(code, str(tmp_path)))
+    assert check.matches(), check.report()
+
+
+def testDeadNegateMatches(tmp_path):
+    code = batch.compileSource(DEAD_NEGATE_SOURCE)
+    check = native.crossCheck(code, [], native.build(code, str(tmp_path)))
+    assert check.matches(), check.report()
+
+
+def testNegateZeroMatches(tmp_path):
+    code = batch.compileSource(NEGATE_SOURCE)
+    assert "push None" in code
+    check = native.crossCheck(code, ['0'], native.build(code, str(tmp_path)))
+    assert check.matches(), check.report()
+
+
+def testNegateValue(tmp_path):
+    code = batch.compileSource(NEGATE_SOURCE)
+    result = native.build(code, str(tmp_path)).execute(['4'])
+    assert result.error is None, result.error
+    assert result.output == "%d\nreturn value:%d\n" % (2 ** 64 - 4, 2 ** 64 - 4)